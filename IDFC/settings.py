@@ -27,6 +27,133 @@ dotenv_path = os.path.join(BASE_DIR, '.env')
 load_dotenv(dotenv_path)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Gemini call resilience (see chatbot/gemini_utils.py). Timeouts are in seconds.
+GEMINI_DEFAULT_TIMEOUT = float(os.getenv("GEMINI_DEFAULT_TIMEOUT", "30"))
+GEMINI_STAGE_TIMEOUTS = {
+    "transcription": float(os.getenv("GEMINI_TRANSCRIPTION_TIMEOUT", "60")),
+    "orchestration": float(os.getenv("GEMINI_ORCHESTRATION_TIMEOUT", "15")),
+    "sub_agent": float(os.getenv("GEMINI_SUB_AGENT_TIMEOUT", "20")),
+    "generalist": float(os.getenv("GEMINI_GENERALIST_TIMEOUT", "30")),
+    "finalization": float(os.getenv("GEMINI_FINALIZATION_TIMEOUT", "30")),
+    # Query embedding for knowledge search; falls back to BM25 when exceeded.
+    "embedding": float(os.getenv("GEMINI_EMBEDDING_TIMEOUT", "5")),
+}
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_RETRY_BACKOFF_BASE = float(os.getenv("GEMINI_RETRY_BACKOFF_BASE", "0.5"))
+GEMINI_RETRY_BACKOFF_CAP = float(os.getenv("GEMINI_RETRY_BACKOFF_CAP", "4"))
+# Hedging is off unless a delay is set. The budget allows roughly one hedge per
+# ten calls, with a small burst allowance.
+GEMINI_HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY")) if os.getenv("GEMINI_HEDGE_DELAY") else None
+GEMINI_HEDGE_BUDGET_RATIO = float(os.getenv("GEMINI_HEDGE_BUDGET_RATIO", "0.1"))
+GEMINI_HEDGE_BUDGET_BURST = float(os.getenv("GEMINI_HEDGE_BUDGET_BURST", "3"))
+GEMINI_CALL_POOL_SIZE = int(os.getenv("GEMINI_CALL_POOL_SIZE", "16"))
+# Calls submitted to the pool and not yet finished, including ones whose
+# caller has given up on them. New calls wait for a slot until their deadline.
+GEMINI_MAX_INFLIGHT_CALLS = int(os.getenv("GEMINI_MAX_INFLIGHT_CALLS", "24"))
+
+# Bulkhead and circuit breaker around the model backend. Keep
+# GEMINI_MAX_CONCURRENT_CALLS below the number of worker threads so the REST
+# endpoints always have threads left when Gemini is slow.
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "8"))
+GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL", "4"))
+GEMINI_BULKHEAD_WAIT = float(os.getenv("GEMINI_BULKHEAD_WAIT", "0.5"))
+GEMINI_SHED_RETRY_AFTER = int(os.getenv("GEMINI_SHED_RETRY_AFTER", "5"))
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET_TIMEOUT = float(os.getenv("GEMINI_BREAKER_RESET_TIMEOUT", "30"))
+
+# Batch chat (/api/chat/batch/, staff only, and `manage.py chat_batch`): turns
+# run on a bounded thread pool and wait up to CHAT_BATCH_SLOT_WAIT seconds for a
+# bulkhead slot rather than being shed. Batch and precompute calls together
+# hold at most CHAT_BATCH_MAX_CONCURRENT_CALLS of the GEMINI_MAX_CONCURRENT_CALLS
+# slots, leaving the rest to live chat.
+CHAT_BATCH_MAX_WORKERS = int(os.getenv("CHAT_BATCH_MAX_WORKERS", "4"))
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "50"))
+CHAT_BATCH_SLOT_WAIT = float(os.getenv("CHAT_BATCH_SLOT_WAIT", "30"))
+CHAT_BATCH_MAX_CONCURRENT_CALLS = int(os.getenv("CHAT_BATCH_MAX_CONCURRENT_CALLS", "2"))
+
+# Sticky routing: a short follow-up in the same chat session goes straight to
+# the previous specialist agent, skipping the orchestrator call.
+STICKY_ROUTING_ENABLED = os.getenv("STICKY_ROUTING_ENABLED", "True") == "True"
+ROUTING_STATE_TTL = int(os.getenv("ROUTING_STATE_TTL", "1800"))
+FOLLOW_UP_MAX_WORDS = int(os.getenv("FOLLOW_UP_MAX_WORDS", "12"))
+CHAT_SESSION_COOKIE = "chat_session_id"
+
+# Single-flight: concurrent identical text turns without history share one
+# pipeline run (see chatbot/coalescing.py). Waiting turns give up and run on
+# their own after CHAT_COALESCE_WAIT seconds.
+CHAT_COALESCING_ENABLED = os.getenv("CHAT_COALESCING_ENABLED", "True") == "True"
+CHAT_COALESCE_WAIT = float(os.getenv("CHAT_COALESCE_WAIT", "60"))
+
+# Precomputed turns for SuggestedPrompt rows (see chatbot/precompute.py).
+# Stored answers are served only to turns using PRECOMPUTE_MODEL.
+PRECOMPUTED_ANSWERS_ENABLED = os.getenv("PRECOMPUTED_ANSWERS_ENABLED", "True") == "True"
+PRECOMPUTE_ON_SAVE = os.getenv("PRECOMPUTE_ON_SAVE", "True") == "True"
+PRECOMPUTE_MODEL = os.getenv("PRECOMPUTE_MODEL", "gemini-2.5-pro")
+
+# Tool plans: a sub-agent may plan up to MAX_TOOL_CALLS_PER_TURN calls; runs of
+# read-only calls execute concurrently on a shared pool of TOOL_POOL_SIZE threads.
+MAX_TOOL_CALLS_PER_TURN = int(os.getenv("MAX_TOOL_CALLS_PER_TURN", "4"))
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL_SIZE", "8"))
+# Seconds a tool call may run before the turn gives up on it and the database
+# interrupts its queries. Per-tool overrides come from TOOL_TIMEOUTS, e.g.
+# TOOL_TIMEOUTS="search_knowledge_base=10,update_card_transaction_limits=3".
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", "5"))
+TOOL_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, _, seconds in (
+        item.partition("=") for item in os.getenv("TOOL_TIMEOUTS", "").split(",") if "=" in item
+    )
+}
+
+# Prompt size per pipeline stage, in estimated tokens (see chatbot/prompts.py).
+# Override per stage with e.g. PROMPT_TOKEN_BUDGETS="finalization=4000,orchestration=1500".
+PROMPT_DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_DEFAULT_TOKEN_BUDGET", "3000"))
+PROMPT_TOKEN_BUDGETS = {
+    "orchestration": 2000,
+    "sub_agent": 3000,
+    "finalization": 3000,
+    "generalist": 1500,
+    **{
+        stage.strip(): int(tokens)
+        for stage, _, tokens in (
+            item.partition("=") for item in os.getenv("PROMPT_TOKEN_BUDGETS", "").split(",") if "=" in item
+        )
+    },
+}
+
+# Knowledge base retrieval (see chatbot/retrieval.py)
+KNOWLEDGE_CHUNK_WORDS = int(os.getenv("KNOWLEDGE_CHUNK_WORDS", "120"))
+KNOWLEDGE_CHUNK_OVERLAP = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP", "20"))
+KNOWLEDGE_SEARCH_TOP_K = int(os.getenv("KNOWLEDGE_SEARCH_TOP_K", "4"))
+KNOWLEDGE_EMBEDDING_MODEL = os.getenv("KNOWLEDGE_EMBEDDING_MODEL", "models/text-embedding-004")
+KNOWLEDGE_EMBEDDINGS_DIR = os.getenv("KNOWLEDGE_EMBEDDINGS_DIR", BASE_DIR / "knowledge_index")
+
+# Opt-in keyset pagination for /api/transactions/ (?page_size= / ?cursor=, see chatbot/pagination.py)
+TRANSACTION_PAGE_SIZE = int(os.getenv("TRANSACTION_PAGE_SIZE", "50"))
+TRANSACTION_MAX_PAGE_SIZE = int(os.getenv("TRANSACTION_MAX_PAGE_SIZE", "500"))
+
+# Transaction merchant search (see chatbot/transaction_search.py)
+TRANSACTION_SEARCH_PAGE_SIZE = int(os.getenv("TRANSACTION_SEARCH_PAGE_SIZE", "20"))
+TRANSACTION_SEARCH_MAX_PAGE_SIZE = int(os.getenv("TRANSACTION_SEARCH_MAX_PAGE_SIZE", "100"))
+# Above this many matches, results are ordered by id (most recently recorded
+# first) instead of by bm25.
+TRANSACTION_SEARCH_RANK_LIMIT = int(os.getenv("TRANSACTION_SEARCH_RANK_LIMIT", "5000"))
+
+# Cache used for tool results and per-model version counters. The default is
+# per process; point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g.
+# django.core.cache.backends.redis.RedisCache) when running several workers so
+# invalidations are seen by all of them.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "idfc-default"),
+    }
+}
+TOOL_CACHE_TIMEOUT = int(os.getenv("TOOL_CACHE_TIMEOUT", "300"))
+# Seconds browsers may reuse read-mostly API responses before revalidating
+# them with If-None-Match (see chatbot/mixins.py).
+API_CACHE_MAX_AGE = int(os.getenv("API_CACHE_MAX_AGE", "60"))
+
 # Email Settings for Notifications
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'  # Or your SMTP server
@@ -57,6 +184,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # FallbackGZipMiddleware handles HTML (with BREACH length masking) and
+    # leaves JSON and the other COMPRESSIBLE_TYPES to CompressionMiddleware.
+    "chatbot.middleware.FallbackGZipMiddleware",
+    "chatbot.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -91,13 +222,104 @@ WSGI_APPLICATION = "IDFC.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE selects SQLite (default) or Postgres. WAL journaling lets readers
+# run alongside a writer; it is stored in the database file, so `migrate`
+# switches it once (migration 0023) rather than every connection. The other
+# pragmas below are set on each new connection: busy_timeout makes writers
+# wait instead of failing with "database is locked", and IMMEDIATE transactions take the write lock up front so two writers never
+# deadlock upgrading from a read lock. Both engines keep connections open for
+# DB_CONN_MAX_AGE seconds.
+DB_ENGINE = os.getenv("DB_ENGINE", "sqlite")
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_PRAGMAS = {
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-32000")), # negative = KiB
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "temp_store": "MEMORY",
+}
+
+if DB_ENGINE == "postgres":
+    POSTGRES_POOL = os.getenv("POSTGRES_POOL", "true").lower() == "true"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "idfc"),
+            "USER": os.getenv("POSTGRES_USER", "idfc"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # Django's psycopg pool replaces persistent connections.
+            "CONN_MAX_AGE": 0 if POSTGRES_POOL else DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+                    "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10")),
+                },
+            } if POSTGRES_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()),
+                "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
     }
+
+
+# REST framework: orjson-backed JSON rendering/parsing (falls back to the
+# stdlib json implementations when orjson is not installed).
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "chatbot.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "chatbot.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    # Proxies in front of the app whose X-Forwarded-For entries are trusted
+    # when identifying clients (rate limits). 0 uses REMOTE_ADDR only.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", "0")),
 }
 
+# Token-bucket rate limits for /api/chat/ and /api/chat/batch/ (see chatbot/throttling.py).
+# "capacity/period_seconds" per "<text|audio>.<client|session|global>" bucket;
+# override any of them with e.g. CHAT_RATE_LIMITS="text.client=60/60,audio.global=30/60".
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() in ("true", "1", "yes")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", BASE_DIR / "ratelimit.sqlite3")
+CHAT_RATE_LIMITS = {
+    "text.client": "30/60",
+    "text.session": "20/60",
+    "text.global": "600/60",
+    "audio.client": "6/60",
+    "audio.session": "6/60",
+    "audio.global": "120/60",
+    **{
+        bucket.strip(): rate.strip()
+        for bucket, _, rate in (
+            item.partition("=") for item in os.getenv("CHAT_RATE_LIMITS", "").split(",") if "=" in item
+        )
+    },
+}
+
+# Response compression (see chatbot/middleware.py)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -139,43 +361,56 @@ STATICFILES_DIRS = [
 ]
 
 # Logging configuration
+# Request threads only enqueue records; a background listener writes JSON lines
+# to django.log (rotated) and plain text to the console. See chatbot/logging_utils.py.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_PAYLOAD_CHARS = int(os.getenv("LOG_MAX_PAYLOAD_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Per-stage levels for the chat pipeline loggers (chatbot.stage.<stage>),
+# e.g. LOG_STAGE_LEVELS="tool=WARNING,finalization=DEBUG".
+LOG_STAGE_LEVELS = {
+    stage.strip(): level.strip().upper()
+    for stage, _, level in (
+        item.partition("=") for item in os.getenv("LOG_STAGE_LEVELS", "").split(",") if "=" in item
+    )
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
-        },
-        'simple': {
-            'format': '{levelname} {message}',
-            'style': '{',
+    'filters': {
+        'payload': {
+            '()': 'chatbot.logging_utils.PayloadFilter',
+            'max_chars': LOG_MAX_PAYLOAD_CHARS,
+            'sample_rate': LOG_PAYLOAD_SAMPLE_RATE,
         },
     },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
-        },
-        'file': {
-            'class': 'logging.handlers.RotatingFileHandler',
+        'queue': {
+            '()': 'chatbot.logging_utils.make_queue_handler',
             'filename': BASE_DIR / 'django.log',
-            'maxBytes': 1024 * 1024 * 5, # 5 MB
-            'backupCount': 5,
-            'formatter': 'verbose',
+            'max_bytes': 1024 * 1024 * 5, # 5 MB
+            'backup_count': 5,
+            'queue_size': LOG_QUEUE_SIZE,
+            'filters': ['payload'],
         },
     },
     'loggers': {
         'chatbot': {
-            'handlers': ['console', 'file'],
-            'level': 'INFO',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'django': {
-            'handlers': ['console', 'file'],
-            'level': 'INFO',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': False,
         },
+        **{
+            f'chatbot.stage.{stage}': {'level': level}
+            for stage, level in LOG_STAGE_LEVELS.items()
+        },
     },
 }
 
@@ -188,5 +423,15 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # see https://help.pythonanywhere.com/pages/DjangoStaticFiles for more info
 MEDIA_ROOT = '/home/IDFCFame5/IDFC/media'
 MEDIA_URL = '/media/'
-STATIC_ROOT = '/home/IDFCFame5/IDFC/static'
+STATIC_ROOT = os.getenv("STATIC_ROOT", '/home/IDFCFame5/IDFC/static')
 STATIC_URL = '/static/'
+
+# collectstatic writes content-hashed copies plus .gz/.br variants (see
+# IDFC/storage.py); IDFC.views.static_asset serves them when
+# SERVE_COLLECTED_STATIC is on (the default when DEBUG is off).
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "IDFC.storage.CompressedManifestStaticFilesStorage"},
+}
+SERVE_COLLECTED_STATIC = os.getenv("SERVE_COLLECTED_STATIC", str(not DEBUG)) == "True"
+STATIC_ASSET_MAX_AGE = int(os.getenv("STATIC_ASSET_MAX_AGE", str(60 * 60 * 24 * 365)))
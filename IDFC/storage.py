@@ -0,0 +1,71 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # Only .gz variants are written.
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = (
+    ".css", ".eot", ".html", ".js", ".json", ".map", ".md", ".svg", ".ttf", ".txt", ".xml",
+)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes `.gz` and `.br` siblings of
+    every compressible file during collectstatic, so IDFC.views.static_asset
+    can send them without compressing anything per request. Compression runs
+    at the highest levels since it happens once per deploy.
+
+    The Vite bundle in static/react is already content-hashed and index.html
+    refers to it by those names, so both the original and the re-hashed copies
+    are kept and compressed.
+    """
+
+    manifest_strict = False
+
+    def stored_name(self, name):
+        # Before the first collectstatic there is no manifest; serve the
+        # unhashed names instead of failing every {% static %} lookup.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed = set()
+        for name, hashed_name, was_processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, was_processed
+            if not isinstance(was_processed, Exception):
+                processed.update(n for n in (name, hashed_name) if n)
+
+        if dry_run:
+            return
+        for name in sorted(processed):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                for variant in self._write_compressed(name):
+                    yield name, variant, True
+
+    def _write_compressed(self, name):
+        path = self.path(name)
+        with open(path, "rb") as f:
+            content = f.read()
+        if len(content) < settings.COMPRESSION_MIN_SIZE:
+            return
+
+        variants = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in variants:
+            compressed = compress(content)
+            if len(compressed) >= len(content):
+                continue
+            tmp_path = f"{path}{suffix}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path + suffix)
+            yield name + suffix
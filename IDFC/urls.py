@@ -16,7 +16,8 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from django.views.generic.base import RedirectView # Import RedirectView
 from . import views
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
@@ -33,4 +34,12 @@ urlpatterns = [
     path('api/', include('chatbot.urls')),
 ]
 
-urlpatterns += staticfiles_urlpatterns()
+if not settings.SERVE_COLLECTED_STATIC:
+    # Development: serve straight from STATICFILES_DIRS and app static folders.
+    urlpatterns += staticfiles_urlpatterns()
+else:
+    # Production: serve collectstatic output with precompressed variants and
+    # long-lived caching for hashed files.
+    urlpatterns += [
+        re_path(rf"^{settings.STATIC_URL.lstrip('/')}(?P<path>.*)$", views.static_asset, name='static_asset'),
+    ]
@@ -1,4 +1,89 @@
-from django.shortcuts import render
+import functools
+import hashlib
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.template.loader import render_to_string
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.static import was_modified_since
+
+from chatbot.middleware import parse_accept_encoding
+
+# Vite writes content-hashed bundle files into this directory of static/react.
+VITE_ASSETS_PREFIX = "assets/"
+PRECOMPRESSED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+
+@functools.cache
+def _index_shell():
+    # index.html has no per-request content, so it is rendered once per process.
+    body = render_to_string('index.html').encode('utf-8')
+    return body, quote_etag(hashlib.sha1(body).hexdigest())
+
 
 def index(request):
-    return render(request, 'index.html')
+    if settings.DEBUG:
+        _index_shell.cache_clear()
+    body, etag = _index_shell()
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='text/html; charset=utf-8')
+    response['ETag'] = etag
+    # The shell names the current bundle hashes, so it must always revalidate.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@functools.cache
+def _hashed_names():
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def _is_immutable(path):
+    return path.startswith(VITE_ASSETS_PREFIX) or path in _hashed_names()
+
+
+def static_asset(request, path):
+    """
+    Serves a file from STATIC_ROOT, preferring the .br/.gz variant written by
+    collectstatic when the client accepts it. Content-hashed files are cached
+    for STATIC_ASSET_MAX_AGE and marked immutable; anything else revalidates.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(fullpath):
+        raise Http404(f"'{path}' does not exist")
+
+    served_path, encoding = fullpath, None
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for coding, suffix in PRECOMPRESSED_VARIANTS:
+        if coding in accepted and os.path.isfile(fullpath + suffix):
+            served_path, encoding = fullpath + suffix, coding
+            break
+
+    stat = os.stat(served_path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(fullpath)
+        response = FileResponse(open(served_path, 'rb'), content_type=content_type or 'application/octet-stream')
+        # FileResponse adds "inline; filename=<name>.br" from the open file,
+        # which is wrong for the variants and pointless for page assets.
+        del response['Content-Disposition']
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if _is_immutable(path):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_ASSET_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -32,6 +32,16 @@ admin.site.register(Instruction)
 admin.site.register(ChatMessage)
 admin.site.register(UserNotificationSettings)
 admin.site.register(UserSecuritySettings)
-admin.site.register(DebitCardSettings)
-admin.site.register(CreditCardSettings)
+
+
+# __str__ of the card settings models reads the related account/card, so the
+# changelists join it in instead of issuing one query per row.
+@admin.register(DebitCardSettings)
+class DebitCardSettingsAdmin(admin.ModelAdmin):
+    list_select_related = ('account',)
+
+
+@admin.register(CreditCardSettings)
+class CreditCardSettingsAdmin(admin.ModelAdmin):
+    list_select_related = ('credit_card',)
 
@@ -0,0 +1,89 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ModelVersion
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# === PER-MODEL VERSIONS =======================================================
+# ==============================================================================
+# Stored in the ModelVersion table rather than in Django's cache, which is per
+# process by default: a change made through one worker must invalidate cached
+# tool results and HTTP validators in every worker.
+
+def get_shared_versions(*models):
+    """
+    Returns ([version per model, in order], latest modification as epoch
+    seconds or None) from the ModelVersion table.
+    """
+    labels = [m._meta.label_lower for m in models]
+    rows = {row.label: row for row in ModelVersion.objects.filter(label__in=labels)}
+    versions = [rows[label].version if label in rows else 0 for label in labels]
+    modified = [int(row.modified_at.timestamp()) for row in rows.values()]
+    return versions, max(modified, default=None)
+
+
+def bump_model_version(model):
+    """
+    Bumps `model`'s ModelVersion row, creating it on first use. Invalidates
+    cached tool results and HTTP validators derived from it. Called from signals.
+    """
+    label = model._meta.label_lower
+    bumped = ModelVersion.objects.filter(label=label).update(version=F("version") + 1, modified_at=timezone.now())
+    if not bumped:
+        _, created = ModelVersion.objects.get_or_create(label=label, defaults={"version": 1})
+        if not created:
+            # Another worker created the row first; still count this change.
+            ModelVersion.objects.filter(label=label).update(version=F("version") + 1, modified_at=timezone.now())
+
+
+# ==============================================================================
+# === TOOL RESULT CACHE ========================================================
+# ==============================================================================
+
+def cached_tool(*models):
+    """
+    Read-through cache for a tool, keyed by tool name, call arguments and the
+    version of every model the tool reads. Saving or deleting a row of any of
+    those models bumps its shared version (see chatbot/signals.py), so no worker
+    serves a stale entry; TOOL_CACHE_TIMEOUT only bounds how long unused ones live.
+    A hit still costs one query, for the versions.
+    Error strings returned by a tool are not cached.
+
+    Writes that send no signals (QuerySet.update(), bulk_create(), bulk_update(),
+    raw SQL) do not bump the version; call bump_model_version() after them.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = json.dumps(bound.arguments, sort_keys=True, default=str)
+            versions = ".".join(str(v) for v in get_shared_versions(*models)[0])
+            digest = hashlib.sha1(f"{arguments}|{versions}".encode("utf-8")).hexdigest()
+            key = f"tool-result:{func.__name__}:{digest}"
+
+            result = cache.get(key)
+            if result is not None:
+                logger.debug(f"Tool cache hit for '{func.__name__}' with arguments {arguments}")
+                return result
+
+            result = func(*args, **kwargs)
+            if not (isinstance(result, str) and result.startswith("Error")):
+                cache.set(key, result, timeout=settings.TOOL_CACHE_TIMEOUT)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,188 @@
+"""
+Single-flight coalescing of identical chat turns.
+
+When many people tap the same suggested prompt at once, every request would
+run the full orchestrator/sub-agent/finalizer pipeline. Instead, concurrent
+turns with the same normalized message and model (and no history) wait for the
+first one and share its answer, so a burst of identical requests costs one set
+of Gemini calls and takes bulkhead slots only for those calls.
+
+A turn is only shared when its answer cannot depend on who asked:
+- it has no history, and is not a follow-up in its session (sticky routing);
+- the shared computation runs without session context;
+- the answer came from the Generalist or only from KNOWLEDGE_TOOLS. For any
+  other plan (account data, or a tool that changes data) waiting turns run
+  their own turn, so account answers are read and actions carried out for the
+  request that asked for them. They are handed the plan as soon as the first
+  turn has made it, before any tool runs, and skip orchestration and planning,
+  so they finish about when the first turn does instead of after it.
+Every waiting turn that reuses an answer still sends its own notification email.
+
+Coalescing is per process; identical requests that land on different workers
+still run once per worker.
+"""
+import hashlib
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .gemini_utils import normalize_model_name
+from .pipeline import AGENTS, notify_shared_turn, run_chat_turn
+from .routing import get_routing_state, is_follow_up, save_routing_state
+from .text_utils import normalize_message
+from .tools import KNOWLEDGE_TOOLS
+
+logger = logging.getLogger(__name__)
+
+
+class CoalesceWaitTimeout(Exception):
+    """Raised by SingleFlight.do when a waiting caller gives up on the in-flight run."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one `fn` per key at a time. Callers that arrive while it runs
+    wait for it and get the same return value (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Returns (value, shared); `shared` is True for callers that reused
+        another caller's run. A follower that waits longer than `timeout`
+        seconds raises CoalesceWaitTimeout; errors raised by `fn` itself,
+        including TimeoutError, reach every caller unchanged.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if leader:
+            try:
+                value = fn()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, value=value)
+            return value, False
+
+        if not call.done.wait(timeout):
+            raise CoalesceWaitTimeout(f"Timed out waiting for in-flight call {key}.")
+        if call.error is not None:
+            raise call.error
+        return call.value, True
+
+    def release(self, key, value):
+        """
+        Called from inside the running `fn` to give its waiting callers `value`
+        now, instead of its return value later. Callers arriving after this
+        start a new run.
+        """
+        with self._lock:
+            call = self._calls.pop(key, None)
+            if call is not None:
+                call.value = value
+                call.done.set()
+
+    def _finish(self, key, call, value=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if call.done.is_set():
+                return  # waiting callers were released early
+            call.value, call.error = value, error
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+chat_flight = SingleFlight()
+
+
+def coalesce_key(user_message, selected_model):
+    # The sub-agent prompt includes today's date, so that is part of the context.
+    raw = f"{normalize_model_name(selected_model)}|{timezone.localdate().isoformat()}|{normalize_message(user_message)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PlanHandOff:
+    """What waiting turns get instead of an answer when the first turn's plan is not shareable."""
+
+    def __init__(self, plan):
+        self.plan = plan
+
+
+def is_shareable(result):
+    """
+    True when the answer depends on neither account data nor an action:
+    Generalist replies and knowledge lookups. Also takes a plan
+    ({"agent", "tool_calls"}).
+    """
+    if result["agent"] == "Generalist":
+        return True
+    return bool(result["tool_calls"]) and all(call["tool_name"] in KNOWLEDGE_TOOLS for call in result["tool_calls"])
+
+
+def run_chat_turn_coalesced(user_message, selected_model, request_id, session_id=None, input_type='text'):
+    """
+    run_chat_turn for a turn without history, sharing the work with identical
+    turns already in flight. The result has `coalesced` set when it was
+    produced by another request.
+    """
+    def run_own_turn(plan=None):
+        return dict(run_chat_turn(user_message, [], selected_model, request_id, input_type=input_type,
+                                  session_id=session_id, plan=plan), coalesced=False)
+
+    if not settings.CHAT_COALESCING_ENABLED or is_follow_up(user_message, get_routing_state(session_id)):
+        return run_own_turn()
+
+    key = coalesce_key(user_message, selected_model)
+
+    def hand_off_unshareable_plan(plan):
+        if not is_shareable(plan):
+            chat_flight.release(key, PlanHandOff(plan))
+
+    def run_shared_turn():
+        return run_chat_turn(user_message, [], selected_model, request_id, input_type=input_type,
+                             on_plan=hand_off_unshareable_plan)
+
+    try:
+        result, shared = chat_flight.do(key, run_shared_turn, timeout=settings.CHAT_COALESCE_WAIT)
+    except CoalesceWaitTimeout:
+        logger.warning(f"[{request_id}] Gave up waiting for an identical in-flight turn; running it separately.")
+        return run_own_turn()
+
+    if isinstance(result, PlanHandOff):
+        logger.info(f"[{request_id}] Identical in-flight turn needs account data or an action; running this turn with its plan.")
+        return run_own_turn(plan=result.plan)
+    if shared and not is_shareable(result):
+        logger.info(f"[{request_id}] Answer of the identical in-flight turn cannot be shared; running this turn separately.")
+        return run_own_turn()
+    if shared:
+        logger.info(f"[{request_id}] Reused the answer of an identical in-flight turn.")
+        notify_shared_turn(user_message, result, request_id, input_type=input_type)
+
+    # The shared turn ran without a session, so remember the routing decision
+    # for this caller's session here.
+    if result["agent"] in AGENTS:
+        save_routing_state(session_id, result["agent"], result["tool"], result["arguments"])
+    return dict(result, coalesced=shared)
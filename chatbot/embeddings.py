@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .gemini_utils import embed_content
+from .lazy_imports import LazyModule, get_genai, get_numpy
+from .models import ChatbotKnowledge
+from .retrieval import chunk_text, get_knowledge_index
+
+logger = logging.getLogger(__name__)
+
+np = LazyModule(get_numpy)
+
+
+def content_hash(entry):
+    return hashlib.sha1(f"{entry.title}\n{entry.knowledge_text}".encode("utf-8")).hexdigest()
+
+
+def embed_texts(texts, task_type):
+    """
+    Embeds a batch of texts with Gemini and returns a float32 (n, dim) matrix.
+    Only used by background syncs; see embed_query() for the request path.
+    """
+    genai = get_genai()
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    result = genai.embed_content(
+        model=settings.KNOWLEDGE_EMBEDDING_MODEL,
+        content=texts,
+        task_type=task_type,
+    )
+    return np.asarray(result["embedding"], dtype=np.float32).reshape(len(texts), -1)
+
+
+def embed_query(query):
+    """Embeds one search query through the Gemini deadline, circuit breaker and bulkhead."""
+    result = embed_content(settings.KNOWLEDGE_EMBEDDING_MODEL, [query], task_type="retrieval_query")
+    return np.asarray(result["embedding"], dtype=np.float32).reshape(1, -1)[0]
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class KnowledgeEmbeddingIndex:
+    """
+    Passage-level embedding index over ChatbotKnowledge.
+
+    Vectors are L2-normalised and kept as one contiguous float32 matrix, so a
+    query is a single matrix-vector product. The matrix, the (entry_id,
+    passage_no) key of each row and a content hash per entry are persisted
+    together in one .npz file under KNOWLEDGE_EMBEDDINGS_DIR. The file is
+    replaced atomically, so another process reloading it after a change
+    always sees vectors, keys and hashes from the same save.
+    """
+
+    INDEX_FILE = "knowledge_index.npz"
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.keys = np.zeros((0, 2), dtype=np.int64)
+        self.hashes = {}
+        self._loaded_mtime = None
+        self._lock = threading.RLock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        with self._lock:
+            mtime = self._file_mtime()
+            if mtime is None:
+                return False
+            with np.load(self.path) as data:
+                self.vectors = data["vectors"]
+                self.keys = data["keys"]
+                self.hashes = dict(zip(data["hash_ids"].tolist(), data["hash_values"].tolist()))
+            self._loaded_mtime = mtime
+            return True
+
+    def reload_if_changed(self):
+        if self._file_mtime() != self._loaded_mtime:
+            self.load()
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f, vectors=self.vectors, keys=self.keys,
+                    hash_ids=np.asarray(list(self.hashes), dtype=np.int64),
+                    hash_values=np.asarray(list(self.hashes.values()), dtype="U40"),
+                )
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = self._file_mtime()
+
+    def _without_entries(self, entry_ids):
+        keep = ~np.isin(self.keys[:, 0], list(entry_ids))
+        return self.vectors[keep], self.keys[keep]
+
+    def upsert_entries(self, entries):
+        """
+        Re-embeds the given entries (if their content changed) and persists.
+        The embedding call runs without holding the lock, so searches are not
+        blocked behind it; callers serialise updates (see sync_embeddings).
+        """
+        changed = [e for e in entries if self.hashes.get(e.pk) != content_hash(e)]
+        if not changed:
+            return
+        new_keys, passages = [], []
+        for entry in changed:
+            for n, passage in enumerate(chunk_text(entry.knowledge_text)):
+                new_keys.append((entry.pk, n))
+                passages.append(f"{entry.title}\n{passage}")
+        new_vectors = _normalize(embed_texts(passages, task_type="retrieval_document")) if passages else None
+
+        with self._lock:
+            vectors, keys = self._without_entries(e.pk for e in changed)
+            if new_vectors is not None:
+                vectors = new_vectors if vectors.shape[0] == 0 else np.vstack([vectors, new_vectors])
+                keys = np.vstack([keys, np.asarray(new_keys, dtype=np.int64)])
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self.keys = keys
+            for entry in changed:
+                self.hashes[entry.pk] = content_hash(entry)
+            self.save()
+        logger.info(f"Embedded {len(passages)} passage(s) from {len(changed)} knowledge entr(y/ies).")
+
+    def remove_entries(self, entry_ids):
+        with self._lock:
+            entry_ids = [i for i in entry_ids if i in self.hashes]
+            if not entry_ids:
+                return
+            vectors, keys = self._without_entries(entry_ids)
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self.keys = keys
+            for entry_id in entry_ids:
+                self.hashes.pop(entry_id, None)
+            self.save()
+
+    def search_vector(self, query_vector, top_k=5):
+        """Returns up to `top_k` ((entry_id, passage_no), score) pairs by cosine similarity."""
+        with self._lock:
+            vectors, keys = self.vectors, self.keys
+        if vectors.shape[0] == 0:
+            return []
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        scores = vectors @ query_vector.astype(np.float32)
+        top_k = min(top_k, scores.shape[0])
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [((int(keys[i, 0]), int(keys[i, 1])), float(scores[i])) for i in best]
+
+
+_index = None
+_index_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+# Embedding after a save runs here, so the save does not wait for Gemini.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="knowledge-embed")
+
+
+def get_embedding_index():
+    """
+    Returns the process-wide embedding index, loaded from disk and reloaded
+    when another process has saved a newer file. It never embeds anything, so
+    the chat request path only pays for the query embedding; entries are
+    embedded by sync_embeddings().
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = KnowledgeEmbeddingIndex(settings.KNOWLEDGE_EMBEDDINGS_DIR)
+            _index.load()
+        else:
+            _index.reload_if_changed()
+        return _index
+
+
+def sync_embeddings():
+    """
+    Brings the index file in line with the database: drops vectors of deleted
+    entries and embeds new or edited ones (by content hash, so unchanged
+    entries cost nothing). Runs after every ChatbotKnowledge change and from
+    `manage.py sync_knowledge_embeddings`; an entry whose embedding failed is
+    retried by the next sync.
+    """
+    with _sync_lock:
+        index = get_embedding_index()
+        entries = list(ChatbotKnowledge.objects.all())
+        live_ids = {e.pk for e in entries}
+        index.remove_entries([i for i in index.hashes if i not in live_ids])
+        index.upsert_entries(entries)
+        return index
+
+
+def _sync_in_background():
+    try:
+        sync_embeddings()
+    except Exception:
+        logger.exception("Failed to sync knowledge embeddings; the next sync retries.")
+    finally:
+        connections.close_all()
+
+
+def schedule_embedding_sync():
+    """Syncs the embedding index in the background once the current transaction commits."""
+    if not settings.GEMINI_API_KEY:
+        return
+    transaction.on_commit(lambda: _executor.submit(_sync_in_background))
+
+
+def search_knowledge(query, top_k=5):
+    """
+    Returns up to `top_k` (score, title, passage) tuples for the query. If the
+    query cannot be embedded (Gemini down, slow or shed), falls back to the
+    BM25 keyword index (see chatbot/retrieval.py).
+    """
+    index = get_embedding_index()
+    if index.vectors.shape[0] == 0:
+        return []
+    try:
+        query_vector = embed_query(query)
+    except Exception as e:
+        logger.warning(f"Could not embed knowledge query ({e}); falling back to keyword search.")
+        return get_knowledge_index().search(query, top_k=top_k)
+    hits = index.search_vector(query_vector, top_k=top_k)
+    entries = ChatbotKnowledge.objects.in_bulk({entry_id for (entry_id, _), _ in hits})
+
+    results = []
+    for (entry_id, passage_no), score in hits:
+        entry = entries.get(entry_id)
+        if entry is None:
+            continue
+        passages = chunk_text(entry.knowledge_text)
+        if passage_no < len(passages):
+            results.append((score, entry.title, passages[passage_no]))
+    return results
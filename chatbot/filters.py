@@ -0,0 +1,92 @@
+"""
+Server-side transaction filtering, shared by TransactionViewSet (through
+TransactionFilterBackend) and the list_recent_transactions tool so both accept
+the same parameters with the same meaning:
+
+- date_from / date_to: ISO dates, inclusive.
+- amount_min / amount_max: inclusive.
+- category, method, transaction_type: one value or a comma-separated list.
+
+Every condition becomes a WHERE clause; the (category|method|transaction_type,
+date) and (date, id) indexes on Transaction serve the common combinations.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Transaction
+
+CHOICE_FILTERS = {
+    "category": Transaction.CATEGORY_CHOICES,
+    "method": Transaction.METHOD_CHOICES,
+    "transaction_type": Transaction.TRANSACTION_TYPES,
+}
+TRANSACTION_FILTER_PARAMS = ("date_from", "date_to", "amount_min", "amount_max", *CHOICE_FILTERS)
+
+
+class TransactionFilterError(ValueError):
+    """Raised for a filter value that cannot be parsed or is not a valid choice."""
+
+
+def _parse_date(name, value):
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        raise TransactionFilterError(f"'{name}' must be a date in YYYY-MM-DD format, got '{value}'.")
+
+
+def _parse_amount(name, value):
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise TransactionFilterError(f"'{name}' must be a number, got '{value}'.")
+
+
+def _parse_choices(name, value):
+    # Match choices case-insensitively so "food" and "upi" work from chat.
+    valid = {choice.lower(): choice for choice, _ in CHOICE_FILTERS[name]}
+    values = [v.strip() for v in str(value).split(",") if v.strip()]
+    unknown = [v for v in values if v.lower() not in valid]
+    if unknown:
+        raise TransactionFilterError(
+            f"Unknown {name} {', '.join(repr(v) for v in unknown)}; expected one of: {', '.join(valid.values())}."
+        )
+    return [valid[v.lower()] for v in values]
+
+
+def filter_transactions(queryset, params):
+    """
+    Applies the filters present in `params` (any mapping; empty values are
+    ignored) to a Transaction queryset. Raises TransactionFilterError for
+    values that cannot be used.
+    """
+    params = {name: params.get(name) for name in TRANSACTION_FILTER_PARAMS if params.get(name) not in (None, "")}
+    conditions = {}
+    if "date_from" in params:
+        conditions["date__gte"] = _parse_date("date_from", params["date_from"])
+    if "date_to" in params:
+        conditions["date__lte"] = _parse_date("date_to", params["date_to"])
+    if "amount_min" in params:
+        conditions["amount__gte"] = _parse_amount("amount_min", params["amount_min"])
+    if "amount_max" in params:
+        conditions["amount__lte"] = _parse_amount("amount_max", params["amount_max"])
+    for name in CHOICE_FILTERS:
+        if name in params:
+            values = _parse_choices(name, params[name])
+            if len(values) == 1:
+                conditions[name] = values[0]
+            elif values:
+                conditions[f"{name}__in"] = values
+    return queryset.filter(**conditions) if conditions else queryset
+
+
+class TransactionFilterBackend(BaseFilterBackend):
+    """DRF filter backend exposing filter_transactions as query parameters; bad values are a 400."""
+
+    def filter_queryset(self, request, queryset, view):
+        try:
+            return filter_transactions(queryset, request.query_params)
+        except TransactionFilterError as e:
+            raise ValidationError({"error": str(e)})
@@ -0,0 +1,380 @@
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+
+from .lazy_imports import get_genai, get_google_exceptions
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiCallTimeout(Exception):
+    """Raised when a Gemini call does not return within its stage timeout."""
+
+
+class ModelBackendUnavailable(Exception):
+    """
+    Raised when a chat turn is shed, either because the bulkhead is full or
+    because the circuit breaker for the model is open. `retry_after` is the
+    number of seconds the client should wait before trying again.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@functools.cache
+def retryable_exceptions():
+    """
+    Errors worth retrying. generate_content has no side effects, so repeating
+    a call after one of these is always safe. GeminiCallTimeout is not one of
+    them: it means the stage deadline, which all attempts share, has passed.
+    """
+    google_exceptions = get_google_exceptions()
+    return (
+        ConnectionError,
+        TimeoutError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.TooManyRequests,
+    )
+
+# Shared pool the calls run on, so the request thread can stop waiting on a
+# slow response (and fire a hedge) without being blocked inside the SDK.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.GEMINI_CALL_POOL_SIZE,
+    thread_name_prefix="gemini-call",
+)
+
+# A call keeps running on the pool after its caller gave up on it (threads
+# cannot be cancelled), so every submitted call holds one of these until it
+# actually finishes. Abandoned calls therefore count against new ones rather
+# than piling up when the backend is slow.
+_inflight_calls = threading.BoundedSemaphore(settings.GEMINI_MAX_INFLIGHT_CALLS)
+
+
+def _submit_call(call, request_options, wait_for):
+    """Submits one Gemini call to the pool, or returns None if no in-flight slot frees up within `wait_for` seconds."""
+    if not _inflight_calls.acquire(timeout=max(0.0, wait_for)):
+        return None
+    future = _executor.submit(call, request_options=request_options)
+    future.add_done_callback(lambda _: _inflight_calls.release())
+    return future
+
+
+class HedgeBudget:
+    """
+    Caps hedged duplicates to a fraction of primary calls. Every primary call
+    earns `ratio` tokens (up to `burst`) and every hedge spends one, so extra
+    load on the backend stays bounded even when it is slow across the board.
+    """
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+hedge_budget = HedgeBudget(
+    ratio=settings.GEMINI_HEDGE_BUDGET_RATIO,
+    burst=settings.GEMINI_HEDGE_BUDGET_BURST,
+)
+
+
+def normalize_model_name(model_name):
+    """GenerativeModel reports its name as 'models/<name>'; keys use the bare name."""
+    return (model_name or "").replace("models/", "", 1)
+
+
+class CircuitBreaker:
+    """
+    Per-model circuit breaker. After `failure_threshold` consecutive failures
+    the circuit opens and calls fail fast for `reset_timeout` seconds. After
+    that a single probe call is let through (half-open); its outcome either
+    closes the circuit again or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Fails fast while the circuit is open, without claiming the probe slot."""
+        with self._lock:
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if (self.state == self.OPEN and remaining > 0) or (self.state == self.HALF_OPEN and self._probe_in_flight):
+                raise ModelBackendUnavailable(
+                    f"Circuit for model '{self.name}' is open.",
+                    retry_after=max(1, int(remaining) + 1),
+                )
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise ModelBackendUnavailable(
+                f"Circuit for model '{self.name}' is open.",
+                retry_after=max(1, int(remaining) + 1),
+            )
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for model '{self.name}' closed again.")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Lets another probe through after one that ended in a non-transient error."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"Circuit for model '{self.name}' opened after {self._failures} consecutive failure(s).")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model_name):
+    name = normalize_model_name(model_name)
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=settings.GEMINI_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=settings.GEMINI_BREAKER_RESET_TIMEOUT,
+            )
+        return _breakers[name]
+
+
+def check_model_backend(model_name):
+    """Raises ModelBackendUnavailable up front if the model's circuit is open."""
+    get_circuit_breaker(model_name).check()
+
+
+# --- Bulkhead: caps concurrent Gemini calls ---
+# Callers only pass model names that were validated against AIModel (see
+# chatbot/views.py) or KNOWLEDGE_EMBEDDING_MODEL, so the per-model dicts here
+# stay small.
+_process_slots = threading.BoundedSemaphore(settings.GEMINI_MAX_CONCURRENT_CALLS)
+_model_slots = {}
+_model_slots_lock = threading.Lock()
+# Batch and precompute calls also take one of these, so they can never hold
+# more than CHAT_BATCH_MAX_CONCURRENT_CALLS of the process slots above.
+_batch_slots = threading.BoundedSemaphore(settings.CHAT_BATCH_MAX_CONCURRENT_CALLS)
+
+# Slot wait of the batch lane in effect for the current context, if any; see bulkhead_wait().
+_slot_wait = contextvars.ContextVar("gemini_slot_wait", default=None)
+
+
+def _get_model_slots(name):
+    with _model_slots_lock:
+        if name not in _model_slots:
+            _model_slots[name] = threading.BoundedSemaphore(settings.GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL)
+        return _model_slots[name]
+
+
+@contextmanager
+def bulkhead_wait(seconds):
+    """
+    Runs the Gemini calls made inside the block in the batch lane: they wait
+    up to `seconds` for a slot instead of being shed, and at most
+    CHAT_BATCH_MAX_CONCURRENT_CALLS of them hold slots at once, so batch
+    turns and precomputation cannot starve live chat.
+    """
+    token = _slot_wait.set(seconds)
+    try:
+        yield
+    finally:
+        _slot_wait.reset(token)
+
+
+@contextmanager
+def model_backend_slot(model_name, wait=None, deadline=None):
+    """
+    Holds one process-wide and one per-model slot for the duration of one
+    Gemini call (generate_content takes it around each attempt), so tools,
+    emails and other work between the calls of a turn hold no slot. Excess
+    calls are shed after at most GEMINI_BULKHEAD_WAIT seconds (or `wait`,
+    or the bulkhead_wait() in effect, but never past `deadline`) with
+    ModelBackendUnavailable instead of queueing behind a degraded backend and
+    tying up every worker. Inside bulkhead_wait() a batch-lane slot is taken
+    first.
+    """
+    name = normalize_model_name(model_name)
+    model_slots = _get_model_slots(name)
+    batch_wait = _slot_wait.get()
+    if wait is None:
+        wait = batch_wait
+    wait_for = settings.GEMINI_BULKHEAD_WAIT if wait is None else wait
+    give_up_at = time.monotonic() + wait_for
+    if deadline is not None:
+        give_up_at = min(give_up_at, deadline)
+    with ExitStack() as held:
+        for slots, message in (
+            (_batch_slots if batch_wait is not None else None, "Too many concurrent batch Gemini calls."),
+            (_process_slots, "Too many concurrent Gemini calls."),
+            (model_slots, f"Too many concurrent requests for model '{name}'."),
+        ):
+            if slots is None:
+                continue
+            if not slots.acquire(timeout=max(0.0, give_up_at - time.monotonic())):
+                raise ModelBackendUnavailable(message, retry_after=settings.GEMINI_SHED_RETRY_AFTER)
+            held.callback(slots.release)
+        yield
+
+
+def _call_with_hedge(call, deadline, stage, request_id):
+    """
+    Runs one attempt of `call` (a Gemini SDK call taking request_options), which must finish by `deadline`
+    (a time.monotonic() value). If a hedge delay is configured and the first
+    call is still pending when it elapses, a duplicate is fired and whichever
+    returns first wins. Hedges are skipped when no in-flight slot is free.
+    """
+    timeout = deadline - time.monotonic()
+    request_options = {"timeout": timeout}
+    first = _submit_call(call, request_options, timeout)
+    if first is None:
+        raise ModelBackendUnavailable("Too many Gemini calls in flight.", retry_after=settings.GEMINI_SHED_RETRY_AFTER)
+    pending = {first}
+    hedge_budget.record_call()
+
+    hedge_delay = settings.GEMINI_HEDGE_DELAY
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(pending, timeout=hedge_delay)
+        if not done and hedge_budget.try_acquire():
+            hedge = _submit_call(call, {"timeout": deadline - time.monotonic()}, 0)
+            if hedge is not None:
+                logger.info(f"[{request_id}] Gemini '{stage}' call still pending after {hedge_delay}s, firing hedged request.")
+                pending.add(hedge)
+
+    last_error = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+
+    if pending:
+        raise GeminiCallTimeout(f"Gemini '{stage}' call did not finish within its deadline.")
+    raise last_error
+
+
+def generate_content(model, contents, stage, request_id=None):
+    """
+    Drop-in replacement for model.generate_content used by the chat pipeline.
+    The per-stage timeout from settings.GEMINI_STAGE_TIMEOUTS is one deadline
+    for the whole stage: retries of transient failures (full-jitter
+    exponential backoff) and hedges all have to finish within it, and a
+    timeout is not retried. Calls that time out or still fail count towards
+    the model's circuit breaker.
+    """
+    return _call_resilient(
+        getattr(model, "model_name", None),
+        functools.partial(model.generate_content, contents),
+        stage,
+        request_id,
+    )
+
+
+def embed_content(model_name, texts, task_type, stage="embedding", request_id=None):
+    """
+    genai.embed_content for callers on the request path (e.g. embedding a
+    search query), with the same stage deadline, retries, circuit breaker and
+    bulkhead as generate_content. Raises on failure so the caller can fall
+    back to something that does not need Gemini.
+    """
+    genai = get_genai()
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return _call_resilient(
+        model_name,
+        functools.partial(genai.embed_content, model=model_name, content=texts, task_type=task_type),
+        stage,
+        request_id,
+    )
+
+
+def _call_resilient(model_name, call, stage, request_id):
+    timeout = settings.GEMINI_STAGE_TIMEOUTS.get(stage, settings.GEMINI_DEFAULT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    max_retries = settings.GEMINI_MAX_RETRIES
+    breaker = get_circuit_breaker(model_name)
+    breaker.before_call()
+    retryable = retryable_exceptions()
+
+    for attempt in range(max_retries + 1):
+        try:
+            with model_backend_slot(breaker.name, deadline=deadline):
+                response = _call_with_hedge(call, deadline, stage, request_id)
+            breaker.record_success()
+            return response
+        except GeminiCallTimeout:
+            breaker.record_failure()
+            logger.error(f"[{request_id}] Gemini '{stage}' call timed out after {timeout}s ({attempt + 1} attempt(s)).")
+            raise
+        except retryable as e:
+            backoff = min(
+                settings.GEMINI_RETRY_BACKOFF_CAP,
+                settings.GEMINI_RETRY_BACKOFF_BASE * (2 ** attempt),
+            )
+            sleep_for = random.uniform(0, backoff)
+            if attempt == max_retries or time.monotonic() + sleep_for >= deadline:
+                breaker.record_failure()
+                logger.error(f"[{request_id}] Gemini '{stage}' call failed after {attempt + 1} attempt(s): {e}")
+                raise
+            logger.warning(f"[{request_id}] Gemini '{stage}' call failed ({e}), retrying in {sleep_for:.2f}s (attempt {attempt + 2}/{max_retries + 1}).")
+            time.sleep(sleep_for)
+        except Exception:
+            breaker.release_probe()
+            raise
@@ -0,0 +1,48 @@
+"""
+Accessors for heavy third-party modules.
+
+google.generativeai alone takes the better part of a second to import, and
+numpy adds more. Importing them at module level made every worker boot and
+every management command (`migrate`, `createsuperuser`, ...) pay that cost.
+Code that needs one of these calls the accessor at the point of use instead
+(or wraps it in LazyModule); the first call imports the module and later
+calls return it from the cache.
+tests.ImportTimeTests keeps them out of startup.
+"""
+import functools
+
+
+@functools.cache
+def get_genai():
+    import google.generativeai as genai
+    return genai
+
+
+@functools.cache
+def get_google_exceptions():
+    from google.api_core import exceptions
+    return exceptions
+
+
+@functools.cache
+def get_numpy():
+    import numpy
+    return numpy
+
+
+class LazyModule:
+    """
+    Module-level stand-in for a heavy module: `np = LazyModule(get_numpy)`
+    lets code write `np.zeros(...)` as usual, and the import happens on the
+    first attribute access instead of when the importing module loads.
+    """
+
+    def __init__(self, accessor):
+        self._accessor = accessor
+
+    def __getattr__(self, name):
+        return getattr(self._accessor(), name)
+
+
+# Modules that must not be imported while Django starts up.
+HEAVY_MODULES = ("google.generativeai", "google.api_core", "numpy", "crewai", "litellm")
@@ -0,0 +1,178 @@
+"""
+Non-blocking, structured logging.
+
+Request threads only put records on an in-memory queue (StructuredQueueHandler);
+a QueueListener thread formats them and does the file/console I/O, including
+rotation. Records are written to the log file as one JSON object per line.
+PayloadFilter bounds how much of a large message (raw tool output, model
+responses, user messages) is kept, and can sample payload records per request.
+
+This module is imported while Django configures logging, before the app
+registry is ready, so it must not import models or other chatbot modules.
+"""
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import weakref
+import zlib
+
+# Attributes every LogRecord has; anything else on a record came in via `extra`.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def get_stage_logger(stage):
+    """Logger for one pipeline stage; its level is set via LOG_STAGE_LEVELS."""
+    return logging.getLogger(f"chatbot.stage.{stage}")
+
+
+def payload_extra(request_id):
+    """`extra` for records whose message carries a user/model/tool payload."""
+    return {"request_id": str(request_id), "payload": True}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object, including `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "thread": record.thread,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class PayloadFilter(logging.Filter):
+    """
+    Truncates any message longer than `max_chars`, and keeps only a
+    `sample_rate` fraction of payload records (those logged with
+    payload_extra). Sampling is decided per request_id, so a sampled request
+    keeps all of its payloads.
+    """
+
+    def __init__(self, max_chars=2000, sample_rate=1.0):
+        super().__init__()
+        self.max_chars = int(max_chars)
+        self.sample_rate = float(sample_rate)
+
+    def _sampled(self, record):
+        if self.sample_rate >= 1:
+            return True
+        key = str(getattr(record, "request_id", record.getMessage())).encode("utf-8")
+        return (zlib.crc32(key) % 10000) < self.sample_rate * 10000
+
+    def filter(self, record):
+        if getattr(record, "payload", False) and not self._sampled(record):
+            return False
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            record.msg = f"{message[:self.max_chars]}... [truncated {len(message) - self.max_chars} chars]"
+            record.args = None
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the
+    record is dropped and counted, and the count is reported with the next
+    record that gets through.
+    """
+
+    def __init__(self, log_queue, listener):
+        super().__init__(log_queue)
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message now (args may be mutated later by the caller) but
+        # leave the rest of the formatting to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped_records = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+    def close(self):
+        # Called by logging.shutdown() at exit and by dictConfig when it replaces
+        # handlers; stopping the listener flushes whatever is still queued.
+        if self.listener is not None:
+            if self.listener._thread is not None:  # not already stopped
+                self.listener.stop()
+            self.listener = None
+        _queue_handlers.discard(self)
+        super().close()
+
+
+# Open queue handlers, for restarting their listeners in forked workers.
+_queue_handlers = weakref.WeakSet()
+
+
+def _restart_listeners_after_fork():
+    """
+    A forked worker (e.g. a preforking server) inherits the queue handlers but
+    not their listener threads, nor reliably the state of the queue's lock.
+    Every listener that was running in the parent gets a fresh queue and a new
+    thread; one that was stopped stays stopped.
+    """
+    for handler in list(_queue_handlers):
+        listener = handler.listener
+        if listener is None or listener._thread is None or listener._thread.is_alive():
+            continue
+        handler.queue = listener.queue = queue.Queue(maxsize=handler.queue.maxsize)
+        listener._thread = None
+        listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+
+
+def make_queue_handler(filename, max_bytes, backup_count, queue_size=10000, console=True):
+    """
+    Handler factory for LOGGING: a StructuredQueueHandler whose listener writes
+    JSON lines to a RotatingFileHandler and, optionally, plain text to stderr.
+    Filters and the level configured on the handler apply in the calling thread,
+    so dropped records never reach the queue.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True,
+    )
+    file_handler.setFormatter(JSONFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("{levelname} {message}", style="{"))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    handler = StructuredQueueHandler(log_queue, listener)
+    _queue_handlers.add(handler)
+    return handler
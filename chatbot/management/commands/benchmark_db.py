@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.utils import load_backend
+
+# Scratch connections are registered under this alias, one per thread.
+BENCH_ALIAS = "benchmark"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks concurrent SQLite reads and writes on a scratch database, "
+        "through Django connections with the default options and with the "
+        "configured DATABASES['default'] options."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=4, help="Number of writer threads.")
+        parser.add_argument("--readers", type=int, default=4, help="Number of reader threads.")
+        parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each run.")
+        parser.add_argument("--rows", type=int, default=5000, help="Rows to seed before each run.")
+
+    def handle(self, *args, **options):
+        default = settings.DATABASES["default"]
+        if default["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("benchmark_db compares SQLite configurations; DB_ENGINE is not sqlite.")
+        # What Django used before: rollback journal, deferred transactions and
+        # the sqlite3 module's default 5 second busy timeout.
+        baseline = {"database": {**default, "OPTIONS": {}}, "journal_mode": "DELETE"}
+        # The configured connection (pragmas, timeout, IMMEDIATE transactions)
+        # plus the journal mode migration 0023 sets on the real database.
+        tuned = {"database": default, "journal_mode": settings.SQLITE_JOURNAL_MODE}
+        results = {}
+        for label, config in (("default", baseline), ("tuned", tuned)):
+            results[label] = self._run(config, options)
+            r = results[label]
+            self.stdout.write(
+                f"{label:>8}: {r['writes'] / r['elapsed']:>9.0f} writes/s  "
+                f"{r['reads'] / r['elapsed']:>9.0f} reads/s  "
+                f"{r['locked']:>6} 'database is locked' errors"
+            )
+
+        if results["default"]["writes"]:
+            speedup = results["tuned"]["writes"] / results["default"]["writes"]
+            self.stdout.write(self.style.SUCCESS(f"Write throughput change: {speedup:.2f}x"))
+
+    def _connect(self, path, config):
+        """
+        Opens a Django connection with `config`'s settings on the scratch
+        database at `path`, registered for this thread as BENCH_ALIAS so
+        transaction.atomic() begins transactions the way the app does.
+        """
+        wrapper = load_backend(config["database"]["ENGINE"]).DatabaseWrapper(
+            {**config["database"], "NAME": path}, BENCH_ALIAS,
+        )
+        connections[BENCH_ALIAS] = wrapper
+        return wrapper
+
+    def _run(self, config, options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.sqlite3")
+            conn = self._connect(path, config)
+            with conn.cursor() as cursor:
+                cursor.execute(f"PRAGMA journal_mode={config['journal_mode']}")
+                cursor.execute(
+                    "CREATE TABLE txn (id INTEGER PRIMARY KEY, date TEXT, merchant TEXT, amount REAL, category TEXT)"
+                )
+                cursor.executemany(
+                    "INSERT INTO txn (date, merchant, amount, category) VALUES (%s, %s, %s, %s)",
+                    [("2025-01-01", f"Merchant {i % 200}", i * 1.5, "Food") for i in range(options["rows"])],
+                )
+            conn.close()
+
+            counts = {"writes": 0, "reads": 0, "locked": 0}
+            lock = threading.Lock()
+            stop_at = time.monotonic() + options["seconds"]
+
+            def writer():
+                c = self._connect(path, config)
+                while time.monotonic() < stop_at:
+                    try:
+                        with transaction.atomic(using=BENCH_ALIAS), c.cursor() as cursor:
+                            cursor.execute(
+                                "INSERT INTO txn (date, merchant, amount, category) VALUES ('2025-02-01', 'Bench', 1.0, 'Food')"
+                            )
+                            cursor.execute("UPDATE txn SET amount = amount + 1 WHERE id = 1")
+                        with lock:
+                            counts["writes"] += 1
+                    except OperationalError:
+                        with lock:
+                            counts["locked"] += 1
+                c.close()
+
+            def reader():
+                c = self._connect(path, config)
+                while time.monotonic() < stop_at:
+                    try:
+                        with c.cursor() as cursor:
+                            cursor.execute(
+                                "SELECT category, SUM(amount) FROM txn WHERE merchant = 'Merchant 7' GROUP BY category"
+                            )
+                            cursor.fetchall()
+                        with lock:
+                            counts["reads"] += 1
+                    except OperationalError:
+                        with lock:
+                            counts["locked"] += 1
+                c.close()
+
+            threads = [threading.Thread(target=writer) for _ in range(options["writers"])]
+            threads += [threading.Thread(target=reader) for _ in range(options["readers"])]
+            started = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            counts["elapsed"] = time.monotonic() - started
+            return counts
@@ -0,0 +1,59 @@
+import datetime
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from chatbot.models import Transaction
+from chatbot.renderers import ORJSONRenderer, orjson
+from chatbot.serializers import TransactionSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks rendering a transaction list with DRF's JSONRenderer and "
+        "with ORJSONRenderer, and reports gzip/brotli payload sizes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="Transactions in the payload.")
+        parser.add_argument("--iterations", type=int, default=50, help="Renders per renderer.")
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed; ORJSONRenderer falls back to JSONRenderer.")
+
+        # Unsaved instances, so the benchmark does not touch the database.
+        transactions = [
+            Transaction(
+                id=i + 1,
+                date=datetime.date(2025, 1, 1) + datetime.timedelta(days=i % 365),
+                merchant=f"Merchant {i % 200}",
+                amount=i * 1.25,
+                category="Food",
+                transaction_type="debit",
+                method="UPI",
+            )
+            for i in range(options["rows"])
+        ]
+        data = TransactionSerializer(transactions, many=True).data
+
+        timings = {}
+        for label, renderer in (("json", JSONRenderer()), ("orjson", ORJSONRenderer())):
+            started = time.perf_counter()
+            for _ in range(options["iterations"]):
+                body = renderer.render(data, "application/json")
+            timings[label] = (time.perf_counter() - started) / options["iterations"]
+            self.stdout.write(f"{label:>8}: {timings[label] * 1000:>8.2f} ms/render  {len(body):>9} bytes")
+
+        sizes = [f"gzip {len(gzip.compress(body, compresslevel=6)):,} bytes"]
+        if brotli is not None:
+            sizes.append(f"br {len(brotli.compress(body, quality=4)):,} bytes")
+        self.stdout.write(f"Compressed: {', '.join(sizes)} (from {len(body):,})")
+        self.stdout.write(self.style.SUCCESS(f"Render speedup: {timings['json'] / timings['orjson']:.2f}x"))
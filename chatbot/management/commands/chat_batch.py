@@ -0,0 +1,82 @@
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.pipeline import run_chat_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a file of chat messages through the orchestrator/sub-agent/finalizer "
+        "pipeline concurrently and writes one JSON result per line. Items may "
+        "carry 'expected_agent'/'expected_tool' to score routing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "input",
+            help="JSON list or JSON Lines file of items: {\"message\": ..., \"history\": [...], \"id\": ...}. Use - for stdin.",
+        )
+        parser.add_argument("--output", help="Where to write JSON Lines results (default: stdout).")
+        parser.add_argument("--model", default="gemini-1.5-flash", help="Model for items that do not name one.")
+        parser.add_argument("--workers", type=int, default=settings.CHAT_BATCH_MAX_WORKERS, help="Concurrent turns.")
+
+    def _load_items(self, path):
+        text = sys.stdin.read() if path == "-" else open(path, encoding="utf-8").read()
+        text = text.strip()
+        try:
+            items = json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise CommandError(f"Could not parse {path}: {e}")
+        for i, item in enumerate(items):
+            if isinstance(item, str):
+                items[i] = item = {"message": item}
+            if not isinstance(item, dict) or not item.get("message"):
+                raise CommandError(f"Item {i} needs a non-empty 'message'.")
+            item.setdefault("id", i)
+        return items
+
+    def handle(self, *args, **options):
+        if not settings.GEMINI_API_KEY:
+            raise CommandError("GEMINI_API_KEY is not set.")
+        items = self._load_items(options["input"])
+
+        started = time.perf_counter()
+        results = run_chat_batch(items, options["model"], max_workers=options["workers"])
+        elapsed = time.perf_counter() - started
+
+        out = open(options["output"], "w", encoding="utf-8") if options["output"] else self.stdout
+        try:
+            for item, result in zip(items, results):
+                for key in ("expected_agent", "expected_tool"):
+                    if key in item:
+                        result[key] = item[key]
+                out.write(json.dumps(result, default=str) + "\n")
+        finally:
+            if options["output"]:
+                out.close()
+
+        self._summarize(items, results, elapsed, options["workers"])
+
+    def _summarize(self, items, results, elapsed, workers):
+        write = self.stderr.write
+        statuses = {}
+        for result in results:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        write(f"{len(results)} item(s) in {elapsed:.1f}s with {workers} worker(s): "
+              + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+
+        totals = sorted(r["timings"]["total"] for r in results if r.get("timings", {}).get("total") is not None)
+        if totals:
+            p50 = totals[len(totals) // 2]
+            p95 = totals[min(len(totals) - 1, int(len(totals) * 0.95))]
+            write(f"Turn latency: p50 {p50:.0f} ms, p95 {p95:.0f} ms")
+
+        for key, field in (("expected_agent", "agent"), ("expected_tool", "tool")):
+            scored = [(item[key], result.get(field)) for item, result in zip(items, results) if key in item]
+            if scored:
+                correct = sum(1 for expected, actual in scored if expected == actual)
+                write(f"{field.capitalize()} accuracy: {correct}/{len(scored)} ({correct / len(scored):.0%})")
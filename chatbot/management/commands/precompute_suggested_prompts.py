@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.models import SuggestedPrompt
+from chatbot.precompute import precompute_prompt_by_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Precomputes the routing decision, tool plan and (where it does not depend "
+        "on account data) the answer for every suggested prompt, so clicks on them "
+        "skip most model calls. Run at deploy; plans are dated and refresh daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=settings.PRECOMPUTE_MODEL, help="Model whose answers are stored.")
+        parser.add_argument("--workers", type=int, default=settings.CHAT_BATCH_MAX_WORKERS, help="Prompts precomputed concurrently.")
+
+    def handle(self, *args, **options):
+        if not settings.GEMINI_API_KEY:
+            raise CommandError("GEMINI_API_KEY is not set.")
+        prompt_ids = list(SuggestedPrompt.objects.values_list("pk", flat=True))
+        if not prompt_ids:
+            self.stderr.write("No suggested prompts to precompute.")
+            return
+
+        started = time.perf_counter()
+        workers = max(1, min(options["workers"], len(prompt_ids)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precompute") as pool:
+            plans = list(pool.map(lambda pk: precompute_prompt_by_id(pk, options["model"]), prompt_ids))
+
+        for prompt_id, plan in zip(prompt_ids, plans):
+            if plan is None:
+                self.stdout.write(f"{prompt_id}: failed (see the log)")
+            else:
+                tools = ", ".join(call["tool_name"] for call in plan["tool_calls"]) or "no tools"
+                self.stdout.write(f"{prompt_id}: {plan['agent'] or 'no agent'} ({tools}){', answer stored' if plan['answer'] else ''}")
+        failed = sum(plan is None for plan in plans)
+        self.stderr.write(f"{len(plans) - failed}/{len(plans)} prompt(s) precomputed in {time.perf_counter() - started:.1f}s.")
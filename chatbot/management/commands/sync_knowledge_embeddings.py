@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.embeddings import sync_embeddings
+
+
+class Command(BaseCommand):
+    help = (
+        "Embeds new or edited knowledge base entries and drops deleted ones from "
+        "the semantic search index. Run at deploy; saves in the admin also sync "
+        "in the background."
+    )
+
+    def handle(self, *args, **options):
+        if not settings.GEMINI_API_KEY:
+            raise CommandError("GEMINI_API_KEY is not set.")
+        started = time.perf_counter()
+        index = sync_embeddings()
+        self.stderr.write(
+            f"{len(index.hashes)} entr(y/ies), {index.keys.shape[0]} passage(s) indexed "
+            f"in {time.perf_counter() - started:.1f}s."
+        )
@@ -0,0 +1,109 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+# Only types that never carry per-user secrets next to reflected input, so
+# compression cannot leak them (BREACH). HTML, which holds CSRF tokens, is
+# left to FallbackGZipMiddleware and its length masking.
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "image/svg+xml",
+)
+ACCEPT_ENCODING_RE = re.compile(r"\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?")
+
+
+def parse_accept_encoding(header):
+    """Parses Accept-Encoding into the set of codings with a non-zero q value."""
+    accepted = set()
+    for part in header.lower().split(","):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        coding, q = match.groups()
+        try:
+            if q is not None and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding)
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with Brotli (when the brotli package is installed)
+    or gzip, whichever the client prefers from what it accepts. Only
+    non-streaming responses of COMPRESSIBLE_TYPES at least
+    COMPRESSION_MIN_SIZE bytes long are compressed, since small bodies do
+    not win enough to pay for the CPU.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+        content_type = response.get("Content-Type", "")
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        # The body varies by Accept-Encoding from here on, even if this
+        # particular response ends up uncompressed.
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        accepted = parse_accept_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if brotli is not None and "br" in accepted:
+            encoding = "br"
+            compressed = brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        elif "gzip" in accepted or "*" in accepted:
+            encoding = "gzip"
+            compressed = gzip.compress(response.content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # The compressed body is a different representation, so the ETag
+        # becomes weak, as Django's GZipMiddleware does.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+
+class FallbackGZipMiddleware(GZipMiddleware):
+    """
+    Django's GZipMiddleware (gzip with BREACH length masking) for the responses
+    CompressionMiddleware does not own: HTML and other types, and streaming
+    responses. Non-streaming COMPRESSIBLE_TYPES are skipped even when
+    CompressionMiddleware left them uncompressed, so COMPRESSION_MIN_SIZE and
+    its other rules hold. Must sit outside CompressionMiddleware.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES):
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# External-content FTS5 index over Transaction.merchant and category. The
+# triggers keep it in step with every write path, including bulk_create(),
+# QuerySet.update() and raw SQL, which model signals would miss.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chatbot_transaction_fts USING fts5(
+        merchant, category,
+        content='chatbot_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_transaction_fts_ai AFTER INSERT ON chatbot_transaction BEGIN
+        INSERT INTO chatbot_transaction_fts(rowid, merchant, category) VALUES (new.id, new.merchant, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_transaction_fts_ad AFTER DELETE ON chatbot_transaction BEGIN
+        INSERT INTO chatbot_transaction_fts(chatbot_transaction_fts, rowid, merchant, category)
+        VALUES ('delete', old.id, old.merchant, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chatbot_transaction_fts_au AFTER UPDATE OF merchant, category ON chatbot_transaction BEGIN
+        INSERT INTO chatbot_transaction_fts(chatbot_transaction_fts, rowid, merchant, category)
+        VALUES ('delete', old.id, old.merchant, old.category);
+        INSERT INTO chatbot_transaction_fts(rowid, merchant, category) VALUES (new.id, new.merchant, new.category);
+    END
+    """,
+    # Index the rows that already exist.
+    "INSERT INTO chatbot_transaction_fts(chatbot_transaction_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS chatbot_transaction_fts_ai",
+    "DROP TRIGGER IF EXISTS chatbot_transaction_fts_ad",
+    "DROP TRIGGER IF EXISTS chatbot_transaction_fts_au",
+    "DROP TABLE IF EXISTS chatbot_transaction_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite-only; other backends search with the ORM fallback in
+        # chatbot/transaction_search.py.
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0018_alter_chatbotknowledge_title"),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SQL), _run(DROP_SQL)),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0020_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='match_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='precomputed_agent',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='precomputed_answer',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='precomputed_answer_model',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='precomputed_plan',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='suggestedprompt',
+            name='precomputed_plan_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
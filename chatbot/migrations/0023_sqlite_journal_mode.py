@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import migrations
+
+# journal_mode is stored in the database file itself, unlike the per-connection
+# pragmas in settings.SQLITE_PRAGMAS, so it is switched once here rather than
+# on every connection. Switching needs autocommit, hence atomic = False.
+
+
+def _set_journal_mode(mode):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode={mode}")
+    return run
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("chatbot", "0022_chatbotknowledge_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(_set_journal_mode(settings.SQLITE_JOURNAL_MODE), _set_journal_mode("DELETE")),
+    ]
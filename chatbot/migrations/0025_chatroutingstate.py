@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0024_modelversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatRoutingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=64, unique=True)),
+                ('agent', models.CharField(max_length=50)),
+                ('tool', models.CharField(blank=True, max_length=100, null=True)),
+                ('arguments', models.JSONField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
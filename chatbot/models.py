@@ -26,6 +26,14 @@ class AIModel(models.Model):
 
 class SuggestedPrompt(models.Model):
     text = models.CharField(max_length=255)
+    # Precomputed turn for this prompt, filled in by chatbot/precompute.py.
+    # match_key is the normalized text it was computed for.
+    match_key = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    precomputed_agent = models.CharField(max_length=50, blank=True, editable=False)
+    precomputed_plan = models.JSONField(default=list, blank=True, editable=False)
+    precomputed_plan_date = models.DateField(null=True, blank=True, editable=False)
+    precomputed_answer = models.TextField(blank=True, editable=False)
+    precomputed_answer_model = models.CharField(max_length=100, blank=True, editable=False)
 
     def __str__(self):
         return self.text
@@ -33,6 +41,9 @@ class SuggestedPrompt(models.Model):
 class ChatbotKnowledge(models.Model):
     title = models.CharField(max_length=255)
     knowledge_text = models.TextField()
+    # Lets every process tell which entries changed since it last indexed them
+    # (see chatbot/retrieval.py).
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return "Chatbot Knowledge Base"
@@ -123,6 +134,14 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ['-date']
+        # Serve the list filters in chatbot/filters.py and keyset pagination
+        # on (date, id): an equality filter plus a date range reads one index range.
+        indexes = [
+            models.Index(fields=['date', 'id'], name='txn_date_id_idx'),
+            models.Index(fields=['category', 'date'], name='txn_category_date_idx'),
+            models.Index(fields=['transaction_type', 'date'], name='txn_type_date_idx'),
+            models.Index(fields=['method', 'date'], name='txn_method_date_idx'),
+        ]
 
 class CreditCard(models.Model):
     # user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credit_cards', null=True, blank=True) # Added user field
@@ -211,4 +230,27 @@ class Instruction(models.Model):
         return self.title
 
 
+class ModelVersion(models.Model):
+    # One row per model, bumped on every save/delete of it (see chatbot/signals.py).
+    # Stored in the database so that every worker keys cached tool results and
+    # HTTP validators on the same values (see chatbot/cache_utils.py).
+    label = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"{self.label} v{self.version}"
+
+
+class ChatRoutingState(models.Model):
+    # The last routing decision of a chat session, for sticky follow-ups (see
+    # chatbot/routing.py). Stored in the database so that a follow-up landing
+    # on any worker finds it. Keyed on the signed session cookie.
+    session_id = models.CharField(max_length=64, unique=True)
+    agent = models.CharField(max_length=50)
+    tool = models.CharField(max_length=100, blank=True, null=True)
+    arguments = models.JSONField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.session_id} -> {self.agent}"
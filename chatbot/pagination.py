@@ -0,0 +1,73 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset ("seek") pagination, newest first. Lists stay plain arrays
+    unless the request sends ?page_size= or ?cursor=; then the response is
+    {"results": [...], "next_cursor": ..., "next": ...}.
+
+    Each page continues after the last row of the previous one with a
+    WHERE (date, id) < (last date, last id) condition rather than an OFFSET,
+    so page 1000 costs the same as page 1 and rows inserted meanwhile do not
+    shift pages. The `ordering` fields must be backed by an index.
+    """
+    ordering = ("date", "id")
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+
+    def _encode_cursor(self, row):
+        values = [str(getattr(row, field)) for field in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, cursor, model):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise ValidationError({"error": "Invalid cursor."})
+
+    def _after(self, values):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), generalised to n fields.
+        condition = Q()
+        for i, (field, value) in enumerate(zip(self.ordering, values)):
+            equal = {f: v for f, v in zip(self.ordering[:i], values[:i])}
+            condition |= Q(**equal, **{f"{field}__lt": value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_size_query_param not in params and self.cursor_query_param not in params:
+            return None
+        try:
+            page_size = int(params.get(self.page_size_query_param, settings.TRANSACTION_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError({"error": f"'{self.page_size_query_param}' must be an integer."})
+        page_size = max(1, min(page_size, settings.TRANSACTION_MAX_PAGE_SIZE))
+
+        queryset = queryset.order_by(*(f"-{field}" for field in self.ordering))
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(self._decode_cursor(cursor, queryset.model)))
+
+        # One extra row tells whether there is a next page without a COUNT.
+        rows = list(queryset[:page_size + 1])
+        self.next_cursor = self._encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+        self.request = request
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        next_url = None
+        if self.next_cursor:
+            next_url = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+        return Response({"results": data, "next_cursor": self.next_cursor, "next": next_url})
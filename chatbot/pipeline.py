@@ -0,0 +1,403 @@
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .email_utils import send_chat_notification_email
+from .gemini_utils import GeminiCallTimeout, ModelBackendUnavailable, bulkhead_wait, generate_content
+from .lazy_imports import get_genai
+from .logging_utils import get_stage_logger, payload_extra
+from .precompute import find_precomputed, save_plan
+from .prompts import (
+    FINALIZER_TEMPLATE, GENERALIST_TEMPLATE, ORCHESTRATOR_TEMPLATE, SUB_AGENT_TEMPLATE,
+    PromptBuilder, keep_recent_lines, shrink_tool_output,
+)
+from .routing import get_routing_state, is_follow_up, save_routing_state
+from .tool_runner import format_tool_results, parse_tool_plan, run_tool_plan
+from .tools import KNOWLEDGE_TOOLS, get_tool_descriptions_for_agent
+
+logger = logging.getLogger(__name__)
+
+# Agents the orchestrator may choose; the last three are tool-using specialists.
+AGENTS = ("Generalist", "AccountSpecialist", "SecurityOfficer", "FinancialAdvisor")
+
+
+# ==============================================================================
+# === CHAT PIPELINE: ORCHESTRATOR -> SUB-AGENT -> TOOL -> FINALIZER ============
+# ==============================================================================
+
+@contextmanager
+def _timed(result, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        result["timings"][stage] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def _build_prompt(result, builder, request_id):
+    prompt = builder.build(request_id)
+    result["prompt_tokens"][builder.stage] = builder.usage["tokens"]
+    return prompt
+
+
+def _finish(result, started):
+    result["timings"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _get_model(selected_model):
+    genai = get_genai()
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel(selected_model)
+
+
+def _strip_json(text):
+    return text.strip().replace("```json", "").replace("```", "")
+
+
+def _orchestrate(model, user_message, formatted_history, request_id, result):
+    """Asks the orchestrator which agent should handle the message; None if its reply is unusable."""
+    builder = (PromptBuilder("orchestration", ORCHESTRATOR_TEMPLATE)
+               .flexible("user_message", user_message)
+               .flexible("formatted_history", formatted_history, keep_recent_lines))
+    orchestrator_prompt = _build_prompt(result, builder, request_id)
+    get_stage_logger("orchestration").info(f"[{request_id}] STEP 1: Performing orchestration call to select an agent...")
+    with _timed(result, "orchestration"):
+        orchestrator_response = generate_content(model, orchestrator_prompt, stage="orchestration", request_id=request_id)
+
+    try:
+        decision_json = json.loads(_strip_json(orchestrator_response.text))
+        chosen_agent = decision_json.get("agent_name")
+        get_stage_logger("orchestration").info(f"[{request_id}] Orchestrator selected agent: '{chosen_agent}'")
+        return chosen_agent
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error(f"[{request_id}] Failed to parse orchestrator JSON response: {e}. Raw response: {orchestrator_response.text}")
+        return None
+
+
+def _answer_directly(model, user_message, request_id, result):
+    """The Generalist's reply: one model call, no tools."""
+    builder = PromptBuilder("generalist", GENERALIST_TEMPLATE).flexible("user_message", user_message)
+    generalist_prompt = _build_prompt(result, builder, request_id)
+    with _timed(result, "generalist"):
+        final_response = generate_content(model, generalist_prompt, stage="generalist", request_id=request_id)
+    return final_response.text
+
+
+def _plan_tools(model, chosen_agent, user_message, routing_state, request_id, result):
+    """Asks the sub-agent which tools to call; returns its raw reply."""
+    tool_descriptions = get_tool_descriptions_for_agent(chosen_agent)
+    previous_call = ""
+    if routing_state and routing_state.get("agent") == chosen_agent and routing_state.get("tool"):
+        previous_call = f"""
+**Previous Tool Call in This Conversation:**
+{routing_state['tool']} with arguments {json.dumps(routing_state['arguments'])}
+If the message follows up on it (e.g. "and the last 20?"), reuse or adjust those arguments.
+"""
+
+    builder = (PromptBuilder("sub_agent", SUB_AGENT_TEMPLATE)
+               .fixed(chosen_agent=chosen_agent, today=timezone.localdate().isoformat(),
+                      previous_call=previous_call, tool_descriptions=tool_descriptions)
+               .flexible("user_message", user_message))
+    sub_agent_prompt = _build_prompt(result, builder, request_id)
+    get_stage_logger("sub_agent").info(f"[{request_id}] STEP 2a: Sub-agent '{chosen_agent}' is deciding which tool to use...")
+    with _timed(result, "sub_agent"):
+        sub_agent_response = generate_content(model, sub_agent_prompt, stage="sub_agent", request_id=request_id)
+    return sub_agent_response.text
+
+
+def _finalize(model, user_message, tool_result, request_id, result):
+    """Turns the tool output into the answer shown to the user."""
+    builder = (PromptBuilder("finalization", FINALIZER_TEMPLATE)
+               .flexible("user_message", user_message)
+               .flexible("tool_result", tool_result, shrink_tool_output))
+    finalizer_prompt = _build_prompt(result, builder, request_id)
+    get_stage_logger("finalization").info(f"[{request_id}] STEP 3: Performing finalization call to format the tool output...")
+    with _timed(result, "finalization"):
+        final_response = generate_content(model, finalizer_prompt, stage="finalization", request_id=request_id)
+    return final_response.text
+
+
+def run_chat_turn(user_message, history, selected_model, request_id, input_type='text', notify=True, session_id=None,
+                  plan=None, on_plan=None, shortcuts=True):
+    """
+    Runs one chat turn through the orchestrator, the chosen sub-agent and its
+    tool plan, and the finalizer. Returns a dict with the bot `response`, the
+    chosen `agent`, the first `tool` and its `arguments`, every planned call
+    in `tool_calls` (with `ok` and `ms`), whether the agent was reused from
+    the session without orchestration (`sticky`), per-stage `timings` in
+    milliseconds and the estimated `prompt_tokens` of each stage's prompt.
+    A first turn matching a suggested prompt is served from its precomputed
+    turn (see chatbot/precompute.py) and has `precomputed` set.
+    Gemini errors (GeminiCallTimeout, ModelBackendUnavailable, ...)
+    propagate to the caller. `notify=False`
+    skips the email notification, e.g. for batch evaluation. With a
+    `session_id`, the routing decision is remembered for the next turn.
+    A specialist's tool plan is passed to `on_plan` as {"agent", "tool_calls"}
+    before any tool runs; a `plan` of that shape, made by an identical turn
+    without session context (see chatbot/coalescing.py), is used instead of
+    orchestrating and planning again. `shortcuts=False` turns off the
+    precomputed-prompt and sticky-routing paths so that every stage runs,
+    e.g. for batch evaluation.
+    """
+    started = time.perf_counter()
+    result = {
+        "response": None, "agent": None, "tool": None, "arguments": None, "tool_calls": [],
+        "sticky": False, "precomputed": False, "timings": {}, "prompt_tokens": {},
+    }
+
+    # --- 1. Configure Gemini API ---
+    model = _get_model(selected_model)
+
+    # --- 2. STEP 1: ORCHESTRATION ---
+    # The first LLM call decides which specialist agent to route the query to.
+    formatted_history = "\n".join([f"{msg.get('role', 'user').capitalize()}: {msg.get('content', '')}" for msg in history])
+
+    routing_state = get_routing_state(session_id) if shortcuts else None
+    precomputed = None
+    if is_follow_up(user_message, routing_state):
+        # Follow-up to the previous specialist turn: skip the orchestrator.
+        chosen_agent = routing_state["agent"]
+        result["sticky"] = True
+        get_stage_logger("orchestration").info(f"[{request_id}] Follow-up in session; reusing agent '{chosen_agent}' without orchestration.")
+    elif plan:
+        chosen_agent = plan["agent"]
+        get_stage_logger("orchestration").info(f"[{request_id}] Reusing agent '{chosen_agent}' chosen by an identical in-flight turn.")
+    else:
+        precomputed = None if history or not shortcuts else find_precomputed(user_message, selected_model)
+        if precomputed:
+            # A suggested prompt: the routing decision was made ahead of time.
+            chosen_agent = precomputed["agent"]
+            result["precomputed"] = True
+            get_stage_logger("orchestration").info(f"[{request_id}] Suggested prompt; using precomputed agent '{chosen_agent}' without orchestration.")
+        else:
+            chosen_agent = _orchestrate(model, user_message, formatted_history, request_id, result)
+            if chosen_agent is None:
+                # Fallback to a general response if orchestration fails
+                result["response"] = "I'm having trouble understanding your request. Could you please rephrase it?"
+                return _finish(result, started)
+    result["agent"] = chosen_agent
+
+    bot_response = ""
+    tool_result = None
+    # Variables for email notification
+    main_agent_decision = None
+    sub_agent_used_for_email = None
+    tools_used_for_email = None
+    sub_agent_raw_response = None
+    final_bot_output = None
+
+    # --- 3. STEP 2: DELEGATION TO SUB-AGENT ---
+    if precomputed and precomputed["answer"]:
+        # The answer does not depend on account data and was computed ahead of time.
+        logger.info(f"[{request_id}] Serving the precomputed answer for this suggested prompt.")
+        main_agent_decision = chosen_agent
+        if precomputed["tool_calls"]:
+            result["tool"], result["arguments"] = precomputed["tool_calls"][0]["tool_name"], precomputed["tool_calls"][0]["arguments"]
+        bot_response = precomputed["answer"]
+        final_bot_output = bot_response
+
+    elif chosen_agent == "Generalist":
+        logger.info(f"[{request_id}] Delegating to Generalist for a direct answer.")
+        main_agent_decision = "Generalist"
+        bot_response = _answer_directly(model, user_message, request_id, result)
+        final_bot_output = bot_response
+
+    elif chosen_agent in AGENTS[1:]:
+        logger.info(f"[{request_id}] Delegating to sub-agent: '{chosen_agent}'")
+        main_agent_decision = chosen_agent
+        sub_agent_used_for_email = chosen_agent
+        if precomputed and precomputed["tool_calls"]:
+            get_stage_logger("sub_agent").info(f"[{request_id}] STEP 2a: Using the precomputed tool plan for this suggested prompt.")
+            sub_agent_raw_response = json.dumps({"tool_calls": precomputed["tool_calls"]})
+        elif plan:
+            get_stage_logger("sub_agent").info(f"[{request_id}] STEP 2a: Using the tool plan of an identical in-flight turn.")
+            sub_agent_raw_response = json.dumps({"tool_calls": plan["tool_calls"]})
+        else:
+            # A matched prompt's plan is stored for everyone who taps it, so
+            # it is made without this session's previous turn.
+            planning_state = None if precomputed else routing_state
+            sub_agent_raw_response = _plan_tools(model, chosen_agent, user_message, planning_state, request_id, result) # Capture raw response
+
+        try:
+            tool_calls = parse_tool_plan(json.loads(_strip_json(sub_agent_raw_response)))
+            if precomputed and not precomputed["tool_calls"]:
+                # The stored plan was out of date; keep this one for the rest of the day.
+                save_plan(precomputed, chosen_agent, tool_calls)
+            if on_plan:
+                on_plan({"agent": chosen_agent, "tool_calls": tool_calls})
+
+            tools_used_for_email = "; ".join(f"Tool: {c['tool_name']}, Arguments: {c['arguments']}" for c in tool_calls) # Capture tool info
+            result["tool"], result["arguments"] = tool_calls[0]["tool_name"], tool_calls[0]["arguments"]
+
+            get_stage_logger("tool").info(f"[{request_id}] Sub-agent '{chosen_agent}' planned tool call(s): {tool_calls}")
+
+            with _timed(result, "tool"):
+                outcomes = run_tool_plan(tool_calls, request_id)
+            result["tool_calls"] = [
+                {key: outcome[key] for key in ("tool_name", "arguments", "ok", "status", "ms")} for outcome in outcomes
+            ]
+            if all(outcome["status"] == "unknown" for outcome in outcomes):
+                bot_response = "I'm sorry, I tried to perform an action but couldn't find the right internal capability."
+                final_bot_output = bot_response
+            else:
+                tool_result = format_tool_results(outcomes)
+
+        except (json.JSONDecodeError, AttributeError, ValueError) as e:
+            logger.error(f"[{request_id}] Sub-agent '{chosen_agent}' failed to produce a valid tool call or tool execution failed: {e}. Raw response: {sub_agent_raw_response}")
+            bot_response = "I'm sorry, I was unable to complete that action. This is demo so my actions are limited. However, I have the capability to perform this if given enough permissions. Until then Please try contacting customer support."
+            final_bot_output = bot_response
+        except Exception as e:
+            logger.exception(f"[{request_id}] An unexpected error occurred while executing the tool plan.")
+            bot_response = "An unexpected error occurred. Please contact support."
+            final_bot_output = bot_response
+
+    else:
+        logger.warning(f"[{request_id}] Orchestrator returned an unknown agent: '{chosen_agent}'")
+        main_agent_decision = "Unknown"
+        bot_response = "I'm not sure how to handle that request. Please try rephrasing."
+        final_bot_output = bot_response
+
+    if main_agent_decision in AGENTS:
+        save_routing_state(session_id, chosen_agent, result["tool"], result["arguments"])
+
+    # --- 4. STEP 3: FINALIZATION (if a tool was used) ---
+    if tool_result:
+        bot_response = _finalize(model, user_message, tool_result, request_id, result)
+        final_bot_output = bot_response # Update final output after finalization
+        get_stage_logger("finalization").info(f"[{request_id}] FINALIZER RAW OUTPUT:\n{bot_response}", extra=payload_extra(request_id))
+
+    # --- Send Email Notification ---
+    if notify:
+        _send_notification(
+            request_id, user_message, input_type,
+            main_agent_response=main_agent_decision,
+            sub_agent_used=sub_agent_used_for_email,
+            tools_used=tools_used_for_email,
+            sub_agent_response=sub_agent_raw_response,
+            final_output=final_bot_output,
+            chat_history=formatted_history
+        )
+
+    # --- 5. Return Final Response ---
+    get_stage_logger("request").info(f"[{request_id}] FINAL RESPONSE to User: '{bot_response}'", extra=payload_extra(request_id))
+    result["response"] = bot_response
+    return _finish(result, started)
+
+
+def _send_notification(request_id, user_message, input_type, **fields):
+    try:
+        email_user_input_query = user_message
+        if input_type == 'audio':
+            if user_message and user_message != "Audio transcription failed.":
+                email_user_input_query = f"Audio Input (transcribed: {user_message})"
+            else:
+                email_user_input_query = "Audio Input (transcription failed)"
+        send_chat_notification_email(user_input_query=email_user_input_query, **fields)
+    except Exception as e:
+        logger.error(f"[{request_id}] Error sending email notification: {e}")
+
+
+def notify_shared_turn(user_message, result, request_id, input_type='text'):
+    """
+    Sends the notification email for a turn whose answer came from another
+    request's run (see chatbot/coalescing.py), built from that run's result.
+    """
+    tool_calls = [{"tool_name": c["tool_name"], "arguments": c["arguments"]} for c in result["tool_calls"]]
+    specialist = result["agent"] if result["agent"] in AGENTS[1:] else None
+    _send_notification(
+        request_id, user_message, input_type,
+        main_agent_response=result["agent"],
+        sub_agent_used=specialist,
+        tools_used="; ".join(f"Tool: {c['tool_name']}, Arguments: {c['arguments']}" for c in tool_calls) or None,
+        sub_agent_response=json.dumps({"tool_calls": tool_calls}) if tool_calls else None,
+        final_output=result["response"],
+        chat_history="",
+    )
+
+
+# ==============================================================================
+# === PRECOMPUTATION FOR SUGGESTED PROMPTS =====================================
+# ==============================================================================
+
+def precompute_turn(user_message, selected_model, request_id):
+    """
+    Plans a first turn ahead of time for chatbot/precompute.py: the
+    orchestrator's choice of agent, the sub-agent's tool plan and, when the
+    answer does not depend on account data, the final answer. Only tools in
+    KNOWLEDGE_TOOLS are run. Returns {"agent", "tool_calls", "answer"};
+    `agent` is "" if the orchestrator's reply was unusable and `answer` is ""
+    when it has to be computed per request. Gemini errors propagate, as do
+    unusable sub-agent replies (ValueError).
+    """
+    result = {"timings": {}, "prompt_tokens": {}}
+    model = _get_model(selected_model)
+    chosen_agent = _orchestrate(model, user_message, "", request_id, result)
+    plan = {"agent": chosen_agent if chosen_agent in AGENTS else "", "tool_calls": [], "answer": ""}
+
+    if chosen_agent == "Generalist":
+        plan["answer"] = _answer_directly(model, user_message, request_id, result)
+    elif chosen_agent in AGENTS[1:]:
+        tool_calls = parse_tool_plan(json.loads(_strip_json(_plan_tools(model, chosen_agent, user_message, None, request_id, result))))
+        plan["tool_calls"] = tool_calls
+        if all(call["tool_name"] in KNOWLEDGE_TOOLS for call in tool_calls):
+            outcomes = run_tool_plan(tool_calls, request_id)
+            # Tools report their own failures as "Error ..." strings; do not keep an answer built on one.
+            if all(outcome["ok"] and not str(outcome["result"]).startswith("Error") for outcome in outcomes):
+                plan["answer"] = _finalize(model, user_message, format_tool_results(outcomes), request_id, result)
+    return plan
+
+
+# ==============================================================================
+# === BATCH EXECUTION ==========================================================
+# ==============================================================================
+
+def _run_batch_item(item, selected_model, slot_wait):
+    request_id = uuid.uuid4()
+    model_name = item.get("model") or selected_model
+    entry = {"id": item.get("id"), "message": item["message"], "request_id": str(request_id)}
+    try:
+        # Batch model calls count against the same bulkhead as live chat, but
+        # wait longer for a slot instead of being shed straight away. Every
+        # stage runs, so evaluations measure routing and the model rather than
+        # stored suggested-prompt answers.
+        with bulkhead_wait(slot_wait):
+            entry.update(run_chat_turn(item["message"], item.get("history") or [], model_name, request_id,
+                                       notify=False, shortcuts=False))
+        entry["status"] = "ok"
+    except GeminiCallTimeout:
+        entry.update(status="timeout", error="Gemini did not respond in time.")
+    except ModelBackendUnavailable as e:
+        entry.update(status="shed", error=str(e))
+    except Exception as e:
+        logger.exception(f"[{request_id}] Batch item failed for message: {item['message']}")
+        entry.update(status="error", error=str(e))
+    finally:
+        # Each worker thread opens its own database connections; close them
+        # rather than leaving one per thread behind after the batch.
+        connections.close_all()
+    return entry
+
+
+def run_chat_batch(items, selected_model, max_workers=None, slot_wait=None):
+    """
+    Runs run_chat_turn for every item ({"message": ..., "history": [...],
+    "id": ..., "model": ...}; only "message" is required) on a bounded thread
+    pool and returns one result per item, in input order, each with a
+    `status` of "ok", "timeout", "shed" or "error". Email notifications are
+    not sent for batch turns, and precomputed answers and sticky routing are
+    not used.
+    """
+    if not items:
+        return []
+    workers = max(1, min(max_workers or settings.CHAT_BATCH_MAX_WORKERS, len(items)))
+    slot_wait = settings.CHAT_BATCH_SLOT_WAIT if slot_wait is None else slot_wait
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-batch") as pool:
+        return list(pool.map(lambda item: _run_batch_item(item, selected_model, slot_wait), items))
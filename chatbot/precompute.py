@@ -0,0 +1,160 @@
+"""
+Precomputed turns for suggested prompts.
+
+SuggestedPrompt rows are fixed one-click questions, so most of their turn can
+be worked out ahead of time. For each prompt the orchestrator's routing
+decision and the sub-agent's tool plan are stored on the row, and for prompts
+whose answer does not depend on account data (Generalist replies and
+knowledge base lookups, see KNOWLEDGE_TOOLS) the final answer too.
+
+run_chat_turn looks up first turns (no history) here by normalized text:
+- with an answer stored for the selected model, it replies with that answer
+  and makes no model calls;
+- otherwise it skips the orchestrator and, if the plan was made today, the
+  sub-agent as well. The tools still run for every request, so account data
+  and actions are always live, and only the finalizer calls the model.
+
+Plans are dated because the sub-agent turns relative dates ("last month")
+into date ranges using today's date. A plan from an earlier day is replaced by
+the next turn that plans the prompt again.
+
+Prompts are precomputed in the background after they are saved, and by
+`manage.py precompute_suggested_prompts`, which is meant to run at deploy.
+A change to the knowledge base clears the answers built from it and
+precomputes those prompts again. Precomputation never runs tools that change
+data.
+"""
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .gemini_utils import bulkhead_wait, normalize_model_name
+from .models import SuggestedPrompt
+from .text_utils import normalize_message
+
+logger = logging.getLogger(__name__)
+
+# Precomputation after a save runs here, one prompt at a time, so saving a
+# prompt in the admin does not wait for the model.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precompute")
+
+
+def match_key(text):
+    return normalize_message(text)[:255]
+
+
+# ==============================================================================
+# === LOOKUP (used by the chat pipeline) =======================================
+# ==============================================================================
+
+def find_precomputed(user_message, selected_model):
+    """
+    Returns the precomputed turn for a message matching a suggested prompt:
+    {"prompt_id", "key", "agent", "tool_calls", "answer"}, where `tool_calls`
+    is None unless the plan was made today and `answer` is None unless one is
+    stored for `selected_model`. Returns None when nothing matches.
+    """
+    if not settings.PRECOMPUTED_ANSWERS_ENABLED:
+        return None
+    key = match_key(user_message)
+    if not key:
+        return None
+    prompt = SuggestedPrompt.objects.filter(match_key=key).exclude(precomputed_agent="").first()
+    if prompt is None:
+        return None
+    plan_is_current = prompt.precomputed_plan and prompt.precomputed_plan_date == timezone.localdate()
+    answer_fits = prompt.precomputed_answer and prompt.precomputed_answer_model == normalize_model_name(selected_model)
+    return {
+        "prompt_id": prompt.pk,
+        "key": key,
+        "agent": prompt.precomputed_agent,
+        "tool_calls": prompt.precomputed_plan if plan_is_current else None,
+        "answer": prompt.precomputed_answer if answer_fits else None,
+    }
+
+
+def save_plan(precomputed, agent, tool_calls):
+    """Stores a plan the sub-agent just made for a matched prompt, dated today."""
+    SuggestedPrompt.objects.filter(pk=precomputed["prompt_id"], match_key=precomputed["key"]).update(
+        precomputed_agent=agent,
+        precomputed_plan=[{"tool_name": c["tool_name"], "arguments": c["arguments"]} for c in tool_calls],
+        precomputed_plan_date=timezone.localdate(),
+    )
+
+
+# ==============================================================================
+# === PRECOMPUTATION ===========================================================
+# ==============================================================================
+
+def precompute_prompt(prompt, selected_model=None):
+    """
+    Plans `prompt` with pipeline.precompute_turn and stores the result on the
+    row. Returns the stored plan ({"agent", "tool_calls", "answer"}). Gemini
+    errors propagate. If the prompt's text changed meanwhile, nothing is stored.
+    """
+    # pipeline imports this module for the lookup.
+    from .pipeline import precompute_turn
+
+    selected_model = selected_model or settings.PRECOMPUTE_MODEL
+    request_id = uuid.uuid4()
+    with bulkhead_wait(settings.CHAT_BATCH_SLOT_WAIT):
+        plan = precompute_turn(prompt.text, selected_model, request_id)
+
+    SuggestedPrompt.objects.filter(pk=prompt.pk, text=prompt.text).update(
+        match_key=match_key(prompt.text) if plan["agent"] else "",
+        precomputed_agent=plan["agent"],
+        precomputed_plan=plan["tool_calls"],
+        precomputed_plan_date=timezone.localdate(),
+        precomputed_answer=plan["answer"],
+        precomputed_answer_model=normalize_model_name(selected_model) if plan["answer"] else "",
+    )
+    logger.info(
+        f"[{request_id}] Precomputed suggested prompt {prompt.pk}: agent '{plan['agent']}', "
+        f"{len(plan['tool_calls'])} tool call(s), {'with' if plan['answer'] else 'without'} answer."
+    )
+    return plan
+
+
+def precompute_prompt_by_id(prompt_id, selected_model=None):
+    """precompute_prompt for use on a worker thread: logs errors instead of raising. Returns the plan or None."""
+    try:
+        prompt = SuggestedPrompt.objects.filter(pk=prompt_id).first()
+        return precompute_prompt(prompt, selected_model) if prompt else None
+    except Exception:
+        logger.exception(f"Failed to precompute suggested prompt {prompt_id}.")
+        return None
+    finally:
+        connections.close_all()
+
+
+def schedule_precompute(prompt_id):
+    """Precomputes the prompt in the background once the current transaction commits."""
+    if not settings.PRECOMPUTE_ON_SAVE or not settings.GEMINI_API_KEY:
+        return
+    transaction.on_commit(lambda: _executor.submit(precompute_prompt_by_id, prompt_id))
+
+
+def clear_precomputed(prompt_id):
+    SuggestedPrompt.objects.filter(pk=prompt_id).update(
+        match_key="", precomputed_agent="", precomputed_plan=[], precomputed_plan_date=None,
+        precomputed_answer="", precomputed_answer_model="",
+    )
+
+
+def forget_knowledge_answers():
+    """
+    Clears the stored answers that were built from knowledge base tools and
+    precomputes those prompts again. Called when the knowledge base changes.
+    """
+    stale = [
+        prompt.pk for prompt in SuggestedPrompt.objects.exclude(precomputed_answer="").only("pk", "precomputed_plan")
+        if prompt.precomputed_plan
+    ]
+    if stale:
+        SuggestedPrompt.objects.filter(pk__in=stale).update(precomputed_answer="", precomputed_answer_model="")
+    for prompt_id in stale:
+        schedule_precompute(prompt_id)
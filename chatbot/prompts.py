@@ -0,0 +1,305 @@
+"""
+Token-budgeted prompt assembly.
+
+Each pipeline stage has a budget (PROMPT_TOKEN_BUDGETS). A PromptBuilder takes
+the stage's template, the parts that must go in whole (instructions, agent
+names, tool specs) and the parts that may be shrunk (history, the user's
+message, tool output). If the whole prompt is over budget, the shrinkable
+parts share what is left and are cut down deterministically: history keeps
+its most recent lines, tables keep their header and first rows, and other
+text keeps its beginning and end. Every cut says how much was left out, so
+the model knows the text is incomplete.
+
+Token counts are a local estimate (no tokenizer call) that errs high on
+purpose; it is accurate enough to bound prompt size, which is what drives
+model latency and cost.
+"""
+import math
+import re
+
+from django.conf import settings
+
+from .logging_utils import get_stage_logger
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d+|\S")
+
+
+def estimate_tokens(text):
+    """
+    Approximate token count: one per punctuation mark or symbol, and one per
+    started 6 letters of a word or 3 digits of a number.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 6)
+        elif piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+# ==============================================================================
+# === STAGE TEMPLATES ==========================================================
+# ==============================================================================
+# str.format templates; literal braces are doubled.
+
+ORCHESTRATOR_TEMPLATE = """
+You are the master request orchestrator for a digital bank. Your primary job is to analyze the user's query and route it to the correct specialist agent. Do not attempt to answer the user yourself.
+
+Here are the available specialist agents and their responsibilities:
+- **AccountSpecialist**: Use for any questions about retrieving data. This includes checking account balances, listing or searching transactions (e.g. by merchant), summarizing spending, fetching account numbers, or getting details about credit/debit cards.
+- **SecurityOfficer**: Use for any requests that involve an action or a change to security settings. This includes updating transaction limits or enabling/disabling international transactions.
+- **FinancialAdvisor**: Use for any questions related to financial advice, planning, investment options, or market trends.
+- **Generalist**: Use for simple greetings, farewells, non-financial questions, or if the user's intent is unclear and doesn't fit any other specialist.
+
+**Conversation History:**
+{formatted_history}
+
+**User's Latest Message:**
+"{user_message}"
+
+Based on the user's latest message, which specialist agent is the most appropriate to handle the request?
+Respond with ONLY a JSON object in the following format. Do not add any other text.
+{{
+  "agent_name": "<name_of_the_chosen_agent>"
+}}
+"""
+
+GENERALIST_TEMPLATE = """
+You are a friendly and helpful banking assistant. The user said: "{user_message}".
+Provide a direct, conversational response. Do not offer to perform any actions you can't do.
+If you don't know the answer, say so politely.
+"""
+
+SUB_AGENT_TEMPLATE = """
+You are a specialist agent known as the '{chosen_agent}'. Your role is to handle specific user requests by using your available tools.
+Based on the user's message, decide which tool or tools to call.
+Today's date is {today}; use it to turn relative dates such as "last month" into date ranges.
+
+**User's Message:**
+"{user_message}"
+{previous_call}
+**Your Available Tools:**
+{tool_descriptions}
+
+Respond with ONLY a JSON object listing the tool calls needed and their arguments.
+Plan several calls only when the message asks for several things (e.g. "show my accounts and credit card"); all of them run in this turn.
+If no tool is appropriate, respond with a JSON object containing an error.
+{{
+  "tool_calls": [
+    {{
+      "tool_name": "<name_of_the_tool_to_call>",
+      "arguments": {{
+        "arg1_name": "value1",
+        "arg2_name": "value2"
+      }}
+    }}
+  ]
+}}"""
+
+FINALIZER_TEMPLATE = """
+The user's original request was: "{user_message}"
+An internal specialist agent was used to process this, and it produced the following result:
+"{tool_result}"
+
+Based on this result, formulate a final, comprehensive, and user-friendly answer.
+- If the result indicates success, confirm the action in a friendly way.
+- If the result is data, present it clearly and concisely.
+- If the result is an error, apologize and explain it simply.
+- If the result is a timeout, say the system took too long to respond and suggest trying again shortly. If it says a change may or may not have been applied, tell the user to check before repeating it.
+- Do not mention that you used a "tool", "function", or "agent". Speak naturally as a single, unified banking assistant.
+"""
+
+
+# ==============================================================================
+# === COMPACT ENCODINGS ========================================================
+# ==============================================================================
+
+def render_table(title, columns, rows):
+    """
+    Renders rows as a pipe-separated table under a one-line title. The column
+    names are written once instead of repeating "Key: value" on every row.
+    """
+    lines = [title, "|".join(columns)]
+    lines += ["|".join(str(value).replace("|", "/").replace("\n", " ") for value in row) for row in rows]
+    return "\n".join(lines)
+
+
+# ==============================================================================
+# === DETERMINISTIC SHRINKING ==================================================
+# ==============================================================================
+
+def share_budget(sizes, available):
+    """
+    Splits `available` tokens between parts of the given sizes: parts smaller
+    than an equal share keep their full size, and what they leave is shared
+    equally by the larger ones. Returns one limit per part, in order.
+    """
+    limits, pending = [None] * len(sizes), list(range(len(sizes)))
+    while pending:
+        share = max(0, available) // len(pending)
+        small = [i for i in pending if sizes[i] <= share]
+        if not small:
+            for i in pending:
+                limits[i] = share
+            break
+        for i in small:
+            limits[i] = sizes[i]
+            available -= sizes[i]
+            pending.remove(i)
+    return limits
+
+
+def _cut_to_tokens(text, max_tokens, from_end=False):
+    """Longest prefix (or suffix) of `text` that fits in `max_tokens`."""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        part = text[-mid:] if from_end else text[:mid]
+        if estimate_tokens(part) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[-low:] if from_end and low else text[:low]
+
+
+def truncate_text(text, max_tokens):
+    """Keeps the beginning and the end of `text`, marking what was dropped in between."""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    marker = f"\n[... {{}} of {total} tokens omitted ...]\n"
+    room = max(0, max_tokens - estimate_tokens(marker.format(total)))
+    head = _cut_to_tokens(text, room * 2 // 3)
+    tail = _cut_to_tokens(text[len(head):], room - estimate_tokens(head), from_end=True)
+    return head + marker.format(total - estimate_tokens(head) - estimate_tokens(tail)) + tail
+
+
+def truncate_rows(text, max_tokens):
+    """
+    For line-oriented text such as render_table output: keeps whole lines from
+    the top (title and header first) and says how many rows were left out.
+    Falls back to truncate_text when even the first line does not fit.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.split("\n")
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens - 8:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return truncate_text(text, max_tokens)
+    return "\n".join(kept + [f"[... {len(lines) - len(kept)} more rows omitted ...]"])
+
+
+def keep_recent_lines(text, max_tokens):
+    """For conversation history: drops the oldest lines first, then shortens the oldest one kept."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.split("\n")
+    kept, used = [], 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens - 8:
+            remaining = max_tokens - 8 - used
+            if remaining > 16:
+                kept.append(truncate_text(line, remaining))
+            break
+        kept.append(line)
+        used += cost
+    omitted = len(lines) - len(kept)
+    return "\n".join([f"[... {omitted} earlier messages omitted ...]"] + kept[::-1])
+
+
+def _shrink_block(text, max_tokens):
+    if "\n" in text and "|" in text:
+        return truncate_rows(text, max_tokens)
+    return truncate_text(text, max_tokens)
+
+
+def shrink_tool_output(text, max_tokens):
+    """
+    Tables lose rows from the bottom; other tool output keeps its beginning and
+    end. The sections of a multi-tool result (blank-line separated, see
+    tool_runner.format_tool_results) share the budget, so one large result
+    cannot crowd out the others.
+    """
+    sections = text.split("\n\n")
+    if len(sections) == 1:
+        return _shrink_block(text, max_tokens)
+    allocation = share_budget([estimate_tokens(section) for section in sections], max_tokens - len(sections))
+    return "\n\n".join(
+        _shrink_block(section, limit) if estimate_tokens(section) > limit else section
+        for section, limit in zip(sections, allocation)
+    )
+
+
+# ==============================================================================
+# === PROMPT BUILDER ===========================================================
+# ==============================================================================
+
+class PromptBuilder:
+    """
+    Builds one stage's prompt from a str.format template within the stage's
+    token budget:
+
+        prompt = (PromptBuilder("finalization", FINALIZER_TEMPLATE)
+                  .fixed(agent=...)
+                  .flexible("tool_result", tool_result, shrink_tool_output)
+                  .build(request_id))
+
+    When the flexible parts do not all fit, the space left after the template
+    and fixed parts is split between them with share_budget.
+    """
+
+    def __init__(self, stage, template, budget=None):
+        self.stage = stage
+        self.template = template
+        self.budget = budget or settings.PROMPT_TOKEN_BUDGETS.get(stage, settings.PROMPT_DEFAULT_TOKEN_BUDGET)
+        self.fixed_parts = {}
+        self.flexible_parts = []
+        self.usage = None
+
+    def fixed(self, **parts):
+        self.fixed_parts.update({name: str(value) for name, value in parts.items()})
+        return self
+
+    def flexible(self, name, text, shrink=truncate_text):
+        self.flexible_parts.append((name, str(text or ""), shrink))
+        return self
+
+    def build(self, request_id=None):
+        empty = {name: "" for name, _, _ in self.flexible_parts}
+        base = estimate_tokens(self.template.format(**self.fixed_parts, **empty))
+        sizes = [estimate_tokens(text) for _, text, _ in self.flexible_parts]
+        allocation = share_budget(sizes, self.budget - base)
+
+        parts, trimmed = {}, []
+        for (name, text, shrink), size, limit in zip(self.flexible_parts, sizes, allocation):
+            if size > limit:
+                text = shrink(text, limit)
+                trimmed.append(name)
+            parts[name] = text
+        prompt = self.template.format(**self.fixed_parts, **parts)
+
+        tokens = estimate_tokens(prompt)
+        self.usage = {"stage": self.stage, "budget": self.budget, "tokens": tokens, "trimmed": trimmed}
+        log = get_stage_logger(self.stage)
+        if base > self.budget:
+            log.warning(f"[{request_id}] The fixed part of the {self.stage} prompt ({base} tokens) exceeds its budget of {self.budget}.")
+        elif trimmed:
+            log.info(f"[{request_id}] Trimmed {', '.join(trimmed)} to fit the {self.stage} prompt budget of {self.budget} tokens.")
+        log.debug(f"[{request_id}] {self.stage} prompt: ~{tokens} tokens.", extra={"prompt_tokens": tokens, "stage": self.stage})
+        return prompt
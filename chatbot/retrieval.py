@@ -0,0 +1,175 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .models import ChatbotKnowledge
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from",
+    "how", "i", "in", "is", "it", "my", "of", "on", "or", "should", "that", "the",
+    "this", "to", "was", "what", "when", "where", "which", "with", "you", "your",
+}
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def chunk_text(text, max_words=None, overlap=None):
+    """
+    Splits a knowledge entry into passages. Paragraphs (blank-line separated)
+    are packed together up to `max_words`; a single paragraph longer than that
+    is cut into overlapping windows so no passage is unbounded.
+    """
+    max_words = max_words or settings.KNOWLEDGE_CHUNK_WORDS
+    overlap = settings.KNOWLEDGE_CHUNK_OVERLAP if overlap is None else overlap
+
+    passages = []
+    current = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(words) > max_words:
+            if current:
+                passages.append(" ".join(current))
+                current = []
+            step = max(1, max_words - overlap)
+            for start in range(0, len(words), step):
+                passages.append(" ".join(words[start:start + max_words]))
+                if start + max_words >= len(words):
+                    break
+            continue
+        if current and len(current) + len(words) > max_words:
+            passages.append(" ".join(current))
+            current = []
+        current.extend(words)
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 index over ChatbotKnowledge passages. Entries are
+    added and removed one at a time, so a save only re-chunks the entry that
+    changed; document frequencies and average length are kept up to date
+    incrementally.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._passages = {}             # (entry_id, n) -> (title, text, length)
+        self._entry_keys = {}           # entry_id -> [(entry_id, n), ...]
+        self._postings = defaultdict(dict)  # term -> {(entry_id, n): tf}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._passages)
+
+    def upsert_entry(self, entry_id, title, text):
+        with self._lock:
+            self.remove_entry(entry_id)
+            keys = []
+            for n, passage in enumerate(chunk_text(text)):
+                key = (entry_id, n)
+                term_counts = Counter(tokenize(passage))
+                length = sum(term_counts.values())
+                self._passages[key] = (title, passage, length)
+                self._total_length += length
+                for term, tf in term_counts.items():
+                    self._postings[term][key] = tf
+                keys.append(key)
+            self._entry_keys[entry_id] = keys
+
+    def remove_entry(self, entry_id):
+        with self._lock:
+            for key in self._entry_keys.pop(entry_id, []):
+                title, passage, length = self._passages.pop(key)
+                self._total_length -= length
+                for term in set(tokenize(passage)):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(key, None)
+                        if not postings:
+                            del self._postings[term]
+
+    def search(self, query, top_k=5, title=None):
+        """Returns up to `top_k` (score, title, passage) tuples, best first."""
+        with self._lock:
+            n_passages = len(self._passages)
+            if not n_passages:
+                return []
+            avg_length = self._total_length / n_passages
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_passages - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    length = self._passages[key][2]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            results = []
+            for key, score in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+                entry_title, passage, _ = self._passages[key]
+                if title is not None and entry_title != title:
+                    continue
+                results.append((score, entry_title, passage))
+                if len(results) == top_k:
+                    break
+            return results
+
+    def leading_passages(self, top_k=5, title=None):
+        """First passages in document order, used when a query matches nothing."""
+        with self._lock:
+            results = []
+            for key in sorted(self._passages):
+                entry_title, passage, _ = self._passages[key]
+                if title is None or entry_title == title:
+                    results.append((0.0, entry_title, passage))
+                    if len(results) == top_k:
+                        break
+            return results
+
+
+_index = None
+_index_stamps = {}   # entry_id -> updated_at of the version in _index
+_index_lock = threading.Lock()
+
+
+def get_knowledge_index():
+    """
+    Returns the process-wide BM25 index, synced with the database first.
+    Each call reads every entry's (id, updated_at) in one query and re-indexes
+    only the entries added, edited or deleted since the last call, by this
+    process or any other, so every worker searches current knowledge.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index()
+        stamps = dict(ChatbotKnowledge.objects.values_list("pk", "updated_at"))
+        removed = [entry_id for entry_id in _index_stamps if entry_id not in stamps]
+        changed = [entry_id for entry_id, stamp in stamps.items() if _index_stamps.get(entry_id) != stamp]
+        for entry_id in removed:
+            _index.remove_entry(entry_id)
+            del _index_stamps[entry_id]
+        if changed:
+            for entry in ChatbotKnowledge.objects.filter(pk__in=changed):
+                _index.upsert_entry(entry.pk, entry.title, entry.knowledge_text)
+                _index_stamps[entry.pk] = entry.updated_at
+        if removed or changed:
+            logger.info(f"Knowledge BM25 index synced: {len(changed)} entr(y/ies) indexed, {len(removed)} removed, {len(_index)} passages.")
+    return _index
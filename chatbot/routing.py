@@ -0,0 +1,106 @@
+import datetime
+import re
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ChatRoutingState
+
+# Agents whose follow-ups can skip orchestration. Generalist turns are cheap
+# and rarely followed by something that should stay with the Generalist.
+STICKY_AGENTS = ("AccountSpecialist", "SecurityOfficer", "FinancialAdvisor")
+
+# A message that names another specialist's domain is a new request, not a
+# follow-up, even if it is short.
+AGENT_KEYWORDS = {
+    "AccountSpecialist": ("balance", "transaction", "statement", "account number", "card detail", "spent", "spending"),
+    "SecurityOfficer": ("limit", "enable", "disable", "block", "international", "set it", "set the", "change it", "update"),
+    "FinancialAdvisor": ("invest", "advice", "advise", "plan", "saving", "mutual fund", "stock", "market", "loan"),
+}
+FOLLOW_UP_PREFIXES = (
+    "and ", "also ", "now ", "then ", "what about", "how about", "same ", "again", "instead",
+    "ok ", "okay ", "make it", "do the same", "the last", "show more", "more ",
+)
+# Words and phrases that point back at the previous answer. Bare "it", "this",
+# "that" and "more" are left out: "what is this charge?" or "tell me more about
+# loans" are as often new questions as follow-ups.
+REFERENCE_WORDS = {"those", "these", "them", "same", "instead", "previous"}
+REFERENCE_PHRASES = ("that one", "this one", "the last", "last one", "one more", "do it again", "show more")
+SMALL_TALK = {"hi", "hello", "hey", "thanks", "thank", "bye", "goodbye"}
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def get_session_cookie(request):
+    """
+    The chat session id from the signed cookie this server issued, or None.
+    Unlike a session_id in the request body, a client cannot invent one or
+    pick another session's, so per-session rate limits and routing state are
+    keyed on it.
+    """
+    return request.get_signed_cookie(settings.CHAT_SESSION_COOKIE, default=None, salt=settings.CHAT_SESSION_COOKIE)
+
+
+def set_session_cookie(response, session_id):
+    response.set_signed_cookie(
+        settings.CHAT_SESSION_COOKIE, session_id, salt=settings.CHAT_SESSION_COOKIE,
+        max_age=settings.ROUTING_STATE_TTL, httponly=True, samesite='Lax',
+    )
+
+
+# How often (seconds) this process deletes expired routing state rows.
+PRUNE_EVERY = 60
+_next_prune = 0.0
+
+
+def _expiry_cutoff():
+    return timezone.now() - datetime.timedelta(seconds=settings.ROUTING_STATE_TTL)
+
+
+def get_routing_state(session_id):
+    """Returns the last routing decision for a session, or None once it is older than ROUTING_STATE_TTL."""
+    if not session_id:
+        return None
+    row = ChatRoutingState.objects.filter(session_id=session_id, updated_at__gte=_expiry_cutoff()).first()
+    if row is None:
+        return None
+    return {"agent": row.agent, "tool": row.tool, "arguments": row.arguments}
+
+
+def save_routing_state(session_id, agent, tool=None, arguments=None):
+    global _next_prune
+    if not session_id:
+        return
+    ChatRoutingState.objects.update_or_create(
+        session_id=session_id, defaults={"agent": agent, "tool": tool, "arguments": arguments},
+    )
+    now = time.monotonic()
+    if now >= _next_prune:
+        _next_prune = now + PRUNE_EVERY
+        ChatRoutingState.objects.filter(updated_at__lt=_expiry_cutoff()).delete()
+
+
+def is_follow_up(message, state):
+    """
+    Local, model-free continuation check: True when `message` looks like a
+    follow-up to the session's last specialist turn ("and the last 20?",
+    "what about my credit card?", "now set it to 30,000"), so the orchestrator
+    can be skipped. It errs towards False, since a miss only costs the
+    orchestration call the turn would have made anyway.
+    """
+    if not settings.STICKY_ROUTING_ENABLED or not state or state.get("agent") not in STICKY_AGENTS:
+        return False
+    text = " ".join(message.lower().split())
+    words = _WORD_RE.findall(text)
+    if not words or len(words) > settings.FOLLOW_UP_MAX_WORDS or SMALL_TALK & set(words):
+        return False
+
+    mentioned = {agent for agent, keywords in AGENT_KEYWORDS.items() if any(k in text for k in keywords)}
+    if mentioned - {state["agent"]}:
+        return False
+    return (
+        text.startswith(FOLLOW_UP_PREFIXES)
+        or bool(REFERENCE_WORDS & set(words))
+        or any(phrase in text for phrase in REFERENCE_PHRASES)
+    )
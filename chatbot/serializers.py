@@ -7,48 +7,86 @@ from .models import (
     UserSecuritySettings, Instruction, DebitCardSettings, CreditCardSettings # Added new models
 )
 
-class UserProfileSerializer(serializers.ModelSerializer):
+def parse_field_list(value):
+    """Splits a comma-separated ?fields=/?exclude= value into a set of names."""
+    return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+
+def get_sparse_fieldset(request):
+    """
+    Returns the (fields, exclude) sets requested on a read, or (None, None) when
+    the request asks for the full representation. Writes always use every
+    field so validation is unaffected.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None, None
+    fields = parse_field_list(request.query_params.get('fields'))
+    exclude = parse_field_list(request.query_params.get('exclude'))
+    if not fields and not exclude:
+        return None, None
+    return fields or None, exclude
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer that honours ?fields=a,b and ?exclude=c on GET requests.
+    Only the top-level serializer of a view is affected; nested serializers
+    declared on a class are built without a request and keep all their fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, exclude = get_sparse_fieldset(self.context.get('request'))
+        if fields is None and not exclude:
+            return
+        for name in list(self.fields):
+            if (fields is not None and name not in fields) or name in (exclude or ()):
+                self.fields.pop(name)
+
+
+class UserProfileSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = UserProfile
         fields = '__all__'
 
-class InitialBotMessageSerializer(serializers.ModelSerializer):
+class InitialBotMessageSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = InitialBotMessage
         fields = '__all__'
 
-class AIModelSerializer(serializers.ModelSerializer):
+class AIModelSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = AIModel
         fields = '__all__'
 
-class SuggestedPromptSerializer(serializers.ModelSerializer):
+class SuggestedPromptSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = SuggestedPrompt
-        fields = '__all__'
+        # The precomputed turn is internal to the chat pipeline.
+        fields = ('id', 'text')
 
-class ChatbotKnowledgeSerializer(serializers.ModelSerializer):
+class ChatbotKnowledgeSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = ChatbotKnowledge
         fields = '__all__'
         read_only_fields = ('title',)
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
 
-class QuickStatSerializer(serializers.ModelSerializer):
+class QuickStatSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = QuickStat
         fields = '__all__'
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Account
         fields = '__all__'
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
@@ -60,38 +98,38 @@ class TransactionSerializer(serializers.ModelSerializer):
             logger.error(f"TransactionSerializer validation errors: {self.errors}")
         return valid
 
-class CreditCardSerializer(serializers.ModelSerializer):
+class CreditCardSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = CreditCard
         fields = '__all__'
 
-class DebitCardSettingsSerializer(serializers.ModelSerializer):
+class DebitCardSettingsSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = DebitCardSettings
         fields = '__all__'
 
-class CreditCardSettingsSerializer(serializers.ModelSerializer):
+class CreditCardSettingsSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = CreditCardSettings
         fields = '__all__'
 
-class ChatMessageSerializer(serializers.ModelSerializer):
+class ChatMessageSerializer(DynamicFieldsModelSerializer):
     ai_model = AIModelSerializer(read_only=True) # Nested serializer for AIModel
     class Meta:
         model = ChatMessage
         fields = '__all__'
 
-class UserNotificationSettingsSerializer(serializers.ModelSerializer):
+class UserNotificationSettingsSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = UserNotificationSettings
         fields = '__all__'
 
-class UserSecuritySettingsSerializer(serializers.ModelSerializer):
+class UserSecuritySettingsSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = UserSecuritySettings
         fields = '__all__'
 
-class InstructionSerializer(serializers.ModelSerializer):
+class InstructionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Instruction
         fields = '__all__'
\ No newline at end of file
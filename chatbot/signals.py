@@ -0,0 +1,52 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    ChatbotKnowledge, Account, Transaction, CreditCard,
+    DebitCardSettings, CreditCardSettings, InitialBotMessage,
+    AIModel, SuggestedPrompt, Instruction,
+)
+from .cache_utils import bump_model_version
+from .embeddings import schedule_embedding_sync
+from .precompute import clear_precomputed, forget_knowledge_answers, match_key, schedule_precompute
+
+
+# --- Re-sync the knowledge embedding index in the background after a change. The
+# --- BM25 index syncs itself from updated_at on every search (see chatbot/retrieval.py).
+
+@receiver(post_save, sender=ChatbotKnowledge)
+def reindex_knowledge_entry(sender, instance, **kwargs):
+    schedule_embedding_sync()
+    forget_knowledge_answers()
+
+
+@receiver(post_delete, sender=ChatbotKnowledge)
+def unindex_knowledge_entry(sender, instance, **kwargs):
+    schedule_embedding_sync()
+    forget_knowledge_answers()
+
+
+# --- Precompute suggested prompts when their text changes (see chatbot/precompute.py) ---
+
+@receiver(post_save, sender=SuggestedPrompt)
+def precompute_suggested_prompt(sender, instance, **kwargs):
+    if instance.match_key != match_key(instance.text):
+        # Drop the turn computed for the old text before computing the new one.
+        clear_precomputed(instance.pk)
+        schedule_precompute(instance.pk)
+
+
+# --- Bump each model's ModelVersion row on every change: the versions key cached
+# --- tool results and drive the ETag/Last-Modified headers of read-mostly APIs.
+
+TOOL_CACHE_MODELS = (Account, Transaction, CreditCard, DebitCardSettings, CreditCardSettings)
+CONDITIONAL_GET_MODELS = (InitialBotMessage, AIModel, SuggestedPrompt, Instruction)
+
+
+def bump_version_on_change(sender, **kwargs):
+    bump_model_version(sender)
+
+
+for model in TOOL_CACHE_MODELS + CONDITIONAL_GET_MODELS:
+    post_save.connect(bump_version_on_change, sender=model, dispatch_uid=f"bump-version-save-{model.__name__}")
+    post_delete.connect(bump_version_on_change, sender=model, dispatch_uid=f"bump-version-delete-{model.__name__}")
@@ -1,3 +1,1418 @@
-from django.test import TestCase
+import datetime
+import decimal
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+import zlib
+from contextlib import ExitStack
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from IDFC import views as site_views
+
+from . import embeddings
+from .cache_utils import bump_model_version
+from .coalescing import CoalesceWaitTimeout, SingleFlight, chat_flight, coalesce_key, run_chat_turn_coalesced
+from .middleware import CompressionMiddleware, FallbackGZipMiddleware, brotli
+from .models import (
+    AIModel, Account, ChatbotKnowledge, ChatMessage, ChatRoutingState, CreditCard, CreditCardSettings,
+    DebitCardSettings, ModelVersion, SuggestedPrompt, Transaction,
+)
+from .gemini_utils import (
+    CircuitBreaker, GeminiCallTimeout, ModelBackendUnavailable, bulkhead_wait, embed_content, generate_content,
+    model_backend_slot,
+)
+from .lazy_imports import HEAVY_MODULES
+from .logging_utils import PayloadFilter, StructuredQueueHandler, make_queue_handler, payload_extra
+from .retrieval import get_knowledge_index
+from .routing import get_routing_state, is_follow_up, save_routing_state
+from .pipeline import _run_batch_item, run_chat_turn
+from .precompute import find_precomputed
+from .throttling import TokenBucketStore
+from .tool_runner import (
+    ToolPlanError, _query_deadline, format_tool_results, parse_tool_plan, run_tool_plan, tool_latency,
+)
+from .renderers import ORJSONParser, ORJSONRenderer
+from .prompts import PromptBuilder, estimate_tokens, keep_recent_lines, render_table, shrink_tool_output
+from .serializers import TransactionSerializer
+from .transaction_search import search_transactions
+from .tools import get_card_details, get_user_accounts, list_recent_transactions, summarize_spending, update_card_transaction_limits
+from .views import BootstrapView
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: each call takes the next (delay, outcome) step."""
+
+    def __init__(self, name, steps):
+        self.model_name = name
+        self.steps = list(steps)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, request_options=None):
+        with self._lock:
+            delay, outcome = self.steps[min(self.calls, len(self.steps) - 1)]
+            self.calls += 1
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@override_settings(
+    GEMINI_STAGE_TIMEOUTS={"test": 0.3}, GEMINI_RETRY_BACKOFF_BASE=0.01, GEMINI_RETRY_BACKOFF_CAP=0.01,
+    GEMINI_MAX_RETRIES=2, GEMINI_HEDGE_DELAY=None,
+)
+class GeminiCallTests(SimpleTestCase):
+    """generate_content: one deadline per stage, shared by retries and hedges."""
+
+    def test_timeout_is_not_retried(self):
+        model = FakeModel("fake-timeout", [(1, "late")])
+        started = time.monotonic()
+        with self.assertRaises(GeminiCallTimeout):
+            generate_content(model, "hi", stage="test")
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(model.calls, 1)
+
+    def test_transient_errors_are_retried(self):
+        model = FakeModel("fake-retry", [(0, ConnectionError("reset")), (0, ConnectionError("reset")), (0, "ok")])
+        self.assertEqual(generate_content(model, "hi", stage="test"), "ok")
+        self.assertEqual(model.calls, 3)
+
+    def test_embed_content_has_a_deadline_and_a_breaker(self):
+        def slow_embed(model, content, task_type, request_options=None):
+            time.sleep(1)
+
+        genai = mock.Mock(embed_content=mock.Mock(side_effect=slow_embed))
+        with mock.patch("chatbot.gemini_utils.get_genai", return_value=genai), \
+                override_settings(GEMINI_BREAKER_FAILURE_THRESHOLD=1):
+            started = time.monotonic()
+            with self.assertRaises(GeminiCallTimeout):
+                embed_content("fake-embed", ["hi"], task_type="retrieval_query", stage="test")
+            self.assertLess(time.monotonic() - started, 0.6)
+            with self.assertRaises(ModelBackendUnavailable):
+                embed_content("fake-embed", ["hi"], task_type="retrieval_query", stage="test")
+        self.assertEqual(genai.embed_content.call_count, 1)
+
+    def test_hedge_wins_when_first_call_is_slow(self):
+        model = FakeModel("fake-hedge", [(1, "slow"), (0, "fast")])
+        with override_settings(GEMINI_HEDGE_DELAY=0.05):
+            self.assertEqual(generate_content(model, "hi", stage="test"), "fast")
+        self.assertEqual(model.calls, 2)
+
+
+class BackendProtectionTests(TestCase):
+    """Circuit breaker, bulkhead, and model validation in front of them."""
+
+    def test_breaker_opens_probes_and_closes(self):
+        breaker = CircuitBreaker("fake-breaker", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+        with self.assertRaises(ModelBackendUnavailable):
+            breaker.before_call()
+        time.sleep(0.06)
+        breaker.before_call()  # the half-open probe
+        with self.assertRaises(ModelBackendUnavailable):
+            breaker.before_call()  # only one probe at a time
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_bulkhead_sheds_when_model_slots_are_taken(self):
+        with ExitStack() as stack:
+            for _ in range(settings.GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL):
+                stack.enter_context(model_backend_slot("fake-bulkhead", wait=0))
+            with self.assertRaises(ModelBackendUnavailable):
+                with model_backend_slot("fake-bulkhead", wait=0):
+                    pass
+        with model_backend_slot("fake-bulkhead", wait=0):
+            pass  # released again
+
+    def test_generate_content_releases_its_slot(self):
+        model = FakeModel("fake-release", [(0, "ok")])
+        for _ in range(settings.GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL + 1):
+            generate_content(model, "hi", stage="test")
+        with ExitStack() as stack:
+            for _ in range(settings.GEMINI_MAX_CONCURRENT_CALLS_PER_MODEL):
+                stack.enter_context(model_backend_slot("fake-release", wait=0))
+
+    def test_unknown_model_is_rejected(self):
+        response = APIClient().post("/api/chat/", {"message": "hi", "model": "made-up-model"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_calls_cannot_take_every_slot(self):
+        with ExitStack() as stack:
+            with bulkhead_wait(0):
+                for i in range(settings.CHAT_BATCH_MAX_CONCURRENT_CALLS):
+                    stack.enter_context(model_backend_slot(f"fake-batch-{i}"))
+                with self.assertRaises(ModelBackendUnavailable):
+                    with model_backend_slot("fake-batch-extra"):
+                        pass
+            with model_backend_slot("fake-live", wait=0):
+                pass  # live chat still gets a slot
+        with bulkhead_wait(0), model_backend_slot("fake-batch-extra"):
+            pass  # released again
+
+
+@override_settings(GEMINI_API_KEY="test-key")
+class ChatBatchViewTests(TestCase):
+    """/api/chat/batch/ is for staff only."""
+
+    ITEMS = {"items": [{"message": "What is my balance?"}, {"message": "Block my card"}]}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        patcher = mock.patch("chatbot.views.run_chat_batch", side_effect=lambda items, model: [{"status": "ok"} for _ in items])
+        self.run_batch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_and_non_staff_are_refused(self):
+        self.assertEqual(self.client.post("/api/chat/batch/", self.ITEMS, format="json").status_code, 403)
+        self.client.force_authenticate(User.objects.create_user("customer", password="pw"))
+        self.assertEqual(self.client.post("/api/chat/batch/", self.ITEMS, format="json").status_code, 403)
+        self.run_batch.assert_not_called()
+
+    def test_staff_runs_the_batch(self):
+        self.client.force_authenticate(User.objects.create_user("ops", password="pw", is_staff=True))
+        response = self.client.post("/api/chat/batch/", self.ITEMS, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [{"status": "ok"}, {"status": "ok"}])
+
+    def test_items_are_validated_before_running(self):
+        self.client.force_authenticate(User.objects.create_user("ops", password="pw", is_staff=True))
+        for body in ({"items": []}, {"items": [{"message": " "}]}, {"items": [{"message": "hi", "model": "made-up"}]}):
+            self.assertEqual(self.client.post("/api/chat/batch/", body, format="json").status_code, 400)
+        self.run_batch.assert_not_called()
+
+
+class QueryBudgetTests(TestCase):
+    """
+    List endpoints and card tools must run a fixed number of queries no matter
+    how many rows exist. A failure here usually means a missing select_related.
+    """
+
+    ROWS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(cls.ROWS):
+            model = AIModel.objects.create(name=f"gemini-{i}", display_name=f"Gemini {i}")
+            ChatMessage.objects.create(session_id="s1", message_type="user", content=f"Message {i}", ai_model=model)
+            account = Account.objects.create(account_type="Savings Account", account_number=f"10000000{i}", balance=1000)
+            DebitCardSettings.objects.create(account=account, daily_limit=5000)
+            card = CreditCard.objects.create(
+                name=f"Card {i}", card_number=f"4000000000000{i}", outstanding_balance=100,
+                credit_limit=10000, due_date=datetime.date(2025, 1, 1), minimum_due=10, reward_points=0,
+            )
+            CreditCardSettings.objects.create(credit_card=card, daily_limit=5000)
+            Transaction.objects.create(
+                date=datetime.date(2025, 1, i + 1), merchant=f"Merchant {i}", amount=10,
+                category="Food", transaction_type="debit", method="UPI",
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assertListQueries(self, url, num):
+        with self.assertNumQueries(num):
+            response = self.client.get(url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), self.ROWS)
+
+    def test_chatmessages_list(self):
+        self.assertListQueries("/api/chatmessages/", 1)
+
+    def test_accounts_list(self):
+        self.assertListQueries("/api/accounts/", 1)
+
+    def test_transactions_list(self):
+        self.assertListQueries("/api/transactions/", 1)
+
+    def test_debitcardsettings_list(self):
+        self.assertListQueries("/api/debitcardsettings/", 1)
+
+    def test_creditcardsettings_list(self):
+        self.assertListQueries("/api/creditcardsettings/", 1)
+
+    def test_get_card_details_debit(self):
+        # One for the cache versions, one SELECT joining the card/account.
+        with self.assertNumQueries(2):
+            get_card_details("debit")
+
+    def test_update_card_transaction_limits(self):
+        for card_type in ("debit", "credit"):
+            # One SELECT joining the card/account, one UPDATE, one version bump.
+            with self.assertNumQueries(3):
+                result = update_card_transaction_limits(card_type, "daily_limit", 7500)
+            self.assertTrue(result.startswith("Success"), result)
+
+    def test_summarize_spending(self):
+        # The cache versions, one aggregate, one GROUP BY for the breakdown,
+        # one for top merchants.
+        with self.assertNumQueries(4):
+            result = summarize_spending(date_from="2025-01-01", date_to="2025-01-31")
+        self.assertIn(f"{self.ROWS} transactions, total ₹{10 * self.ROWS:,.2f}", result)
+        self.assertIn("By category: Food", result)
+
+    def test_bootstrap(self):
+        # One query per section, however many rows each section has.
+        with self.assertNumQueries(len(BootstrapView.SECTIONS)):
+            response = self.client.get("/api/bootstrap/", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["accounts"]), self.ROWS)
+
+
+class ToolCacheTests(TestCase):
+    """cached_tool serves repeat calls from the cache until a model it reads changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.account = Account.objects.create(account_type="Savings Account", account_number="1234567890", balance=1000)
+
+    def test_repeat_call_is_a_cache_hit(self):
+        # A miss reads the versions and the accounts; a hit only the versions.
+        with self.assertNumQueries(2):
+            first = get_user_accounts()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_accounts(), first)
+
+    def test_save_of_a_dependent_model_invalidates(self):
+        get_user_accounts()
+        self.account.balance = 2500
+        self.account.save()
+        with self.assertNumQueries(2):
+            self.assertIn("₹2,500.00", get_user_accounts())
+
+    def test_change_made_by_another_worker_invalidates(self):
+        get_user_accounts()
+        # Another worker saves the account: its signal bumps the shared row,
+        # and this worker's cache never hears about it.
+        Account.objects.filter(pk=self.account.pk).update(balance=2500)
+        ModelVersion.objects.filter(label="chatbot.account").update(version=F("version") + 1)
+        self.assertIn("₹2,500.00", get_user_accounts())
+
+    def test_queryset_update_needs_an_explicit_bump(self):
+        get_user_accounts()
+        Account.objects.filter(pk=self.account.pk).update(balance=2500)
+        self.assertIn("₹1,000.00", get_user_accounts())
+        bump_model_version(Account)
+        self.assertIn("₹2,500.00", get_user_accounts())
+
+
+class ConditionalGetTests(TestCase):
+    """Validators come from the database, so they do not depend on any worker's cache."""
+
+    def setUp(self):
+        self.client = APIClient()
+        AIModel.objects.create(name="gemini-1.5-flash", display_name="Flash")
+
+    def test_save_invalidates_etag_across_workers(self):
+        first = self.client.get("/api/aimodels/")
+        etag = first["ETag"]
+
+        # A different worker has an empty cache but must agree on the validator.
+        cache.clear()
+        self.assertEqual(self.client.get("/api/aimodels/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        AIModel.objects.create(name="gemini-1.5-pro", display_name="Pro")
+        cache.clear()
+        response = self.client.get("/api/aimodels/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_edit_and_delete_change_the_etag(self):
+        etag = self.client.get("/api/aimodels/")["ETag"]
+        model = AIModel.objects.get()
+        model.display_name = "Gemini Flash"
+        model.save()
+        edited = self.client.get("/api/aimodels/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(edited.status_code, 200)
+
+        model.delete()
+        self.assertEqual(self.client.get("/api/aimodels/", HTTP_IF_NONE_MATCH=edited["ETag"]).status_code, 200)
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields=/?exclude= trim both the response and the SELECT."""
+
+    def setUp(self):
+        self.client = APIClient()
+        ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+
+    def _get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        select = [q["sql"] for q in queries.captured_queries if "chatbot_chatbotknowledge" in q["sql"]]
+        self.assertEqual(len(select), 1)
+        return response.json(), select[0]
+
+    def test_fields_keeps_only_the_named_columns(self):
+        rows, sql = self._get("/api/chatbotknowledge/?fields=id,title")
+        self.assertEqual(set(rows[0]), {"id", "title"})
+        self.assertNotIn("knowledge_text", sql)
+
+    def test_exclude_drops_the_named_columns(self):
+        rows, sql = self._get("/api/chatbotknowledge/?exclude=knowledge_text")
+        self.assertEqual(set(rows[0]), {"id", "title", "updated_at"})
+        self.assertNotIn("knowledge_text", sql)
+
+    def test_full_representation_by_default(self):
+        rows, sql = self._get("/api/chatbotknowledge/")
+        self.assertIn("knowledge_text", rows[0])
+        self.assertIn("knowledge_text", sql)
+
+    def test_bootstrap_skip_drops_sections(self):
+        AIModel.objects.create(name="gemini-1.5-flash", display_name="Flash")
+        SuggestedPrompt.objects.create(text="What is my balance?")
+        payload = self.client.get("/api/bootstrap/?page=chat&skip=aimodels").json()
+        self.assertNotIn("aimodels", payload)
+        self.assertEqual(payload["suggestedprompts"][0]["text"], "What is my balance?")
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(SimpleTestCase):
+    """CompressionMiddleware negotiates the coding and only touches non-secret types."""
+
+    BODY = b'{"merchant": "Swiggy", "amount": "250.00"}' * 20
+
+    def _respond(self, accept_encoding, body=None, content_type="application/json"):
+        request = RequestFactory().get("/api/transactions/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        response = HttpResponse(self.BODY if body is None else body, content_type=content_type)
+        return CompressionMiddleware(lambda r: response)(request)
+
+    def test_prefers_brotli_then_gzip(self):
+        response = self._respond("gzip, deflate, br")
+        self.assertEqual(response["Content-Encoding"], "br" if brotli else "gzip")
+        response = self._respond("gzip, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.BODY)
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+
+    def test_no_acceptable_coding_leaves_body_alone(self):
+        for header in ("", "identity", "gzip;q=0"):
+            response = self._respond(header)
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertEqual(response.content, self.BODY)
+            self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_small_bodies_are_not_compressed_but_vary(self):
+        response = self._respond("gzip", body=b'{"ok": true}')
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_html_is_left_to_gzip_middleware(self):
+        html = b"<form><input name='csrfmiddlewaretoken' value='secret'></form>" * 20
+        response = self._respond("gzip, br", body=html, content_type="text/html; charset=utf-8")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertFalse(response.has_header("Vary"))
+
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip, br")
+        chain = FallbackGZipMiddleware(CompressionMiddleware(
+            lambda r: HttpResponse(html, content_type="text/html; charset=utf-8")
+        ))
+        response = chain(request)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), html)
+
+    @override_settings(COMPRESSION_MIN_SIZE=1024)
+    def test_json_under_the_threshold_stays_uncompressed_through_the_stack(self):
+        body = b'{"merchant": "Swiggy", "amount": "250.00"}' * 9
+        self.assertLess(len(body), settings.COMPRESSION_MIN_SIZE)
+        request = RequestFactory().get("/api/transactions/", HTTP_ACCEPT_ENCODING="gzip, br")
+        # The compression middleware exactly as configured, outermost first.
+        chain = lambda r: HttpResponse(body, content_type="application/json")
+        for path in reversed([m for m in settings.MIDDLEWARE if "gzip" in m.lower() or "compression" in m.lower()]):
+            chain = import_string(path)(chain)
+        response = chain(request)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, body)
+
+
+class QueueLoggingTests(SimpleTestCase):
+    """Queue handler, JSON formatter and payload filter, including in forked workers."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "test.log")
+        self.handler = make_queue_handler(self.filename, max_bytes=1024 * 1024, backup_count=1, console=False)
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger(f"chatbot.tests.queue.{self._testMethodName}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def read_entries(self):
+        with open(self.filename, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_reach_the_file_as_json_lines(self):
+        self.handler.addFilter(PayloadFilter(max_chars=50))
+        self.logger.info("balance for %s", "Savings", extra=payload_extra("r1"))
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("tool failed")
+        self.handler.close()  # stops the listener, flushing the queue
+
+        first, second = self.read_entries()
+        self.assertEqual(first["message"], "balance for Savings")
+        self.assertEqual((first["level"], first["logger"]), ("INFO", self.logger.name))
+        self.assertEqual((first["request_id"], first["payload"]), ("r1", True))
+        self.assertEqual(first["process"], os.getpid())
+        self.assertTrue(first["ts"].endswith("+00:00"))
+        self.assertEqual(second["level"], "ERROR")
+        self.assertIn("ValueError: boom", second["exc"])
+
+    def test_message_is_resolved_in_the_calling_thread(self):
+        self.handler.listener.stop()  # keep records on the queue
+        arguments = ["before"]
+        self.logger.info("value: %s", arguments)
+        arguments[0] = "after"
+        record = self.handler.queue.get_nowait()
+        self.assertEqual(record.msg, "value: ['before']")
+        self.assertIsNone(record.args)
+
+    def test_full_queue_drops_and_reports(self):
+        handler = StructuredQueueHandler(queue.Queue(maxsize=1), listener=None)
+        for message in ("kept", "dropped", "dropped too"):
+            handler.handle(logging.LogRecord("chatbot", logging.INFO, __file__, 1, message, None, None))
+        self.assertEqual(handler.dropped, 2)
+        handler.queue.get_nowait()
+        handler.handle(logging.LogRecord("chatbot", logging.INFO, __file__, 1, "next", None, None))
+        self.assertEqual(handler.queue.get_nowait().dropped_records, 2)
+        self.assertEqual(handler.dropped, 0)
+
+    def test_payload_filter_truncates_and_samples_per_request(self):
+        long_record = logging.LogRecord("chatbot", logging.INFO, __file__, 1, "%s", ("x" * 120,), None)
+        self.assertTrue(PayloadFilter(max_chars=100).filter(long_record))
+        self.assertEqual(long_record.getMessage(), "x" * 100 + "... [truncated 20 chars]")
+
+        sampler = PayloadFilter(sample_rate=0.5)
+
+        def kept(request_id, payload=True):
+            record = logging.LogRecord("chatbot", logging.INFO, __file__, 1, "payload", None, None)
+            record.request_id, record.payload = request_id, payload
+            return sampler.filter(record)
+
+        decisions = [kept(f"r{i}") for i in range(200)]
+        self.assertTrue(any(decisions) and not all(decisions))
+        self.assertEqual(decisions, [kept(f"r{i}") for i in range(200)])  # same request, same decision
+        self.assertTrue(all(kept(f"r{i}", payload=False) for i in range(20)))
+        self.assertFalse(PayloadFilter(sample_rate=0).filter(
+            logging.makeLogRecord({"msg": "payload", "payload": True, "request_id": "r1"})))
+
+    def test_fork_restarts_running_listeners_only(self):
+        stopped = make_queue_handler(self.filename + ".stopped", max_bytes=1024, backup_count=1, console=False)
+        self.addCleanup(stopped.close)
+        stopped.listener.stop()
+
+        pid = os.fork()
+        if pid == 0:
+            # Child: log through the inherited handler, then report whether
+            # the deliberately stopped listener stayed stopped.
+            code = 1
+            try:
+                self.logger.info("from the child")
+                self.handler.close()
+                code = 0 if stopped.listener._thread is None else 2
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual([e["message"] for e in self.read_entries()], ["from the child"])
+
+    def test_fork_hook_is_registered_once(self):
+        with mock.patch("os.register_at_fork") as register:
+            make_queue_handler(self.filename, max_bytes=1024, backup_count=1, console=False).close()
+        register.assert_not_called()
+
+
+class RendererParityTests(SimpleTestCase):
+    """ORJSONRenderer/ORJSONParser must produce exactly what DRF's JSON classes do."""
+
+    TRANSACTION = Transaction(
+        id=7, date=datetime.date(2025, 1, 31), merchant="Café ☕", amount=decimal.Decimal("1250.50"),
+        category="Food", transaction_type="debit", method="UPI",
+    )
+
+    def assertSameRendering(self, data):
+        expected = JSONRenderer().render(data)
+        self.assertEqual(ORJSONRenderer().render(data), expected)
+        return expected
+
+    def test_serializer_output_with_decimals_as_strings(self):
+        rendered = self.assertSameRendering(TransactionSerializer(self.TRANSACTION).data)
+        self.assertIn(b'"amount":"1250.50"', rendered)
+        self.assertIn(b'"date":"2025-01-31"', rendered)
+
+    def test_serializer_output_with_decimals_as_numbers(self):
+        with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, COERCE_DECIMAL_TO_STRING=False)):
+            rendered = self.assertSameRendering(TransactionSerializer(self.TRANSACTION).data)
+        self.assertIn(b'"amount":1250.5', rendered)
+
+    def test_values_drf_encodes_itself(self):
+        ist = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+        self.assertSameRendering({
+            "amounts": [decimal.Decimal("0.10"), decimal.Decimal("99999999.99")],
+            "date": datetime.date(2025, 1, 31),
+            "utc": datetime.datetime(2025, 1, 31, 10, 0, tzinfo=datetime.timezone.utc),
+            "ist": datetime.datetime(2025, 1, 31, 10, 0, 0, 123456, tzinfo=ist),
+            "naive": datetime.datetime(2025, 1, 31, 10, 0),
+            "time": datetime.time(9, 30, 1, 5),
+            "duration": datetime.timedelta(hours=1, seconds=3),
+            "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "label": gettext_lazy("Savings Account"),
+            "text": "₹ line\u2028separator",
+            1: [(1, 2), {"ok": True, "missing": None}],
+        })
+
+    def test_indented_output_uses_drf(self):
+        data = {"amount": "250.00"}
+        media_type = "application/json; indent=2"
+        self.assertEqual(ORJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+    def test_parser_matches_drf(self):
+        body = '{"message": "Block my card ₹", "amount": 250.5, "items": [1, null, true]}'.encode()
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for parser in (ORJSONParser(), JSONParser()):
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(b'{"message": '))
+
+
+@override_settings(DEBUG=False, STATIC_ASSET_MAX_AGE=3600)
+class StaticAssetTests(SimpleTestCase):
+    """The index shell is rendered once and revalidated; static files get caching headers."""
+
+    def setUp(self):
+        site_views._index_shell.cache_clear()
+        self.addCleanup(site_views._index_shell.cache_clear)
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        os.makedirs(os.path.join(root.name, "assets"))
+        for name, content in (
+            ("assets/index-1a2b3c.js", b"console.log('app');"),
+            ("assets/index-1a2b3c.js.br", b"brotli bytes"),
+            ("robots.txt", b"User-agent: *"),
+        ):
+            with open(os.path.join(root.name, name), "wb") as f:
+                f.write(content)
+        settings_override = override_settings(STATIC_ROOT=root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+    def test_index_shell_is_rendered_once_and_revalidates(self):
+        with mock.patch.object(site_views, "render_to_string", return_value="<html></html>") as render:
+            first = site_views.index(self.factory.get("/"))
+            again = site_views.index(self.factory.get("/", HTTP_IF_NONE_MATCH=first["ETag"]))
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("no-cache", first["Cache-Control"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+
+    def test_hashed_asset_is_immutable_and_precompressed(self):
+        request = self.factory.get("/static/assets/index-1a2b3c.js", HTTP_ACCEPT_ENCODING="gzip, br")
+        response = site_views.static_asset(request, "assets/index-1a2b3c.js")
+        self.assertEqual(b"".join(response.streaming_content), b"brotli bytes")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertIn("javascript", response["Content-Type"])
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=3600", response["Cache-Control"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertFalse(response.has_header("Content-Disposition"))
+        response.close()
+
+    def test_unhashed_file_revalidates(self):
+        response = site_views.static_asset(self.factory.get("/static/robots.txt"), "robots.txt")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("no-cache", response["Cache-Control"])
+        last_modified = response["Last-Modified"]
+        response.close()
+
+        again = site_views.static_asset(
+            self.factory.get("/static/robots.txt", HTTP_IF_MODIFIED_SINCE=last_modified), "robots.txt",
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_missing_files_are_404_and_traversal_is_refused(self):
+        for path in ("missing.js", "assets"):
+            with self.assertRaises(Http404):
+                site_views.static_asset(self.factory.get(f"/static/{path}"), path)
+        with self.assertRaises(SuspiciousFileOperation):
+            site_views.static_asset(self.factory.get("/static/../secret.txt"), "../secret.txt")
+
+
+class KnowledgeIndexTests(TestCase):
+    """The BM25 index follows the database, including changes made by other processes."""
+
+    def test_index_follows_saves_and_deletes(self):
+        entry = ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+        self.assertEqual(get_knowledge_index().search("blocked")[0][1], "Cards")
+
+        # Another worker edits the row; no signal reaches this process's index.
+        ChatbotKnowledge.objects.filter(pk=entry.pk).update(
+            knowledge_text="Fixed deposits renew automatically.", updated_at=entry.updated_at + datetime.timedelta(seconds=1),
+        )
+        index = get_knowledge_index()
+        self.assertEqual(index.search("blocked"), [])
+        self.assertEqual(index.search("deposits")[0][1], "Cards")
+
+        ChatbotKnowledge.objects.filter(pk=entry.pk).delete()
+        self.assertEqual(get_knowledge_index().search("deposits"), [])
+
+
+def fake_embed_texts(texts, task_type):
+    """Bag-of-words vectors: texts sharing words point the same way."""
+    np = embeddings.np
+    matrix = np.zeros((len(texts), 64), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            matrix[row, zlib.crc32(word.strip(".,?").encode()) % 64] += 1.0
+    return matrix
+
+
+class EmbeddingIndexTests(TestCase):
+    """Entries are embedded by sync_embeddings only; searches embed just the query."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(KNOWLEDGE_EMBEDDINGS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        mock.patch.object(embeddings, "_index", None).start()
+        self.embed = mock.patch.object(embeddings, "embed_texts", side_effect=fake_embed_texts).start()
+        self.embed_query = mock.patch.object(
+            embeddings, "embed_content",
+            side_effect=lambda model, texts, task_type: {"embedding": fake_embed_texts(texts, task_type).tolist()},
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_search_does_not_embed_entries(self):
+        ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+        self.assertEqual(embeddings.search_knowledge("blocked cards"), [])
+        self.embed.assert_not_called()
+
+        embeddings.sync_embeddings()
+        self.embed.reset_mock()
+        self.assertEqual(embeddings.search_knowledge("blocked cards")[0][1], "Cards")
+        self.embed.assert_not_called()
+        self.assertEqual(self.embed_query.call_count, 1)
+        self.assertEqual(self.embed_query.call_args.kwargs["task_type"], "retrieval_query")
+
+    def test_search_falls_back_to_keywords_when_gemini_fails(self):
+        ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+        ChatbotKnowledge.objects.create(title="Deposits", knowledge_text="Fixed deposits renew automatically.")
+        embeddings.sync_embeddings()
+        for error in (GeminiCallTimeout("slow"), ModelBackendUnavailable("open", retry_after=1)):
+            self.embed_query.side_effect = error
+            results = embeddings.search_knowledge("fixed deposits")
+            self.assertEqual([title for _, title, _ in results], ["Deposits"])
+
+    def test_sync_reembeds_only_changed_entries_and_drops_deleted(self):
+        cards = ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+        deposits = ChatbotKnowledge.objects.create(title="Deposits", knowledge_text="Fixed deposits renew automatically.")
+        embeddings.sync_embeddings()
+        self.assertEqual(self.embed.call_count, 1)
+
+        embeddings.sync_embeddings()
+        self.assertEqual(self.embed.call_count, 1)
+
+        cards.knowledge_text = "Cards can be replaced from the branch."
+        cards.save()
+        deposits.delete()
+        index = embeddings.sync_embeddings()
+        self.assertEqual(self.embed.call_count, 2)
+        self.assertEqual(set(index.hashes), {cards.pk})
+        self.assertEqual(set(index.keys[:, 0].tolist()), {cards.pk})
+
+    def test_index_is_one_file_shared_between_processes(self):
+        ChatbotKnowledge.objects.create(title="Cards", knowledge_text="Lost cards can be blocked in the app.")
+        saved = embeddings.sync_embeddings()
+        self.assertEqual(os.listdir(self.directory), [embeddings.KnowledgeEmbeddingIndex.INDEX_FILE])
+
+        other = embeddings.KnowledgeEmbeddingIndex(self.directory)
+        self.assertTrue(other.load())
+        self.assertEqual(other.hashes, saved.hashes)
+        self.assertEqual(other.keys.tolist(), saved.keys.tolist())
+
+        ChatbotKnowledge.objects.create(title="Deposits", knowledge_text="Fixed deposits renew automatically.")
+        embeddings.sync_embeddings()
+        other.reload_if_changed()
+        self.assertEqual(other.hashes, saved.hashes)
+        self.assertEqual(other.vectors.shape, saved.vectors.shape)
+
+
+class TransactionSearchTests(TestCase):
+    """The FTS5 index must follow inserts, updates and deletes, including bulk ones."""
+
+    def setUp(self):
+        self.client = APIClient()
+        Transaction.objects.bulk_create([
+            Transaction(date=datetime.date(2025, 1, d), merchant=merchant, amount=10,
+                        category=category, transaction_type="debit", method="UPI")
+            for d, merchant, category in (
+                (1, "Swiggy", "Food"), (2, "Swiggy Instamart", "Shopping"),
+                (3, "Amazon", "Shopping"), (4, "Indian Railways", "Travel"),
+            )
+        ])
+
+    def merchants(self, query):
+        return [t.merchant for t, _ in search_transactions(query)[1]]
+
+    def test_search_ranks_and_tracks_changes(self):
+        self.assertEqual(self.merchants("swiggy")[0], "Swiggy")
+        self.assertEqual(set(self.merchants("swig")), {"Swiggy", "Swiggy Instamart"})
+        self.assertEqual(self.merchants("shopping swiggy"), ["Swiggy Instamart"])
+        self.assertEqual(self.merchants('rail" OR *'), [])
+
+        Transaction.objects.filter(merchant="Amazon").update(merchant="Zomato")
+        self.assertEqual(self.merchants("amazon"), [])
+        self.assertEqual(self.merchants("zomato"), ["Zomato"])
+        Transaction.objects.filter(merchant__startswith="Swiggy").delete()
+        self.assertEqual(self.merchants("swiggy"), [])
+
+    def test_search_endpoint(self):
+        response = self.client.get("/api/transactions/search/?q=swiggy&limit=1", HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["count"], body["next_offset"], len(body["results"])), (2, 1, 1))
+        self.assertEqual(self.client.get("/api/transactions/search/").status_code, 400)
+
+
+class TransactionFilterTests(TestCase):
+    """List filters run in SQL, and keyset pages follow (date, id) order across equal dates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Transaction.objects.bulk_create([
+            Transaction(date=datetime.date(2025, 1, 1 + i // 3), merchant=f"Merchant {i}", amount=100 * i,
+                        category="Food" if i % 2 else "Travel", transaction_type="debit", method="UPI")
+            for i in range(9)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get(self, url):
+        return self.client.get(url, HTTP_ACCEPT="application/json")
+
+    def test_filters(self):
+        rows = self.get("/api/transactions/?category=food&date_from=2025-01-02&amount_max=500").json()
+        self.assertEqual(sorted(r["merchant"] for r in rows), ["Merchant 3", "Merchant 5"])
+        self.assertEqual(self.get("/api/transactions/?method=Cheque").status_code, 400)
+        self.assertIn("Merchant 7", list_recent_transactions(category="Food", date_from="2025-01-03"))
+
+    def test_keyset_pages(self):
+        seen, url = [], "/api/transactions/?page_size=2"
+        while url:
+            with self.assertNumQueries(1):
+                body = self.get(url).json()
+            seen += [r["id"] for r in body["results"]]
+            url = body["next"]
+        self.assertEqual(seen, list(Transaction.objects.order_by("-date", "-id").values_list("id", flat=True)))
+
+
+class PromptBudgetTests(SimpleTestCase):
+    """Prompts stay within their stage budget, and trimming is deterministic."""
+
+    TEMPLATE = "History:\n{history}\nResult:\n{result}\nAnswer for {agent}."
+
+    def build(self, history, result):
+        return (PromptBuilder("finalization", self.TEMPLATE, budget=300)
+                .fixed(agent="AccountSpecialist")
+                .flexible("history", history, keep_recent_lines)
+                .flexible("result", result, shrink_tool_output)
+                .build())
+
+    def test_oversized_parts_are_trimmed(self):
+        history = "\n".join(f"User: message {i} about my card limits" for i in range(200))
+        table = render_table("Transactions:", ("date", "merchant", "amount"), [("2025-01-01", f"Shop {i}", "10.00") for i in range(500)])
+        prompt = self.build(history, table)
+        self.assertLessEqual(estimate_tokens(prompt), 300)
+        self.assertIn("User: message 199", prompt)
+        self.assertIn("date|merchant|amount", prompt)
+        self.assertIn("more rows omitted", prompt)
+        self.assertEqual(prompt, self.build(history, table))
+
+    def test_small_parts_are_untouched(self):
+        self.assertEqual(self.build("User: hi", "ok"), "History:\nUser: hi\nResult:\nok\nAnswer for AccountSpecialist.")
+
+
+class RateLimitTests(SimpleTestCase):
+    """Chat endpoints draw from token buckets and report them in RateLimit-* headers."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_buckets_are_debited_together(self):
+        store = TokenBucketStore(os.path.join(self.tmp.name, "buckets.sqlite3"))
+        buckets = [("client", 2, 60), ("global", 100, 60)]
+        self.assertEqual([store.take(buckets, now=0)[0] for _ in range(3)], [True, True, False])
+        allowed, states = store.take([("global", 100, 60)], now=0)
+        self.assertEqual(states[0]["remaining"], 97)  # the refused request took nothing
+        self.assertTrue(store.take(buckets, now=30)[0])  # one token refilled after 30s
+
+    def test_batch_endpoint_is_throttled(self):
+        limits = {"text.client": "2/60", "text.global": "100/60"}
+        with override_settings(RATE_LIMIT_DB=os.path.join(self.tmp.name, "rl.sqlite3"), CHAT_RATE_LIMITS=limits):
+            client = APIClient()
+            client.force_authenticate(User(username="ops", is_staff=True))
+            codes = [client.post("/api/chat/batch/", {"items": []}, format="json") for _ in range(3)]
+        self.assertEqual([r.status_code for r in codes], [400, 400, 429])
+        self.assertEqual(codes[0]["RateLimit-Limit"], "2")
+        self.assertEqual(codes[1]["RateLimit-Remaining"], "0")
+        self.assertIn("Retry-After", codes[2])
+
+    def test_spoofed_forwarded_for_and_session_ids_share_one_bucket(self):
+        limits = {"text.client": "2/60", "text.session": "2/60"}
+        with override_settings(RATE_LIMIT_DB=os.path.join(self.tmp.name, "rl.sqlite3"), CHAT_RATE_LIMITS=limits):
+            client = APIClient()
+            codes = [
+                client.post(
+                    "/api/chat/", {"message": "", "session_id": f"s{i}"}, format="json",
+                    HTTP_X_FORWARDED_FOR=f"203.0.113.{i}", REMOTE_ADDR="198.51.100.7",
+                ).status_code
+                for i in range(3)
+            ]
+        self.assertEqual(codes, [400, 400, 429])
+
+    def test_idle_buckets_are_pruned(self):
+        store = TokenBucketStore(os.path.join(self.tmp.name, "buckets.sqlite3"))
+        store.take([("idle", 2, 60)], now=0)
+        store.take([("busy", 2, 60)], now=30)
+        store.take([("busy", 2, 60)], now=120)
+        keys = [row[0] for row in store._connection().execute("SELECT key FROM buckets")]
+        self.assertEqual(keys, ["busy"])
+
+
+class CoalescingTests(SimpleTestCase):
+    """Identical turns in flight at the same time share one run."""
+
+    def test_followers_share_the_leaders_result(self):
+        flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+        runs, results = [], []
+
+        def work():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return "answer"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do("k", work, timeout=5))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flight._calls["k"].followers < 3:
+            release.wait(0.01)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(results), [("answer", False)] + [("answer", True)] * 3)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_key_ignores_case_spacing_and_punctuation(self):
+        self.assertEqual(coalesce_key("What is my  balance?", "gemini-1.5-flash"),
+                         coalesce_key("what is my balance", "gemini-1.5-flash"))
+        self.assertNotEqual(coalesce_key("what is my balance", "gemini-1.5-flash"),
+                            coalesce_key("what is my balance", "gemini-1.5-pro"))
+
+
+class CoalescedTurnTests(SimpleTestCase):
+    """run_chat_turn_coalesced shares only answers that depend on neither account data nor actions."""
+
+    def setUp(self):
+        cache.clear()
+        # Routing state lives in the database; these turns are never follow-ups.
+        mock.patch("chatbot.coalescing.get_routing_state", return_value=None).start()
+        mock.patch("chatbot.coalescing.save_routing_state").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def run_two(self, result):
+        """Runs two identical turns at once; the first blocks until the second is waiting on it."""
+        release, calls = threading.Event(), []
+
+        def fake_turn(user_message, history, selected_model, request_id, **kwargs):
+            calls.append(request_id)
+            if len(calls) == 1:
+                release.wait(5)
+            return dict(result)
+
+        outcomes = {}
+        with mock.patch("chatbot.coalescing.run_chat_turn", side_effect=fake_turn), \
+                mock.patch("chatbot.coalescing.notify_shared_turn") as notify:
+            leader = threading.Thread(target=lambda: outcomes.setdefault("leader", run_chat_turn_coalesced(
+                "What is a fixed deposit?", "gemini-1.5-flash", "r1", session_id="s1")))
+            leader.start()
+            while not calls:
+                time.sleep(0.01)
+            follower = threading.Thread(target=lambda: outcomes.setdefault("follower", run_chat_turn_coalesced(
+                "what is a fixed deposit", "gemini-1.5-flash", "r2", session_id="s2")))
+            follower.start()
+            while not any(call.followers for call in chat_flight._calls.values()):
+                time.sleep(0.01)
+            release.set()
+            leader.join(5)
+            follower.join(5)
+        return outcomes, calls, notify
+
+    def result(self, agent, tools=()):
+        return {
+            "response": "answer", "agent": agent, "tool": None, "arguments": None,
+            "tool_calls": [{"tool_name": t, "arguments": {}, "ok": True, "status": "ok", "ms": 1.0} for t in tools],
+        }
+
+    def test_generalist_and_knowledge_answers_are_shared_and_notified(self):
+        for result in (self.result("Generalist"), self.result("FinancialAdvisor", ["search_knowledge_base"])):
+            with self.subTest(agent=result["agent"]):
+                outcomes, calls, notify = self.run_two(result)
+                self.assertEqual(calls, ["r1"])
+                self.assertFalse(outcomes["leader"]["coalesced"])
+                self.assertTrue(outcomes["follower"]["coalesced"])
+                notify.assert_called_once()
+                self.assertEqual(notify.call_args.args[2], "r2")
+
+    def test_unshareable_plan_is_handed_over_before_tools_run(self):
+        account_plan = {"agent": "AccountSpecialist", "tool_calls": [{"tool_name": "get_user_accounts", "arguments": {}}]}
+        follower_done, calls, outcomes = threading.Event(), [], {}
+
+        def fake_turn(user_message, history, selected_model, request_id, plan=None, on_plan=None, **kwargs):
+            calls.append((request_id, plan))
+            if on_plan:
+                while not any(call.followers for call in chat_flight._calls.values()):
+                    time.sleep(0.01)
+                on_plan(account_plan)
+                # The leader is still "running its tools" when the follower finishes.
+                outcomes["follower_finished_first"] = follower_done.wait(5)
+            return self.result("AccountSpecialist", ["get_user_accounts"])
+
+        with mock.patch("chatbot.coalescing.run_chat_turn", side_effect=fake_turn):
+            leader = threading.Thread(target=run_chat_turn_coalesced, args=("Show my accounts", "gemini-1.5-flash", "r1"))
+            leader.start()
+            while not calls:
+                time.sleep(0.01)
+
+            def follow():
+                outcomes["follower"] = run_chat_turn_coalesced("show my accounts", "gemini-1.5-flash", "r2")
+                follower_done.set()
+
+            follower = threading.Thread(target=follow)
+            follower.start()
+            leader.join(5)
+            follower.join(5)
+        self.assertTrue(outcomes["follower_finished_first"])
+        self.assertEqual(calls, [("r1", None), ("r2", account_plan)])
+        self.assertFalse(outcomes["follower"]["coalesced"])
+
+    def test_errors_of_the_shared_run_are_not_retried(self):
+        outcomes, calls = {}, []
+        started = threading.Event()
+
+        def failing_turn(user_message, history, selected_model, request_id, **kwargs):
+            calls.append(request_id)
+            started.set()
+            time.sleep(0.2)
+            raise TimeoutError("Gemini retries exhausted")
+
+        def run(name, request_id):
+            try:
+                run_chat_turn_coalesced("What is a fixed deposit?", "gemini-1.5-flash", request_id)
+            except TimeoutError as e:
+                outcomes[name] = e
+
+        with mock.patch("chatbot.coalescing.run_chat_turn", side_effect=failing_turn):
+            leader = threading.Thread(target=run, args=("leader", "r1"))
+            leader.start()
+            started.wait(5)
+            follower = threading.Thread(target=run, args=("follower", "r2"))
+            follower.start()
+            leader.join(5)
+            follower.join(5)
+        self.assertEqual(calls, ["r1"])
+        self.assertEqual(set(outcomes), {"leader", "follower"})
+
+    def test_giving_up_raises_coalesce_wait_timeout(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=flight.do, args=("k", lambda: release.wait(5)))
+        leader.start()
+        while not flight.in_flight():
+            time.sleep(0.01)
+        with self.assertRaises(CoalesceWaitTimeout):
+            flight.do("k", lambda: "unused", timeout=0.05)
+        release.set()
+        leader.join(5)
+
+    def test_account_and_action_answers_are_not_shared(self):
+        for tools in (["get_user_accounts"], ["update_card_transaction_limits"]):
+            with self.subTest(tools=tools):
+                outcomes, calls, notify = self.run_two(self.result("AccountSpecialist", tools))
+                self.assertEqual(sorted(calls), ["r1", "r2"])
+                self.assertFalse(outcomes["follower"]["coalesced"])
+                notify.assert_not_called()
+
+
+@override_settings(GEMINI_API_KEY="test-key")
+class ChatViewCoalescingTests(TestCase):
+    """ChatView coalesces first text turns only."""
+
+    RESULT = {"response": "answer", "agent": "Generalist", "tool": None, "arguments": None, "tool_calls": []}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.coalesced = mock.patch("chatbot.views.run_chat_turn_coalesced", return_value=dict(self.RESULT, coalesced=True)).start()
+        self.direct = mock.patch("chatbot.views.run_chat_turn", return_value=dict(self.RESULT)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_first_text_turn_is_coalesced(self):
+        response = self.client.post("/api/chat/", {"message": "What is a fixed deposit?"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["response"], "answer")
+        self.coalesced.assert_called_once()
+        self.direct.assert_not_called()
+
+    def test_turn_with_history_runs_alone(self):
+        history = [{"role": "user", "content": "hi"}, {"role": "bot", "content": "Hello!"}]
+        response = self.client.post("/api/chat/", {"message": "What is a fixed deposit?", "history": history}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.direct.assert_called_once()
+        self.coalesced.assert_not_called()
+
+
+@override_settings(GEMINI_API_KEY="test-key")
+class RoutingStateTests(TestCase):
+    """Sticky routing state is shared by all workers and keyed only on the signed cookie."""
+
+    RESULT = {"response": "answer", "agent": "AccountSpecialist", "tool": None, "arguments": None, "tool_calls": []}
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_state_survives_a_worker_switch_and_expires(self):
+        save_routing_state("s1", "AccountSpecialist", "list_recent_transactions", {"limit": 10})
+        cache.clear()  # another worker's cache
+        self.assertEqual(get_routing_state("s1"), {
+            "agent": "AccountSpecialist", "tool": "list_recent_transactions", "arguments": {"limit": 10},
+        })
+        ChatRoutingState.objects.update(updated_at=timezone.now() - datetime.timedelta(seconds=settings.ROUTING_STATE_TTL + 1))
+        self.assertIsNone(get_routing_state("s1"))
+
+    def test_session_comes_only_from_the_signed_cookie(self):
+        with mock.patch("chatbot.views.run_chat_turn_coalesced", return_value=dict(self.RESULT, coalesced=False)) as turn:
+            first = self.client.post("/api/chat/", {"message": "show my accounts", "session_id": "victim"}, format="json")
+            session_id = turn.call_args.kwargs["session_id"]
+            self.assertNotEqual(session_id, "victim")
+            self.assertEqual(first.json()["session_id"], session_id)
+
+            self.client.post("/api/chat/", {"message": "and the last 20?"}, format="json")
+            self.assertEqual(turn.call_args.kwargs["session_id"], session_id)
+
+            self.client.cookies[settings.CHAT_SESSION_COOKIE] = "victim"  # unsigned
+            self.client.post("/api/chat/", {"message": "and the last 20?"}, format="json")
+            self.assertNotIn(turn.call_args.kwargs["session_id"], ("victim", session_id))
+
+
+class FollowUpTests(SimpleTestCase):
+    """is_follow_up only keeps a turn with the last specialist when it clearly refers back."""
+
+    ACCOUNT = {"agent": "AccountSpecialist"}
+    SECURITY = {"agent": "SecurityOfficer"}
+
+    def test_follow_ups(self):
+        for message, state in (
+            ("and the last 20?", self.ACCOUNT),
+            ("what about my credit card?", self.ACCOUNT),
+            ("show those again", self.ACCOUNT),
+            ("same for last month", self.ACCOUNT),
+            ("only the Swiggy ones instead", self.ACCOUNT),
+            ("now set it to 30,000", self.SECURITY),
+            ("do it again for the other card", self.SECURITY),
+        ):
+            with self.subTest(message=message):
+                self.assertTrue(is_follow_up(message, state))
+
+    def test_new_questions(self):
+        for message, state in (
+            ("what is this charge?", self.ACCOUNT),
+            ("how does it work?", self.ACCOUNT),
+            ("is that a fee?", self.ACCOUNT),
+            ("tell me more about credit cards", self.ACCOUNT),
+            ("and should I invest in mutual funds?", self.ACCOUNT),
+            ("what is my balance?", self.SECURITY),
+            ("thanks, same time tomorrow", self.ACCOUNT),
+            ("and the last 20?", None),
+            ("and the last 20?", {"agent": "Generalist"}),
+        ):
+            with self.subTest(message=message):
+                self.assertFalse(is_follow_up(message, state))
+
+    @override_settings(STICKY_ROUTING_ENABLED=False)
+    def test_disabled(self):
+        self.assertFalse(is_follow_up("and the last 20?", self.ACCOUNT))
+
+
+class ToolPlanTests(TestCase):
+    """Sub-agent plans are validated, capped, and run with reads in parallel and writes in order."""
+
+    def test_single_call_and_plan_forms(self):
+        single = {"tool_name": "get_user_accounts"}
+        self.assertEqual(parse_tool_plan(single), [{"tool_name": "get_user_accounts", "arguments": {}}])
+        plan = {"tool_calls": [
+            {"tool_name": "get_user_accounts", "arguments": {}},
+            {"tool_name": "list_recent_transactions", "arguments": {"limit": 5}},
+        ]}
+        self.assertEqual([c["tool_name"] for c in parse_tool_plan(plan)], ["get_user_accounts", "list_recent_transactions"])
+
+    def test_malformed_plans_are_rejected(self):
+        for plan in (
+            "get_user_accounts",
+            {"tool_calls": []},
+            {"tool_calls": {"tool_name": "get_user_accounts"}},
+            {"tool_calls": [{"arguments": {}}]},
+            {"tool_calls": ["get_user_accounts"]},
+            {"tool_name": "list_recent_transactions", "arguments": [5]},
+        ):
+            with self.subTest(plan=plan), self.assertRaises(ToolPlanError):
+                parse_tool_plan(plan)
+
+    @override_settings(MAX_TOOL_CALLS_PER_TURN=2)
+    def test_plans_over_the_cap_are_rejected(self):
+        calls = [{"tool_name": "get_user_accounts"}] * 3
+        with self.assertRaisesMessage(ToolPlanError, "at most 2"):
+            parse_tool_plan({"tool_calls": calls})
+        self.assertEqual(len(parse_tool_plan({"tool_calls": calls[:2]})), 2)
+
+    def run_with_fake_tools(self, calls):
+        """Runs `calls` against fake tools that log (event, tool) pairs; read_* tools are read-only."""
+        events, lock = [], threading.Lock()
+
+        def make_tool(name):
+            def tool(delay=0.1):
+                with lock:
+                    events.append(("start", name))
+                time.sleep(delay)
+                with lock:
+                    events.append(("end", name))
+                return f"{name} done"
+            return tool
+
+        tools = {name: make_tool(name) for name in ("read_a", "read_b", "read_c", "write")}
+        with mock.patch("chatbot.tool_runner.get_tool_by_name", side_effect=tools.get), \
+                mock.patch("chatbot.tool_runner.READ_ONLY_TOOLS", {"read_a", "read_b", "read_c"}):
+            started = time.monotonic()
+            outcomes = run_tool_plan(calls, "test")
+        return outcomes, events, time.monotonic() - started
+
+    def test_reads_run_concurrently(self):
+        calls = [{"tool_name": name, "arguments": {"delay": 0.2}} for name in ("read_a", "read_b", "read_c")]
+        outcomes, events, elapsed = self.run_with_fake_tools(calls)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual([o["result"] for o in outcomes], ["read_a done", "read_b done", "read_c done"])
+        self.assertTrue(all(o["ok"] and o["status"] == "ok" for o in outcomes))
+
+    def test_writes_run_alone_and_in_plan_order(self):
+        calls = [{"tool_name": name, "arguments": {}} for name in ("read_a", "write", "read_b")]
+        outcomes, events, _ = self.run_with_fake_tools(calls)
+        self.assertEqual(events, [
+            ("start", "read_a"), ("end", "read_a"),
+            ("start", "write"), ("end", "write"),
+            ("start", "read_b"), ("end", "read_b"),
+        ])
+        self.assertEqual([o["tool_name"] for o in outcomes], ["read_a", "write", "read_b"])
+
+    def test_unknown_tool_does_not_stop_the_plan(self):
+        calls = [{"tool_name": "made_up", "arguments": {}}, {"tool_name": "read_a", "arguments": {}}]
+        outcomes, _, _ = self.run_with_fake_tools(calls)
+        self.assertEqual([o["status"] for o in outcomes], ["unknown", "ok"])
+        self.assertIn("no tool named 'made_up'", outcomes[0]["result"])
+
+    def test_format_tool_results(self):
+        one = [{"tool_name": "get_user_accounts", "arguments": {}, "result": "Accounts: none"}]
+        self.assertEqual(format_tool_results(one), "Accounts: none")
+        two = one + [{"tool_name": "list_recent_transactions", "arguments": {"limit": 5}, "result": "No transactions"}]
+        self.assertEqual(
+            format_tool_results(two),
+            "Result of get_user_accounts():\nAccounts: none\n\n"
+            "Result of list_recent_transactions(limit=5):\nNo transactions",
+        )
+
+
+@override_settings(TOOL_TIMEOUTS={"slow_read": 0.1, "slow_write": 0.1})
+class ToolTimeoutTests(TestCase):
+    """A tool that overruns its timeout is reported as such and its queries are interrupted."""
+
+    def run_slow(self, name):
+        def slow_tool():
+            time.sleep(0.4)
+            return "finished late"
+
+        with mock.patch("chatbot.tool_runner.get_tool_by_name", return_value=slow_tool), \
+                mock.patch("chatbot.tool_runner.READ_ONLY_TOOLS", {"slow_read"}):
+            started = time.monotonic()
+            [outcome] = run_tool_plan([{"tool_name": name, "arguments": {}}], "test")
+        self.assertLess(time.monotonic() - started, 0.3)
+        return outcome
+
+    def test_slow_read_times_out(self):
+        outcome = self.run_slow("slow_read")
+        self.assertEqual(outcome["status"], "timeout")
+        self.assertFalse(outcome["ok"])
+        self.assertEqual(outcome["timeout_s"], 0.1)
+        self.assertEqual(outcome["result"], "Timeout: 'slow_read' did not finish within 0.1 seconds.")
+        self.assertGreaterEqual(tool_latency.snapshot()["slow_read"]["timeouts"], 1)
+
+    def test_slow_write_warns_it_may_have_applied(self):
+        outcome = self.run_slow("slow_write")
+        self.assertEqual(outcome["status"], "timeout")
+        self.assertIn("may or may not have been applied", outcome["result"])
+
+    def test_query_deadline_interrupts_sqlite_queries(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("progress handler deadline is SQLite-only")
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+        started = time.monotonic()
+        with self.assertRaises(OperationalError), _query_deadline(0.1), connection.cursor() as cursor:
+            cursor.execute(endless)
+        self.assertLess(time.monotonic() - started, 2)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")  # the handler is removed again
+
+    def test_pool_threads_keep_their_connections(self):
+        closed = []
+        with mock.patch.object(type(connections[DEFAULT_DB_ALIAS]), "close", lambda wrapper: closed.append(wrapper)), \
+                mock.patch("chatbot.tool_runner.get_tool_by_name", return_value=lambda: Account.objects.count()), \
+                mock.patch("chatbot.tool_runner.READ_ONLY_TOOLS", {"count_read"}):
+            for _ in range(3):
+                [outcome] = run_tool_plan([{"tool_name": "count_read", "arguments": {}}], "test")
+                self.assertTrue(outcome["ok"], outcome)
+        # Healthy connections within CONN_MAX_AGE stay open for the next call.
+        self.assertEqual(closed, [])
+
+    def test_stats_are_staff_only(self):
+        self.run_slow("slow_read")
+        client = APIClient()
+        self.assertEqual(client.get("/api/tools/stats/").status_code, 403)
+        client.force_authenticate(User.objects.create_user("ops", password="pw", is_staff=True))
+        response = client.get("/api/tools/stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tools"]["slow_read"]["timeout_s"], 0.1)
+
+
+class PrecomputedPromptTests(TestCase):
+    """First turns matching a suggested prompt are served from its precomputed turn."""
+
+    def setUp(self):
+        cache.clear()
+        SuggestedPrompt.objects.create(
+            text="Hi there", match_key="hi there", precomputed_agent="Generalist",
+            precomputed_answer="Hello! How can I help?", precomputed_answer_model="gemini-2.5-pro",
+        )
+        SuggestedPrompt.objects.create(
+            text="Show my accounts", match_key="show my accounts", precomputed_agent="AccountSpecialist",
+            precomputed_plan=[{"tool_name": "get_user_accounts", "arguments": {}}],
+            precomputed_plan_date=datetime.date(2020, 1, 1),
+        )
+
+    def test_stored_answer_needs_no_model_call(self):
+        genai = mock.Mock()
+        genai.GenerativeModel.return_value.generate_content.side_effect = AssertionError("model called")
+        with mock.patch("chatbot.pipeline.get_genai", return_value=genai):
+            result = run_chat_turn("hi  there!", [], "gemini-2.5-pro", "test", notify=False)
+        self.assertTrue(result["precomputed"])
+        self.assertEqual(result["response"], "Hello! How can I help?")
+
+    def test_stale_plan_is_replanned_without_session_context(self):
+        save_routing_state("s1", "AccountSpecialist", "list_recent_transactions", {"limit": 50})
+        plan = '{"tool_calls": [{"tool_name": "get_user_accounts", "arguments": {}}]}'
+        with mock.patch("chatbot.pipeline._get_model"), \
+                mock.patch("chatbot.pipeline._plan_tools", return_value=plan) as plan_tools, \
+                mock.patch("chatbot.pipeline._finalize", return_value="Your accounts"):
+            result = run_chat_turn("show my accounts", [], "gemini-2.5-pro", "test", notify=False, session_id="s1")
+        self.assertEqual(result["response"], "Your accounts")
+        self.assertIsNone(plan_tools.call_args.args[3])  # routing_state
+        self.assertEqual(find_precomputed("show my accounts", "gemini-2.5-pro")["tool_calls"],
+                         [{"tool_name": "get_user_accounts", "arguments": {}}])
+
+    def test_batch_items_run_every_stage(self):
+        with mock.patch("chatbot.pipeline._get_model"), \
+                mock.patch("chatbot.pipeline._orchestrate", return_value="Generalist") as orchestrate, \
+                mock.patch("chatbot.pipeline._answer_directly", return_value="Hi from the model"):
+            entry = _run_batch_item({"message": "hi there"}, "gemini-2.5-pro", slot_wait=0)
+        self.assertEqual(entry["status"], "ok")
+        self.assertFalse(entry["precomputed"])
+        self.assertEqual(entry["response"], "Hi from the model")
+        orchestrate.assert_called_once()
+
+    def test_no_shortcuts_ignores_sticky_routing(self):
+        save_routing_state("s1", "AccountSpecialist", "list_recent_transactions", {"limit": 50})
+        with mock.patch("chatbot.pipeline._get_model"), \
+                mock.patch("chatbot.pipeline._orchestrate", return_value="Generalist") as orchestrate, \
+                mock.patch("chatbot.pipeline._answer_directly", return_value="Sure"):
+            result = run_chat_turn("and the last 20?", [], "gemini-2.5-pro", "test", notify=False,
+                                   session_id="s1", shortcuts=False)
+        self.assertFalse(result["sticky"])
+        orchestrate.assert_called_once()
+
+    def test_lookup(self):
+        self.assertIsNone(find_precomputed("hi there", "gemini-2.5-flash")["answer"])  # stored for another model
+        self.assertIsNone(find_precomputed("show my accounts", "gemini-2.5-pro")["tool_calls"])  # plan from another day
+        self.assertIsNone(find_precomputed("hi there, show my accounts", "gemini-2.5-pro"))
+
+
+class ImportTimeTests(SimpleTestCase):
+    """
+    Booting Django and loading the URLconf (what every worker and management
+    command does) must not import the heavy SDKs. Checked in a fresh
+    interpreter, since this test process has long imported them.
+    """
+
+    def test_startup_imports(self):
+        script = (
+            "import sys, django; django.setup(); import IDFC.urls; "
+            f"print('heavy:', *sorted(m for m in sys.modules if m.startswith({HEAVY_MODULES!r})))"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="IDFC.settings")
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        heavy = result.stdout.splitlines()[-1].split()[1:]
+        self.assertEqual(heavy, [], "Import these lazily via chatbot.lazy_imports")
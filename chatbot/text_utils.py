@@ -0,0 +1,8 @@
+"""Text helpers shared by modules that match chat messages against each other."""
+
+_PUNCTUATION = "?!.,;: "
+
+
+def normalize_message(message):
+    """Lowercases, collapses whitespace and strips surrounding punctuation."""
+    return " ".join(message.lower().split()).strip(_PUNCTUATION)
@@ -0,0 +1,198 @@
+"""
+Token-bucket rate limiting for the chat endpoints.
+
+Every chat request takes tokens from three buckets of its kind ("text" or
+"audio"): one for the client IP, one for the chat session and one shared by
+everyone. The client IP only comes from X-Forwarded-For when NUM_PROXIES says
+how many proxies to trust, and the session bucket is keyed on the signed
+session cookie this server issued, so neither can be rotated at will to
+drain the global bucket. A bucket holds up to `capacity` tokens and refills continuously at
+capacity/period per second, so clients can burst up to the capacity and then
+sustain the refill rate. The request goes through only if every bucket has
+enough tokens, and then all of them are debited together.
+
+Bucket state lives in a small SQLite file (RATE_LIMIT_DB) shared by every
+worker process on the host; each check is one short IMMEDIATE transaction.
+Rows of buckets that have been idle long enough to refill completely are
+deleted now and then, since a missing row already means a full bucket.
+For several hosts, point RATE_LIMIT_DB at shared storage or replace
+TokenBucketStore with a Redis-backed one. If the store cannot be used the
+request is let through and a warning logged: losing rate limiting for a moment
+is better than failing every chat request.
+
+Responses carry RateLimit-Limit/-Remaining/-Reset for the most constrained
+bucket, and 429 responses carry Retry-After.
+"""
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .routing import get_session_cookie
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(rate):
+    """'20/60' -> (capacity 20, refill 20 tokens per 60 seconds)."""
+    capacity, _, period = str(rate).partition("/")
+    return float(capacity), float(period or 60)
+
+
+class TokenBucketStore:
+    """Token buckets in a SQLite file, safe to share between threads and processes."""
+
+    def __init__(self, path, prune_every=60):
+        self.path = str(path)
+        self.prune_every = prune_every
+        self._local = threading.local()
+        # Longest bucket period seen by this process: a row idle for longer
+        # than that belongs to a full bucket and can be dropped.
+        self._max_period = 0.0
+        self._next_prune = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, buckets, cost=1, now=None):
+        """
+        Debits `cost` tokens from every (key, capacity, period) bucket if all of
+        them have enough, otherwise from none. Returns (allowed, states) with
+        one {"key", "limit", "remaining", "reset", "retry_after"} per bucket;
+        times are in seconds.
+        """
+        now = time.time() if now is None else now
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            states = []
+            for key, capacity, period in buckets:
+                row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", [key]).fetchone()
+                rate = capacity / period
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                # A request costing more than the capacity needs a full bucket
+                # rather than being refused forever.
+                charge = min(cost, capacity)
+                states.append({
+                    "key": key,
+                    "limit": int(capacity),
+                    "period": period,
+                    "tokens": tokens,
+                    "charge": charge,
+                    "retry_after": 0 if tokens >= charge else (charge - tokens) / rate,
+                    "rate": rate,
+                })
+            allowed = all(state["retry_after"] == 0 for state in states)
+            for state in states:
+                if allowed:
+                    state["tokens"] -= state["charge"]
+                connection.execute(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    [state["key"], state["tokens"], now],
+                )
+            self._max_period = max([self._max_period] + [period for _, _, period in buckets])
+            if now >= self._next_prune:
+                self._next_prune = now + self.prune_every
+                connection.execute("DELETE FROM buckets WHERE updated < ?", [now - self._max_period])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        for state in states:
+            state["remaining"] = max(0, math.floor(state["tokens"]))
+            del state["charge"]
+            # Seconds until the bucket is full again.
+            state["reset"] = math.ceil((state["limit"] - state.pop("tokens")) / state.pop("rate"))
+        return allowed, states
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_bucket_store():
+    path = str(settings.RATE_LIMIT_DB)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = TokenBucketStore(path)
+        return _stores[path]
+
+
+class ChatRateThrottle(BaseThrottle):
+    """
+    DRF throttle for the chat views. Limits come from CHAT_RATE_LIMITS, keyed
+    "<kind>.<scope>" with scope "client", "session" or "global". A view may
+    define get_throttle_cost(request) to charge more than one token (the batch
+    endpoint charges one per item).
+    """
+
+    SCOPES = ("client", "session", "global")
+
+    def _buckets(self, request, kind):
+        idents = {"client": self.get_ident(request), "session": get_session_cookie(request), "global": "all"}
+        buckets = []
+        for scope in self.SCOPES:
+            rate = settings.CHAT_RATE_LIMITS.get(f"{kind}.{scope}")
+            if rate and idents[scope]:
+                buckets.append((f"chat:{kind}:{scope}:{idents[scope]}", *parse_rate(rate)))
+        return buckets
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if not settings.RATE_LIMIT_ENABLED:
+            return True
+        kind = "audio" if "audio" in request.FILES else "text"
+        cost = view.get_throttle_cost(request) if hasattr(view, "get_throttle_cost") else 1
+        buckets = self._buckets(request, kind)
+        if not buckets:
+            return True
+        try:
+            allowed, states = get_bucket_store().take(buckets, cost=cost)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Rate limit store unavailable, letting the request through: {e}")
+            return True
+
+        # Report the bucket that will run out first.
+        tightest = max(states, key=lambda s: (s["retry_after"], -s["remaining"]))
+        request.rate_limit = tightest
+        if not allowed:
+            self.retry_after = tightest["retry_after"]
+            logger.warning(f"Rate limited {tightest['key']} ({kind}, cost {cost}); retry in {self.retry_after:.1f}s.")
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class RateLimitHeadersMixin:
+    """
+    Throttles with ChatRateThrottle and adds its RateLimit-* headers to the
+    response; DRF adds Retry-After when the request is refused with a 429.
+    """
+
+    throttle_classes = [ChatRateThrottle]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        state = getattr(request, "rate_limit", None)
+        if state is not None:
+            response["RateLimit-Limit"] = str(state["limit"])
+            response["RateLimit-Remaining"] = str(state["remaining"])
+            response["RateLimit-Reset"] = str(max(state["reset"], math.ceil(state["retry_after"])))
+            response["RateLimit-Policy"] = f"{state['limit']};w={int(state['period'])}"
+        return response
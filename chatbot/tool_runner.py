@@ -0,0 +1,249 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from .logging_utils import get_stage_logger, payload_extra
+from .tools import READ_ONLY_TOOLS, get_tool_by_name
+
+logger = logging.getLogger(__name__)
+
+# Shared by all requests in the process, so concurrent turns cannot multiply
+# the number of tool threads.
+_executor = ThreadPoolExecutor(max_workers=settings.TOOL_POOL_SIZE, thread_name_prefix="tool")
+
+# How many SQLite VM instructions run between deadline checks.
+SQLITE_PROGRESS_OPS = 10000
+
+
+class ToolPlanError(ValueError):
+    """Raised when a sub-agent reply does not contain a usable tool plan."""
+
+
+# ==============================================================================
+# === PER-TOOL LATENCY STATS ===================================================
+# ==============================================================================
+
+class ToolLatencyStats:
+    """
+    Per-tool latency distribution for this process: the most recent
+    `window` durations plus running counts of calls, errors and timeouts.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._tools = {}
+
+    def record(self, tool_name, ms, status):
+        with self._lock:
+            entry = self._tools.setdefault(
+                tool_name, {"samples": deque(maxlen=self.window), "calls": 0, "errors": 0, "timeouts": 0},
+            )
+            entry["samples"].append(ms)
+            entry["calls"] += 1
+            if status == "error":
+                entry["errors"] += 1
+            elif status == "timeout":
+                entry["timeouts"] += 1
+
+    def snapshot(self):
+        def percentile(ordered, p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+        with self._lock:
+            tools = {name: (sorted(e["samples"]), dict(e)) for name, e in self._tools.items()}
+        return {
+            name: {
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "timeouts": entry["timeouts"],
+                "timeout_s": get_tool_timeout(name),
+                "p50_ms": percentile(ordered, 0.50),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": ordered[-1],
+            }
+            for name, (ordered, entry) in tools.items() if ordered
+        }
+
+
+tool_latency = ToolLatencyStats()
+
+
+def get_tool_timeout(tool_name):
+    return settings.TOOL_TIMEOUTS.get(tool_name, settings.TOOL_DEFAULT_TIMEOUT)
+
+
+# ==============================================================================
+# === PLAN PARSING AND EXECUTION ===============================================
+# ==============================================================================
+
+def parse_tool_plan(plan):
+    """
+    Normalises a sub-agent reply into a list of {"tool_name", "arguments"}
+    calls. Accepts the plan form {"tool_calls": [...]} as well as the
+    single-call form {"tool_name": ..., "arguments": {...}}.
+    """
+    if not isinstance(plan, dict):
+        raise ToolPlanError("Sub-agent reply is not a JSON object.")
+    calls = plan["tool_calls"] if "tool_calls" in plan else [plan]
+    if not isinstance(calls, list) or not calls:
+        raise ToolPlanError("Sub-agent did not return a tool name.")
+    if len(calls) > settings.MAX_TOOL_CALLS_PER_TURN:
+        raise ToolPlanError(f"Sub-agent planned {len(calls)} tool calls; at most {settings.MAX_TOOL_CALLS_PER_TURN} are allowed.")
+
+    parsed = []
+    for call in calls:
+        if not isinstance(call, dict) or not call.get("tool_name"):
+            raise ToolPlanError("Sub-agent did not return a tool name.")
+        arguments = call.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            raise ToolPlanError(f"Arguments for '{call['tool_name']}' are not an object.")
+        parsed.append({"tool_name": call["tool_name"], "arguments": arguments})
+    return parsed
+
+
+@contextmanager
+def _query_deadline(timeout):
+    """
+    Makes the database abandon this thread's queries once `timeout` seconds
+    have passed, so a tool that overran its timeout stops holding a pool
+    thread and a connection soon after. SQLite checks the deadline from a
+    progress handler; Postgres uses statement_timeout.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor == "sqlite":
+        connection.ensure_connection()
+        deadline = time.monotonic() + timeout
+        connection.connection.set_progress_handler(lambda: int(time.monotonic() > deadline), SQLITE_PROGRESS_OPS)
+        try:
+            yield
+        finally:
+            if connection.connection is not None:
+                connection.connection.set_progress_handler(None, 0)
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", [int(timeout * 1000)])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET statement_timeout")
+    else:
+        yield
+
+
+def _execute(tool_function, arguments, timeout):
+    """Runs a tool on a pool thread; returns (result, perf_counter at completion)."""
+    try:
+        with _query_deadline(timeout):
+            return tool_function(**arguments), time.perf_counter()
+    finally:
+        # Each pool thread keeps its own persistent connection (CONN_MAX_AGE),
+        # as a request thread does; only close it once it is broken or too old.
+        close_old_connections()
+
+
+def _submit(call, request_id):
+    """Starts a call on the tool pool. Returns (call, future or None, timeout, started)."""
+    tool_function = get_tool_by_name(call["tool_name"])
+    timeout = get_tool_timeout(call["tool_name"])
+    started = time.perf_counter()
+    if tool_function is None:
+        return call, None, timeout, started
+    return call, _executor.submit(_execute, tool_function, call["arguments"], timeout), timeout, started
+
+
+def _collect(submitted, request_id):
+    call, future, timeout, started = submitted
+    outcome = dict(call, ok=False, status="ok")
+    if future is None:
+        logger.error(f"[{request_id}] Sub-agent chose an unknown tool: {call['tool_name']}")
+        outcome.update(status="unknown", ms=0.0, result=f"Error: there is no tool named '{call['tool_name']}'.")
+    else:
+        remaining = max(0.0, timeout - (time.perf_counter() - started))
+        finished = None
+        try:
+            result, finished = future.result(timeout=remaining)
+            outcome.update(ok=True, result=result)
+        except Exception as e:
+            # Past the deadline, an exception is the database interrupting the
+            # tool's query (see _query_deadline): that is a timeout too.
+            timed_out = isinstance(e, FutureTimeoutError) or time.perf_counter() - started >= timeout
+            if not timed_out:
+                logger.exception(f"[{request_id}] An unexpected error occurred while executing tool '{call['tool_name']}'.")
+                outcome.update(status="error", result=f"Error: '{call['tool_name']}' failed unexpectedly.")
+        else:
+            timed_out = False
+        if timed_out:
+            future.cancel()
+            logger.warning(f"[{request_id}] Tool '{call['tool_name']}' timed out after {timeout}s.")
+            may_have_applied = "" if call["tool_name"] in READ_ONLY_TOOLS else (
+                " The change may or may not have been applied; check its current state before retrying."
+            )
+            outcome.update(
+                status="timeout", timeout_s=timeout,
+                result=f"Timeout: '{call['tool_name']}' did not finish within {timeout:g} seconds.{may_have_applied}",
+            )
+
+        # Reads are collected in plan order; time each from its own completion.
+        outcome["ms"] = round(((finished or time.perf_counter()) - started) * 1000, 1)
+        tool_latency.record(call["tool_name"], outcome["ms"], outcome["status"])
+    get_stage_logger("tool").info(
+        f"[{request_id}] TOOL OUTPUT (RAW) {call['tool_name']}: '{outcome['result']}'",
+        extra=dict(payload_extra(request_id), tool=call["tool_name"], ms=outcome["ms"], status=outcome["status"]),
+    )
+    return outcome
+
+
+def run_tool_plan(calls, request_id):
+    """
+    Executes the calls of a tool plan and returns one outcome per call, in
+    plan order: the call plus `result` (the tool's return value, or an error
+    or timeout message), `ok`, `status` ("ok", "error", "timeout" or
+    "unknown") and `ms`.
+
+    Every call runs on the shared tool pool under its TOOL_TIMEOUTS limit, so
+    a stuck tool cannot hold the request thread. Consecutive read-only calls
+    run concurrently; any other tool runs alone, in the order the plan gives,
+    so reads after a write see its effect.
+    """
+    outcomes = []
+    pending_reads = []
+
+    def flush_reads():
+        submitted = [_submit(call, request_id) for call in pending_reads]
+        outcomes.extend(_collect(s, request_id) for s in submitted)
+        pending_reads.clear()
+
+    for call in calls:
+        if call["tool_name"] in READ_ONLY_TOOLS:
+            pending_reads.append(call)
+        else:
+            flush_reads()
+            outcomes.append(_collect(_submit(call, request_id), request_id))
+    flush_reads()
+    return outcomes
+
+
+def format_tool_results(outcomes):
+    """The finalizer's view of a plan: the bare result for one call, labelled sections for several."""
+    if len(outcomes) == 1:
+        return outcomes[0]["result"]
+    sections = []
+    for outcome in outcomes:
+        arguments = ", ".join(f"{k}={v!r}" for k, v in outcome["arguments"].items())
+        sections.append(f"Result of {outcome['tool_name']}({arguments}):\n{outcome['result']}")
+    return "\n\n".join(sections)
+
+
+def get_tool_stats():
+    """Latency/timeout stats for every tool called in this process."""
+    return {"process": os.getpid(), "tools": tool_latency.snapshot()}
@@ -1,6 +1,14 @@
 import json
 import inspect
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from .retrieval import get_knowledge_index
+from .embeddings import search_knowledge
+from .cache_utils import cached_tool
+from .transaction_search import search_transactions as find_transactions
+from .filters import filter_transactions
+from .prompts import render_table
 from .models import (
     Account,
     Transaction,
@@ -16,6 +24,7 @@ from .models import (
 
 # --- Category 1: Read-Only Data Retrieval Tools ---
 
+@cached_tool(Account)
 def get_user_accounts() -> str:
     """
     Use this tool to get a list of all bank accounts (Savings, Current, Loan account etc.)
@@ -32,25 +41,144 @@ def get_user_accounts() -> str:
         )
     return "Accounts: " + "; ".join(account_details)
 
-def list_recent_transactions(limit: int = 10) -> str:
+@cached_tool(Transaction)
+def list_recent_transactions(
+    limit: int = 10,
+    date_from: str = "",
+    date_to: str = "",
+    category: str = "",
+    method: str = "",
+    transaction_type: str = "",
+    amount_min: float = None,
+    amount_max: float = None,
+) -> str:
     """
     Use this tool to list the most recent transactions.
-    You can specify how many transactions to retrieve.
+    You can specify how many transactions to retrieve, and optionally filter them:
+    date_from/date_to (YYYY-MM-DD, inclusive), category (Food, Shopping, Travel,
+    Bills, Income), method (UPI, Card, Netbanking, NEFT, RTGS), transaction_type
+    (debit or credit) and amount_min/amount_max. Several categories or methods
+    can be given comma-separated, e.g. "Food,Travel".
     """
     try:
-        transactions = Transaction.objects.order_by('-date')[:limit]
+        transactions = filter_transactions(Transaction.objects.all(), {
+            "date_from": date_from, "date_to": date_to, "category": category, "method": method,
+            "transaction_type": transaction_type, "amount_min": amount_min, "amount_max": amount_max,
+        })
+        transactions = transactions.order_by('-date', '-id')[:limit]
         if not transactions:
-            return f"No recent transactions found for your account."
-
-        transaction_details = []
-        for t in transactions:
-            transaction_details.append(
-                f"Date: {t.date.strftime('%Y-%m-%d')}, Merchant: {t.merchant}, Amount: {t.transaction_type}₹{t.amount:,.2f}"
-            )
-        return f"Recent transactions for your account are: " + "; ".join(transaction_details)
+            return f"No recent transactions found for your account matching those filters."
+
+        return render_table(
+            "Recent transactions for your account (amounts in ₹):",
+            ("date", "merchant", "category", "type", "amount"),
+            [(t.date.strftime('%Y-%m-%d'), t.merchant, t.category, t.transaction_type, f"{t.amount:.2f}") for t in transactions],
+        )
     except Exception as e:
         return f"Error listing recent transactions: {e}"
 
+# Groupings summarize_spending accepts, and the expression each groups on.
+SPENDING_GROUPINGS = {
+    "category": F("category"),
+    "merchant": F("merchant"),
+    "method": F("method"),
+    "week": TruncWeek("date"),
+    "month": TruncMonth("date"),
+}
+PERIOD_LABELS = {
+    "week": lambda d: f"week of {d:%Y-%m-%d}",
+    "month": lambda d: f"{d:%b %Y}",
+}
+# At most this many weeks/months are listed, so long periods stay compact.
+MAX_PERIOD_BUCKETS = 13
+
+
+@cached_tool(Transaction)
+def summarize_spending(
+    date_from: str = "",
+    date_to: str = "",
+    group_by: str = "category",
+    top_n: int = 5,
+    category: str = "",
+    method: str = "",
+    transaction_type: str = "debit",
+) -> str:
+    """
+    Use this tool for questions about totals and patterns rather than individual
+    transactions, e.g. "where did my money go this quarter?", "how much did I spend
+    on food last month?" or "who are my top merchants?". It returns the count, total,
+    average, minimum and maximum amount for the period, totals grouped by group_by
+    (category, merchant, method, or the last 13 weeks or months), and the top_n merchants.
+    Filters: date_from/date_to (YYYY-MM-DD, inclusive), category, method and
+    transaction_type ("debit" for spending, the default; "credit" for income).
+    """
+    try:
+        if group_by not in SPENDING_GROUPINGS:
+            return f"Error summarizing spending: group_by must be one of {', '.join(SPENDING_GROUPINGS)}."
+        top_n = max(1, min(int(top_n), 20))
+        transactions = filter_transactions(Transaction.objects.order_by(), {
+            "date_from": date_from, "date_to": date_to, "category": category,
+            "method": method, "transaction_type": transaction_type,
+        })
+
+        # All numbers are computed in the database: one aggregate query plus
+        # one GROUP BY per breakdown, however many rows the period holds.
+        stats = transactions.aggregate(
+            count=Count("id"), total=Sum("amount"), avg=Avg("amount"), low=Min("amount"), high=Max("amount"),
+            first=Min("date"), last=Max("date"),
+        )
+        period = f"{date_from or stats['first'] or 'the start'} to {date_to or stats['last'] or 'today'}"
+        kind = f"{transaction_type} transactions" if transaction_type else "transactions"
+        if not stats["count"]:
+            return f"No {kind} found from {period}."
+        total = stats["total"]
+
+        def breakdown(key, limit=None):
+            rows = (transactions.annotate(key=SPENDING_GROUPINGS[key]).values("key")
+                    .annotate(total=Sum("amount"), count=Count("id")))
+            if key in PERIOD_LABELS:
+                # The most recent periods, listed in date order.
+                rows = reversed(rows.order_by("-key")[:MAX_PERIOD_BUCKETS])
+            else:
+                rows = rows.order_by("-total")[:limit]
+            parts = []
+            for row in rows:
+                label = PERIOD_LABELS[key](row["key"]) if key in PERIOD_LABELS else row["key"]
+                parts.append(f"{label} ₹{row['total']:,.2f} ({row['count']}, {row['total'] / total:.0%})")
+            return "; ".join(parts)
+
+        lines = [
+            f"Summary of {kind} from {period}: {stats['count']} transactions, total ₹{total:,.2f}, "
+            f"average ₹{stats['avg']:,.2f}, smallest ₹{stats['low']:,.2f}, largest ₹{stats['high']:,.2f}.",
+            f"By {group_by}: {breakdown(group_by, top_n)}",
+        ]
+        if group_by != "merchant":
+            lines.append(f"Top {top_n} merchants: {breakdown('merchant', top_n)}")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error summarizing spending: {e}"
+
+@cached_tool(Transaction)
+def search_transactions(query: str, limit: int = 10) -> str:
+    """
+    Use this tool to find transactions by merchant or category, e.g. "Swiggy",
+    "amazon" or "travel". Pass the merchant or category words as the query.
+    Returns the best matches first and how many transactions matched in total.
+    """
+    try:
+        total, matches = find_transactions(query, limit=limit)
+        if not matches:
+            return f"No transactions found matching '{query}'."
+
+        return render_table(
+            f"Found {total} transaction(s) matching '{query}', showing {len(matches)} (amounts in ₹):",
+            ("date", "merchant", "category", "type", "amount"),
+            [(t.date.strftime('%Y-%m-%d'), t.merchant, t.category, t.transaction_type, f"{t.amount:.2f}") for t, _ in matches],
+        )
+    except Exception as e:
+        return f"Error searching transactions: {e}"
+
+@cached_tool(CreditCard, DebitCardSettings, Account)
 def get_card_details(card_type: str) -> str:
     """
     Use this tool to get details for a credit or debit card.
@@ -68,7 +196,7 @@ def get_card_details(card_type: str) -> str:
             else:
                 return "You don't have a Credit card."
         elif card_type.lower() == 'debit':
-            settings = DebitCardSettings.objects.first()
+            settings = DebitCardSettings.objects.select_related('account').first()
             # CORRECTED: Check for the '.account' attribute which exists on the model
             if settings and hasattr(settings, 'account') and settings.account:
                  return (
@@ -99,14 +227,14 @@ def update_card_transaction_limits(card_type: str, limit_type: str, new_amount:
         card_number_last_4 = ""
 
         if card_type.lower() == 'credit':
-            card_settings = CreditCardSettings.objects.first()
+            card_settings = CreditCardSettings.objects.select_related('credit_card').first()
             # CORRECTED: Check for the actual attribute '.credit_card'
             if card_settings and hasattr(card_settings, 'credit_card'):
                 card_type_str = "Credit Card"
                 # ADDED: Get the last 4 digits for the response message
                 card_number_last_4 = str(card_settings.credit_card.card_number)[-4:]
         elif card_type.lower() == 'debit':
-            card_settings = DebitCardSettings.objects.first()
+            card_settings = DebitCardSettings.objects.select_related('account').first()
             # CORRECTED: Check for the actual attribute '.account'
             if card_settings and hasattr(card_settings, 'account'):
                 card_type_str = "Debit Card"
@@ -138,14 +266,14 @@ def toggle_international_transactions(card_type: str, enabled: bool) -> str:
         card_number_last_4 = ""
 
         if card_type.lower() == 'credit':
-            card_settings = CreditCardSettings.objects.first()
+            card_settings = CreditCardSettings.objects.select_related('credit_card').first()
             # CORRECTED: Check for the actual attribute '.credit_card'
             if card_settings and hasattr(card_settings, 'credit_card'):
                 card_type_str = "Credit Card"
                 # ADDED: Get the last 4 digits for the response message
                 card_number_last_4 = str(card_settings.credit_card.card_number)[-4:]
         elif card_type.lower() == 'debit':
-            card_settings = DebitCardSettings.objects.first()
+            card_settings = DebitCardSettings.objects.select_related('account').first()
             # CORRECTED: Check for the actual attribute '.account'
             if card_settings and hasattr(card_settings, 'account'):
                 card_type_str = "Debit Card"
@@ -171,25 +299,51 @@ def toggle_international_transactions(card_type: str, enabled: bool) -> str:
 
 # --- Category 3: Knowledge & Advice Tools ---
 
-def search_financial_playbook():
+PLAYBOOK_TITLE = "Finance Advisory Playbook"
+
+def search_financial_playbook(query: str = "") -> str:
     """
     Use this tool to offer financial advice or help user with financial planning.
     Always call this tool before giving any financial advice.
+    Pass the user's question as the query; only the most relevant playbook passages are returned.
     """
     try:
-        knowledge_entries = ChatbotKnowledge.objects.filter(title="Finance Advisory Playbook").distinct()
+        index = get_knowledge_index()
+        top_k = settings.KNOWLEDGE_SEARCH_TOP_K
+        passages = index.search(query, top_k=top_k, title=PLAYBOOK_TITLE)
+        if not passages:
+            passages = index.leading_passages(top_k=top_k, title=PLAYBOOK_TITLE)
 
-        if not knowledge_entries:
+        if not passages:
             return f"No relevant information found in my knowledge base."
 
         results = []
-        for entry in knowledge_entries:
-            results.append(f"Title: {entry.title}\nContent: {entry.knowledge_text}\n---")
+        for _, title, passage in passages:
+            results.append(f"Title: {title}\nContent: {passage}\n---")
         return "".join(results)
     except Exception as e:
         return f"Error searching financial playbook: {e}"
 
 
+def search_knowledge_base(query: str) -> str:
+    """
+    Use this tool to look up any topic in the bank's knowledge base (products, policies,
+    guidelines and the advisory playbook) by meaning rather than exact wording.
+    Pass the user's question as the query.
+    """
+    try:
+        passages = search_knowledge(query, top_k=settings.KNOWLEDGE_SEARCH_TOP_K)
+        if not passages:
+            return f"No relevant information found in my knowledge base."
+
+        results = []
+        for _, title, passage in passages:
+            results.append(f"Title: {title}\nContent: {passage}\n---")
+        return "".join(results)
+    except Exception as e:
+        return f"Error searching knowledge base: {e}"
+
+
 # ==============================================================================
 # === NEW: AGENT TOOLKIT DEFINITIONS ===========================================
 # ==============================================================================
@@ -198,6 +352,8 @@ def search_financial_playbook():
 ACCOUNT_SPECIALIST_TOOLS = {
     "get_user_accounts": get_user_accounts,
     "list_recent_transactions": list_recent_transactions,
+    "search_transactions": search_transactions,
+    "summarize_spending": summarize_spending,
     "get_card_details": get_card_details,
 }
 
@@ -208,8 +364,28 @@ SECURITY_OFFICER_TOOLS = {
 
 FINANCIAL_ADVISOR_TOOLS = {
     "search_financial_playbook": search_financial_playbook,
+    "search_knowledge_base": search_knowledge_base,
 }
 
+# Tools with no side effects. Several of these can run concurrently within one
+# turn; every other tool changes data and runs on its own, in plan order.
+READ_ONLY_TOOLS = frozenset({
+    "get_user_accounts",
+    "list_recent_transactions",
+    "search_transactions",
+    "summarize_spending",
+    "get_card_details",
+    "search_financial_playbook",
+    "search_knowledge_base",
+})
+
+# Tools whose output depends only on the knowledge base, not on account data,
+# so answers built from them can be precomputed (see chatbot/precompute.py).
+KNOWLEDGE_TOOLS = frozenset({
+    "search_financial_playbook",
+    "search_knowledge_base",
+})
+
 # A dictionary mapping agent names to their specific toolsets.
 AGENT_TOOLKITS = {
     "AccountSpecialist": ACCOUNT_SPECIALIST_TOOLS,
@@ -264,7 +440,8 @@ def get_tool_descriptions_for_agent(agent_name: str) -> str:
                 spec["parameters"]["required"].append(name)
         tool_specs.append(spec)
     
-    return json.dumps(tool_specs, indent=2)
+    # Compact separators: the specs go into every sub-agent prompt.
+    return json.dumps(tool_specs, separators=(",", ":"))
 
 def get_tool_by_name(name: str):
     """Returns the actual tool function object from its name string."""
@@ -0,0 +1,76 @@
+"""
+Merchant/category search over transactions.
+
+On SQLite this queries the chatbot_transaction_fts FTS5 index (migration 0019,
+kept in sync by triggers) and ranks matches with bm25, merchant weighted above
+category. Every query word is matched as a prefix, so "swig" finds Swiggy.
+Scoring every match is what makes very broad queries ("s", "shop") slow, so
+when more than TRANSACTION_SEARCH_RANK_LIMIT rows match they are returned
+most recently recorded (highest id) first instead, which the index can do
+without scoring the rest.
+Other databases fall back to a case-insensitive containment filter, newest
+first, with no rank.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Transaction
+
+FTS_TABLE = "chatbot_transaction_fts"
+# bm25() column weights: merchant, category.
+MERCHANT_WEIGHT, CATEGORY_WEIGHT = 10.0, 1.0
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def query_terms(query):
+    return _TERM_RE.findall((query or "").lower())
+
+
+def _fts_match(terms):
+    # Quoting each term keeps FTS5 operators and punctuation in user input
+    # from being parsed as query syntax.
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_transactions(query, limit=20, offset=0):
+    """
+    Returns (total, results) for transactions whose merchant or category
+    matches every word of `query`. `results` holds up to `limit` (transaction,
+    rank) pairs starting at `offset`, best match first (highest id first past
+    the rank limit); lower bm25 ranks are better, and rank is None on the fallback
+    path.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return 0, []
+    if connection.vendor != "sqlite":
+        return _search_orm(terms, limit, offset)
+
+    match = _fts_match(terms)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        total = cursor.fetchone()[0]
+        if not total or offset >= total:
+            return total, []
+        order = "rank, rowid DESC" if total <= settings.TRANSACTION_SEARCH_RANK_LIMIT else "rowid DESC"
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s ORDER BY {order} LIMIT %s OFFSET %s",
+            [MERCHANT_WEIGHT, CATEGORY_WEIGHT, match, limit, offset],
+        )
+        ranked = cursor.fetchall()
+
+    transactions = Transaction.objects.in_bulk([pk for pk, _ in ranked])
+    return total, [(transactions[pk], rank) for pk, rank in ranked if pk in transactions]
+
+
+def _search_orm(terms, limit, offset):
+    condition = Q()
+    for term in terms:
+        condition &= Q(merchant__icontains=term) | Q(category__icontains=term)
+    queryset = Transaction.objects.filter(condition).order_by('-date', '-id')
+    return queryset.count(), [(t, None) for t in queryset[offset:offset + limit]]
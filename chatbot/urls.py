@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    ChatView,
+    ChatView, ChatBatchView, ToolStatsView, BootstrapView,
     UserProfileViewSet, InitialBotMessageViewSet, AIModelViewSet, SuggestedPromptViewSet,
     ChatbotKnowledgeViewSet, NotificationViewSet, QuickStatViewSet, AccountViewSet,
     TransactionViewSet, CreditCardViewSet, ChatMessageViewSet, UserNotificationSettingsViewSet,
@@ -29,5 +29,8 @@ router.register(r'creditcardsettings', CreditCardSettingsViewSet)
 
 urlpatterns = [
     path('chat/', ChatView.as_view(), name='chat'),
+    path('chat/batch/', ChatBatchView.as_view(), name='chat_batch'),
+    path('tools/stats/', ToolStatsView.as_view(), name='tool_stats'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
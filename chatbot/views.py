@@ -5,7 +5,7 @@ from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework import status, viewsets, permissions
+from rest_framework import authentication, status, viewsets, permissions
 from django.conf import settings
 import logging
 import os
@@ -13,11 +13,29 @@ import json
 import uuid # Used for creating a unique request ID for tracing
 import time
 
-# --- NEW: Import for Google Gemini API ---
-import google.generativeai as genai
+# --- Google Gemini API (imported on first use, see lazy_imports) ---
+from .lazy_imports import get_genai
 
-# --- Import for Email Utility ---
-from .email_utils import send_chat_notification_email
+# --- Per-stage loggers and payload tagging for structured logs ---
+from .logging_utils import get_stage_logger, payload_extra
+
+# --- Timeout/retry/hedging wrapper for Gemini calls ---
+from .gemini_utils import (
+    generate_content, check_model_backend, normalize_model_name, GeminiCallTimeout, ModelBackendUnavailable,
+)
+
+# --- Orchestrator / sub-agent / finalizer pipeline, single turn and batch ---
+from .pipeline import run_chat_turn, run_chat_batch
+from .coalescing import run_chat_turn_coalesced
+
+# --- Token-bucket rate limits and RateLimit-* headers for the chat endpoints ---
+from .throttling import RateLimitHeadersMixin
+
+# --- Signed chat session cookie (routing state and per-session rate limits) ---
+from .routing import get_session_cookie, set_session_cookie
+
+# --- Per-tool timeouts and latency stats ---
+from .tool_runner import get_tool_stats
 
 # --- Model and Serializer Imports (Unchanged) ---
 from .models import (
@@ -33,27 +51,78 @@ from .serializers import (
     UserSecuritySettingsSerializer, InstructionSerializer, DebitCardSettingsSerializer, CreditCardSettingsSerializer
 )
 
-# --- Importing tools (now with new structure) ---
-from .tools import get_tool_descriptions_for_agent, get_tool_by_name
+# --- FTS5-backed merchant/category search over transactions ---
+from .transaction_search import search_transactions
+
+# --- Transaction list filters and opt-in keyset pagination ---
+from .filters import TransactionFilterBackend
+from .pagination import KeysetPagination
+
+# --- ETag / conditional GET and ?fields= column pruning for viewsets ---
+from .mixins import ConditionalGetMixin, SparseFieldsetMixin, conditional_get, make_etag
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CHAT_MODEL = 'gemini-1.5-flash'
+
+
+def is_known_model(model_name):
+    """
+    Only the default model and models listed in AIModel may be used. The
+    circuit breakers and bulkhead slots are kept per model name, so request
+    bodies must not be able to mint new ones.
+    """
+    if not isinstance(model_name, str):
+        return False
+    name = normalize_model_name(model_name)
+    return name == DEFAULT_CHAT_MODEL or AIModel.objects.filter(name=name).exists()
+
+
+def unknown_model_response(model_name):
+    return Response({"error": f"Unknown model '{model_name}'."}, status=status.HTTP_400_BAD_REQUEST)
+
 # ==============================================================================
 # === UPDATED CHATBOT VIEW WITH MULTI-AGENT ARCHITECTURE =======================
 # ==============================================================================
 
 @method_decorator(csrf_exempt, name='dispatch')
-class ChatView(APIView):
+class ChatView(RateLimitHeadersMixin, APIView):
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
     csrf_exempt = True
 
     def post(self, request, *args, **kwargs):
+        selected_model = request.data.get('model', DEFAULT_CHAT_MODEL)
+        if not is_known_model(selected_model):
+            return unknown_model_response(selected_model)
+        try:
+            # Shed the turn up front if the model's circuit is open. Bulkhead
+            # slots are taken around each Gemini call (see gemini_utils), so a
+            # saturated backend sheds the turn at its first call.
+            check_model_backend(selected_model)
+            # Turns without history may share an identical in-flight turn
+            # (see chatbot/coalescing.py).
+            coalesce = 'audio' not in request.FILES and not request.data.get('history')
+            return self._process_chat(request, coalesce=coalesce)
+        except ModelBackendUnavailable as e:
+            logger.warning(f"Shedding chat request for model '{selected_model}': {e}")
+            response = Response(
+                {"error": "The assistant is busy right now. Please try again in a few seconds."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+    def _process_chat(self, request, coalesce=False):
         request_id = uuid.uuid4()
         user_message = None
         history = []
-        selected_model = 'gemini-1.5-flash'
+        selected_model = DEFAULT_CHAT_MODEL
         original_user_input_type = None # New variable to track input type
+        # Routing state is kept per session, keyed only on the signed cookie set
+        # on the first response, so a client cannot read or overwrite another
+        # session's state by sending its id.
+        session_id = get_session_cookie(request) or str(uuid.uuid4())
 
         # --- Determine Input Type: Audio or Text (This part is unchanged) ---
         if 'audio' in request.FILES:
@@ -61,7 +130,7 @@ class ChatView(APIView):
             logger.info(f"======== [START AUDIO REQUEST: {request_id}] ========")
             audio_file = request.FILES['audio']
             history = json.loads(request.data.get('history', '[]'))
-            selected_model = request.data.get('model', 'gemini-1.5-flash')
+            selected_model = request.data.get('model', DEFAULT_CHAT_MODEL)
             logger.info(f"[{request_id}] Received audio file: {audio_file.name}")
 
             gemini_api_key = settings.GEMINI_API_KEY
@@ -69,6 +138,7 @@ class ChatView(APIView):
                 return Response({"error": "Gemini API key not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             try:
+                genai = get_genai()
                 genai.configure(api_key=gemini_api_key)
                 temp_dir = os.path.join(settings.BASE_DIR, 'temp_audio')
                 os.makedirs(temp_dir, exist_ok=True)
@@ -91,10 +161,12 @@ class ChatView(APIView):
 
                 model = genai.GenerativeModel(selected_model)
                 transcription_prompt = "Please transcribe this audio file. Only return the transcribed text."
-                transcription_response = model.generate_content([transcription_prompt, uploaded_file])
+                transcription_response = generate_content(model, [transcription_prompt, uploaded_file], stage="transcription", request_id=request_id)
                 user_message = transcription_response.text.strip()
-                logger.info(f"[{request_id}] Transcribed from audio: '{user_message}'")
+                get_stage_logger("transcription").info(f"[{request_id}] Transcribed from audio: '{user_message}'", extra=payload_extra(request_id))
 
+            except ModelBackendUnavailable:
+                raise
             except Exception as e:
                 logger.exception(f"[{request_id}] Error during audio processing.")
                 # Even if audio processing fails, we still want to send a notification
@@ -107,9 +179,9 @@ class ChatView(APIView):
             logger.info(f"======== [START TEXT REQUEST: {request_id}] ========")
             user_message = request.data.get('message')
             history = request.data.get('history', [])
-            selected_model = request.data.get('model', 'gemini-1.5-flash')
+            selected_model = request.data.get('model', DEFAULT_CHAT_MODEL)
 
-        logger.info(f"[{request_id}] User Message (after potential transcription): '{user_message}'")
+        get_stage_logger("request").info(f"[{request_id}] User Message (after potential transcription): '{user_message}'", extra=payload_extra(request_id))
 
         if not user_message:
             return Response({"error": "No message provided"}, status=status.HTTP_400_BAD_REQUEST)
@@ -120,193 +192,166 @@ class ChatView(APIView):
             return Response({"error": "Gemini API key not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         try:
-            # --- 1. Configure Gemini API ---
-            genai.configure(api_key=gemini_api_key)
-            model = genai.GenerativeModel(selected_model)
-
-            # --- 2. STEP 1: ORCHESTRATION ---
-            # The first LLM call decides which specialist agent to route the query to.
-            formatted_history = "\n".join([f"{msg.get('role', 'user').capitalize()}: {msg.get('content', '')}" for msg in history])
-
-            orchestrator_prompt = f"""
-You are the master request orchestrator for a digital bank. Your primary job is to analyze the user's query and route it to the correct specialist agent. Do not attempt to answer the user yourself.
-
-Here are the available specialist agents and their responsibilities:
-- **AccountSpecialist**: Use for any questions about retrieving data. This includes checking account balances, listing transactions, fetching account numbers, or getting details about credit/debit cards.
-- **SecurityOfficer**: Use for any requests that involve an action or a change to security settings. This includes updating transaction limits or enabling/disabling international transactions.
-- **FinancialAdvisor**: Use for any questions related to financial advice, planning, investment options, or market trends.
-- **Generalist**: Use for simple greetings, farewells, non-financial questions, or if the user's intent is unclear and doesn't fit any other specialist.
-
-**Conversation History:**
-{formatted_history}
-
-**User's Latest Message:**
-"{user_message}"
-
-Based on the user's latest message, which specialist agent is the most appropriate to handle the request?
-Respond with ONLY a JSON object in the following format. Do not add any other text.
-{{
-  "agent_name": "<name_of_the_chosen_agent>"
-}}
-"""
-            logger.info(f"[{request_id}] STEP 1: Performing orchestration call to select an agent...")
-            orchestrator_response = model.generate_content(orchestrator_prompt)
-
-            try:
-                decision_text = orchestrator_response.text.strip().replace("```json", "").replace("```", "")
-                decision_json = json.loads(decision_text)
-                chosen_agent = decision_json.get("agent_name")
-                logger.info(f"[{request_id}] Orchestrator selected agent: '{chosen_agent}'")
-            except (json.JSONDecodeError, AttributeError) as e:
-                logger.error(f"[{request_id}] Failed to parse orchestrator JSON response: {e}. Raw response: {orchestrator_response.text}")
-                # Fallback to a general response if orchestration fails
-                return Response({"response": "I'm having trouble understanding your request. Could you please rephrase it?"}, status=status.HTTP_200_OK)
-
-            bot_response = ""
-            tool_result = None
-            # Variables for email notification
-            main_agent_decision = None
-            sub_agent_used_for_email = None
-            tools_used_for_email = None
-            sub_agent_raw_response = None
-            final_bot_output = None
-
-            # --- 3. STEP 2: DELEGATION TO SUB-AGENT ---
-            if chosen_agent == "Generalist":
-                logger.info(f"[{request_id}] Delegating to Generalist for a direct answer.")
-                main_agent_decision = "Generalist"
-                generalist_prompt = f"""
-You are a friendly and helpful banking assistant. The user said: "{user_message}".
-Provide a direct, conversational response. Do not offer to perform any actions you can't do.
-If you don't know the answer, say so politely.
-"""
-                final_response = model.generate_content(generalist_prompt)
-                bot_response = final_response.text
-                final_bot_output = bot_response
-
-            elif chosen_agent in ["AccountSpecialist", "SecurityOfficer", "FinancialAdvisor"]:
-                logger.info(f"[{request_id}] Delegating to sub-agent: '{chosen_agent}'")
-                main_agent_decision = chosen_agent
-                sub_agent_used_for_email = chosen_agent
-                tool_descriptions = get_tool_descriptions_for_agent(chosen_agent)
-
-                sub_agent_prompt = f"""
-You are a specialist agent known as the '{chosen_agent}'. Your role is to handle specific user requests by using your available tools.
-Based on the user's message, decide which tool to call.
-
-**User's Message:**
-"{user_message}"
-
-**Your Available Tools:**
-{tool_descriptions}
-
-Respond with ONLY a JSON object indicating the tool to call and its arguments.
-If no tool is appropriate, respond with a JSON object containing an error.
-{{
-  "tool_name": "<name_of_the_tool_to_call>",
-  "arguments": {{
-    "arg1_name": "value1",
-    "arg2_name": "value2"
-  }}
-}}"""
-                logger.info(f"[{request_id}] STEP 2a: Sub-agent '{chosen_agent}' is deciding which tool to use...")
-                sub_agent_response = model.generate_content(sub_agent_prompt)
-                sub_agent_raw_response = sub_agent_response.text # Capture raw response
-
-                try:
-                    tool_call_text = sub_agent_response.text.strip().replace("```json", "").replace("```", "")
-                    tool_call_json = json.loads(tool_call_text)
-                    tool_name = tool_call_json.get("tool_name")
-                    arguments = tool_call_json.get("arguments", {})
-
-                    if not tool_name:
-                         raise ValueError("Sub-agent did not return a tool name.")
-
-                    tools_used_for_email = f"Tool: {tool_name}, Arguments: {arguments}" # Capture tool info
-
-                    logger.info(f"[{request_id}] Sub-agent '{chosen_agent}' decided to use tool '{tool_name}' with arguments: {arguments}")
-
-                    tool_function = get_tool_by_name(tool_name)
-                    if not tool_function:
-                        logger.error(f"[{request_id}] Sub-agent '{chosen_agent}' chose an unknown tool: {tool_name}")
-                        bot_response = "I'm sorry, I tried to perform an action but couldn't find the right internal capability."
-                        final_bot_output = bot_response
-                    else:
-                        tool_result = tool_function(**arguments)
-                        logger.info(f"[{request_id}] TOOL OUTPUT (RAW): '{tool_result}'")
-
-                except (json.JSONDecodeError, AttributeError, ValueError) as e:
-                    logger.error(f"[{request_id}] Sub-agent '{chosen_agent}' failed to produce a valid tool call or tool execution failed: {e}. Raw response: {sub_agent_response.text}")
-                    bot_response = "I'm sorry, I was unable to complete that action. This is demo so my actions are limited. However, I have the capability to perform this if given enough permissions. Until then Please try contacting customer support."
-                    final_bot_output = bot_response
-                except Exception as e:
-                    logger.exception(f"[{request_id}] An unexpected error occurred while executing tool '{tool_name}'.")
-                    bot_response = "An unexpected error occurred. Please contact support."
-                    final_bot_output = bot_response
-
+            if coalesce:
+                result = run_chat_turn_coalesced(user_message, selected_model, request_id, session_id=session_id)
             else:
-                logger.warning(f"[{request_id}] Orchestrator returned an unknown agent: '{chosen_agent}'")
-                main_agent_decision = "Unknown"
-                bot_response = "I'm not sure how to handle that request. Please try rephrasing."
-                final_bot_output = bot_response
-
-            # --- 4. STEP 3: FINALIZATION (if a tool was used) ---
-            if tool_result:
-                finalizer_prompt = f"""
-The user's original request was: "{user_message}"
-An internal specialist agent was used to process this, and it produced the following result:
-"{tool_result}"
-
-Based on this result, formulate a final, comprehensive, and user-friendly answer.
-- If the result indicates success, confirm the action in a friendly way.
-- If the result is data, present it clearly and concisely.
-- If the result is an error, apologize and explain it simply.
-- Do not mention that you used a "tool", "function", or "agent". Speak naturally as a single, unified banking assistant.
-"""
-                logger.info(f"[{request_id}] STEP 3: Performing finalization call to format the tool output...")
-                final_response = model.generate_content(finalizer_prompt)
-                bot_response = final_response.text
-                final_bot_output = bot_response # Update final output after finalization
-                logger.info(f"[{request_id}] FINALIZER RAW OUTPUT:\n{bot_response}")
-
-            # --- Send Email Notification ---
-            try:
-                email_user_input_query = user_message
-                if original_user_input_type == 'audio':
-                    if user_message and user_message != "Audio transcription failed.":
-                        email_user_input_query = f"Audio Input (transcribed: {user_message})"
-                    else:
-                        email_user_input_query = "Audio Input (transcription failed)"
-
-                send_chat_notification_email(
-                    user_input_query=email_user_input_query,
-                    main_agent_response=main_agent_decision,
-                    sub_agent_used=sub_agent_used_for_email,
-                    tools_used=tools_used_for_email,
-                    sub_agent_response=sub_agent_raw_response,
-                    final_output=final_bot_output,
-                    chat_history=formatted_history
+                result = run_chat_turn(
+                    user_message, history, selected_model, request_id,
+                    input_type=original_user_input_type, session_id=session_id,
                 )
-            except Exception as e:
-                logger.error(f"[{request_id}] Error sending email notification: {e}")
-
-            # --- 5. Return Final Response ---
-            logger.info(f"[{request_id}] FINAL RESPONSE to User: '{bot_response}'")
             logger.info(f"======== [END REQUEST: {request_id}] ========\n")
-            return Response({"response": bot_response}, status=status.HTTP_200_OK)
-
+            response = Response({"response": result["response"], "session_id": session_id}, status=status.HTTP_200_OK)
+            set_session_cookie(response, session_id)
+            return response
+
+        except ModelBackendUnavailable:
+            raise
+        except GeminiCallTimeout:
+            logger.exception(f"[{request_id}] Gemini did not respond in time for message: {user_message}")
+            error_message = "I'm sorry, this is taking longer than expected. Please try again in a moment."
+            return Response({"error": error_message}, status=status.HTTP_504_GATEWAY_TIMEOUT)
         except Exception as e:
             logger.exception(f"[{request_id}] A critical error occurred in ChatView for message: {user_message}")
             error_message = "I'm sorry, a critical error occurred. Our technical team has been notified."
             return Response({"error": error_message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatBatchView(RateLimitHeadersMixin, APIView):
+    """
+    Runs up to CHAT_BATCH_MAX_ITEMS chat turns concurrently, for offline
+    evaluation of routing and for pre-generating answers. Larger sets should
+    use `python manage.py chat_batch`, which has no item limit.
+
+    Body: {"model": "...", "items": [{"message": "...", "history": [...], "id": ...}, ...]}
+    Response: {"results": [...], "elapsed_ms": ...}, one result per item in
+    input order with the response, agent, tool, arguments, per-stage timings
+    and a status. No notification emails are sent.
+
+    Staff only (Django admin session or HTTP Basic), since one request can
+    run CHAT_BATCH_MAX_ITEMS model turns.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
+
+    def get_throttle_cost(self, request):
+        # Each item is a chat turn, so a batch draws one token per item.
+        items = request.data.get('items')
+        return max(1, len(items)) if isinstance(items, list) else 1
+
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('items')
+        selected_model = request.data.get('model', DEFAULT_CHAT_MODEL)
+        if not isinstance(items, list) or not items:
+            return Response({"error": "'items' must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.CHAT_BATCH_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {settings.CHAT_BATCH_MAX_ITEMS} items per request; use the chat_batch management command for larger sets."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not is_known_model(selected_model):
+            return unknown_model_response(selected_model)
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get('message'), str) or not item['message'].strip():
+                return Response({"error": f"Item {i} needs a non-empty 'message'."}, status=status.HTTP_400_BAD_REQUEST)
+            if item.get('model') and not is_known_model(item['model']):
+                return unknown_model_response(item['model'])
+            if not isinstance(item.get('history', []), list):
+                return Response({"error": f"Item {i} has a 'history' that is not a list."}, status=status.HTTP_400_BAD_REQUEST)
+        if not settings.GEMINI_API_KEY:
+            return Response({"error": "Gemini API key not configured."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        started = time.perf_counter()
+        results = run_chat_batch(items, selected_model)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Chat batch of {len(items)} item(s) finished in {elapsed_ms} ms.")
+        return Response({"results": results, "elapsed_ms": elapsed_ms}, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ToolStatsView(APIView):
+    """
+    Per-tool call counts, errors, timeouts, configured timeout and latency
+    percentiles (p50/p95/p99/max over the last 1000 calls). The numbers are
+    for the process that answers the request only. Staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [authentication.SessionAuthentication, authentication.BasicAuthentication]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_tool_stats())
+
+
+# ==============================================================================
+# === PAGE BOOTSTRAP ENDPOINT ==================================================
+# ==============================================================================
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BootstrapView(APIView):
+    """
+    Returns everything the dashboard or chat page needs in one response, keyed
+    by the same names as the individual endpoints. Each section costs exactly
+    one query.
+
+    Query parameters:
+    - page: 'dashboard', 'chat' or 'all' (default 'all').
+    - include / skip: comma-separated section names to add to or drop from the page's set.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    csrf_exempt = True
+
+    SECTIONS = {
+        'userprofiles': (lambda: UserProfile.objects.all(), UserProfileSerializer),
+        'notifications': (lambda: Notification.objects.all(), NotificationSerializer),
+        'quickstats': (lambda: QuickStat.objects.all(), QuickStatSerializer),
+        'accounts': (lambda: Account.objects.all(), AccountSerializer),
+        'transactions': (lambda: Transaction.objects.all(), TransactionSerializer),
+        'creditcards': (lambda: CreditCard.objects.all(), CreditCardSerializer),
+        'initialbotmessages': (lambda: InitialBotMessage.objects.all(), InitialBotMessageSerializer),
+        'aimodels': (lambda: AIModel.objects.all(), AIModelSerializer),
+        'suggestedprompts': (lambda: SuggestedPrompt.objects.all(), SuggestedPromptSerializer),
+    }
+    PAGES = {
+        'dashboard': ['userprofiles', 'notifications', 'quickstats', 'accounts', 'transactions', 'creditcards'],
+        'chat': ['initialbotmessages', 'aimodels', 'suggestedprompts'],
+    }
+
+    @staticmethod
+    def _parse_list(value):
+        return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+    def get(self, request, *args, **kwargs):
+        page = request.query_params.get('page', 'all')
+        if page == 'all':
+            sections = list(self.SECTIONS)
+        elif page in self.PAGES:
+            sections = list(self.PAGES[page])
+        else:
+            return Response({"error": f"Unknown page '{page}'. Use one of: all, {', '.join(self.PAGES)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        include = self._parse_list(request.query_params.get('include'))
+        skip = set(self._parse_list(request.query_params.get('skip')))
+        unknown = [name for name in list(include) + list(skip) if name not in self.SECTIONS]
+        if unknown:
+            return Response({"error": f"Unknown section(s): {', '.join(unknown)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        sections += [name for name in include if name not in sections]
+        payload = {}
+        for name in sections:
+            if name in skip:
+                continue
+            get_queryset, serializer_class = self.SECTIONS[name]
+            payload[name] = serializer_class(get_queryset(), many=True, context={'request': request}).data
+        return Response(payload)
+
+
 # ==============================================================================
 # === ALL OTHER VIEWSETS (UNCHANGED) ===========================================
 # ==============================================================================
 
 @method_decorator(csrf_exempt, name='dispatch')
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.AllowAny]
@@ -314,7 +359,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class InitialBotMessageViewSet(viewsets.ModelViewSet):
+class InitialBotMessageViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = InitialBotMessage.objects.all()
     serializer_class = InitialBotMessageSerializer
     permission_classes = [permissions.AllowAny]
@@ -322,7 +367,7 @@ class InitialBotMessageViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class AIModelViewSet(viewsets.ModelViewSet):
+class AIModelViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = AIModel.objects.all()
     serializer_class = AIModelSerializer
     permission_classes = [permissions.AllowAny]
@@ -330,7 +375,7 @@ class AIModelViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class SuggestedPromptViewSet(viewsets.ModelViewSet):
+class SuggestedPromptViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = SuggestedPrompt.objects.all()
     serializer_class = SuggestedPromptSerializer
     permission_classes = [permissions.AllowAny]
@@ -338,7 +383,7 @@ class SuggestedPromptViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class ChatbotKnowledgeViewSet(viewsets.ModelViewSet):
+class ChatbotKnowledgeViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = ChatbotKnowledge.objects.all()
     serializer_class = ChatbotKnowledgeSerializer
     permission_classes = [permissions.AllowAny]
@@ -346,7 +391,7 @@ class ChatbotKnowledgeViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.AllowAny]
@@ -354,7 +399,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class QuickStatViewSet(viewsets.ModelViewSet):
+class QuickStatViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = QuickStat.objects.all()
     serializer_class = QuickStatSerializer
     permission_classes = [permissions.AllowAny]
@@ -362,7 +407,7 @@ class QuickStatViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [permissions.AllowAny]
@@ -370,15 +415,54 @@ class AccountViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    """
+    List filters: ?date_from=&date_to=&amount_min=&amount_max=&category=&method=&transaction_type=
+    (see chatbot/filters.py). Add ?page_size= (and then ?cursor=) for keyset pages.
+    """
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
     csrf_exempt = True
+    filter_backends = [TransactionFilterBackend]
+    pagination_class = KeysetPagination
 
     @action(detail=False, methods=['get'])
     def choices(self, request):
+        # Choices only change with a deploy, so the ETag is derived from them directly.
+        etag = make_etag(
+            request.accepted_media_type,
+            Transaction.TRANSACTION_TYPES, Transaction.METHOD_CHOICES, Transaction.CATEGORY_CHOICES,
+        )
+        return conditional_get(request, etag, None, self._build_choices_response)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked merchant/category search: ?q=swiggy&limit=20&offset=0. Every word
+        of q must match (as a prefix). Results are best match first, each with
+        its `rank` (bm25, lower is better; null on databases without FTS5).
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "The 'q' query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', settings.TRANSACTION_SEARCH_PAGE_SIZE))
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({"error": "'limit' and 'offset' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.TRANSACTION_SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+
+        total, matches = search_transactions(query, limit=limit, offset=offset)
+        rows = self.get_serializer([t for t, _ in matches], many=True).data
+        for row, (_, rank) in zip(rows, matches):
+            row['rank'] = rank
+        next_offset = offset + limit if offset + limit < total else None
+        return Response({"count": total, "limit": limit, "offset": offset, "next_offset": next_offset, "results": rows})
+
+    def _build_choices_response(self):
         transaction_types = [{'value': choice[0], 'label': choice[1]} for choice in Transaction.TRANSACTION_TYPES]
         method_choices = [{'value': choice[0], 'label': choice[1]} for choice in Transaction.METHOD_CHOICES]
         category_choices = [{'value': choice[0], 'label': choice[1]} for choice in Transaction.CATEGORY_CHOICES]
@@ -389,7 +473,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
         })
 
 @method_decorator(csrf_exempt, name='dispatch')
-class CreditCardViewSet(viewsets.ModelViewSet):
+class CreditCardViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = CreditCard.objects.all()
     serializer_class = CreditCardSerializer
     permission_classes = [permissions.AllowAny]
@@ -397,7 +481,7 @@ class CreditCardViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class DebitCardSettingsViewSet(viewsets.ModelViewSet):
+class DebitCardSettingsViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = DebitCardSettings.objects.all()
     serializer_class = DebitCardSettingsSerializer
     permission_classes = [permissions.AllowAny]
@@ -405,7 +489,7 @@ class DebitCardSettingsViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class CreditCardSettingsViewSet(viewsets.ModelViewSet):
+class CreditCardSettingsViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = CreditCardSettings.objects.all()
     serializer_class = CreditCardSettingsSerializer
     permission_classes = [permissions.AllowAny]
@@ -413,15 +497,15 @@ class CreditCardSettingsViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class ChatMessageViewSet(viewsets.ModelViewSet):
-    queryset = ChatMessage.objects.all()
+class ChatMessageViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = ChatMessage.objects.select_related('ai_model') # ai_model is serialized nested
     serializer_class = ChatMessageSerializer
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class UserNotificationSettingsViewSet(viewsets.ModelViewSet):
+class UserNotificationSettingsViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = UserNotificationSettings.objects.all()
     serializer_class = UserNotificationSettingsSerializer
     permission_classes = [permissions.AllowAny]
@@ -429,7 +513,7 @@ class UserNotificationSettingsViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class UserSecuritySettingsViewSet(viewsets.ModelViewSet):
+class UserSecuritySettingsViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = UserSecuritySettings.objects.all()
     serializer_class = UserSecuritySettingsSerializer
     permission_classes = [permissions.AllowAny]
@@ -437,7 +521,7 @@ class UserSecuritySettingsViewSet(viewsets.ModelViewSet):
     csrf_exempt = True
 
 @method_decorator(csrf_exempt, name='dispatch')
-class InstructionViewSet(viewsets.ModelViewSet):
+class InstructionViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Instruction.objects.all()
     serializer_class = InstructionSerializer
     permission_classes = [permissions.AllowAny]